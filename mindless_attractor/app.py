@@ -1,16 +1,24 @@
-from flask import Flask, render_template, jsonify, request, Response, url_for
+from flask import Flask, render_template, jsonify, request, Response, url_for, send_file
 from flask_socketio import SocketIO
 from datetime import datetime  # Add this import
-import cv2
 import threading
-import base64
 import numpy as np
 import socket
-from controller import AttentionController
+from controller import AttentionController, serve_in_thread
+from pipeline import InferencePipeline
+from shm_pipeline import SharedMemoryPipeline
+from mjpeg_hub import MJPEGBroadcastHub
+from serialization import NumpyEncoder, to_json_serializable
+from status_channel import StatusChannel
+from session_manager import SessionManager, SessionLimitError, SessionBusyError, SessionUnavailableError
+from jobs import JobManager, MultipartUpload, JobLimitError, UploadTooLargeError, DiskQuotaError
+from session_store import SessionStore, default_root
+from frame_source import CameraSource, source_factory_from_env
+from scheduler import AdaptiveRate
+import metrics
 import logging
-from queue import Queue
+from queue import Queue, Empty, Full
 import asyncio
-from pydub import AudioSegment
 import wave
 import tempfile
 import os
@@ -23,6 +31,9 @@ import signal
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CAMERA_READ_SECONDS = metrics.histogram('camera_read_seconds', 'cv2.VideoCapture.read time')
+CAMERA_READ_FAILURES = metrics.counter('camera_read_failures_total', 'Failed camera reads')
+
 def find_free_port(start_port=5000, max_port=5020):
     """找到一个可用的端口"""
     for port in range(start_port, max_port):
@@ -36,51 +47,54 @@ def find_free_port(start_port=5000, max_port=5020):
     raise OSError("Could not find a free port")
 
 class CameraManager:
-    def __init__(self):
+    """摄像头采集，帧写入预分配的环形缓冲区
+
+    每帧带有单调递增的帧序号（0 表示尚无帧）。读取方拿到的是环形缓冲区中
+    槽位的只读视图而不是拷贝；一个视图在之后 ring_size - 2 帧内保持有效，
+    可用 is_frame_valid(seq) 判断读取方是否已经落后太多。
+
+    帧源由 source_factory 创建（默认本地摄像头），也可以是录制回放，见 frame_source。
+    """
+    def __init__(self, ring_size=8, frame_shape=(480, 640, 3), source_factory=None):
         self.active = False
         self.cap = None
+        self.source_factory = source_factory or CameraSource
         self.frame_queue = Queue(maxsize=10)
         self.lock = threading.Lock()
         self.get_frame_lock = threading.Lock()
-        self.frame = None
+        self.frame_cond = threading.Condition(self.get_frame_lock)
+        self.ring_size = max(3, ring_size)
+        self.ring = np.zeros((self.ring_size,) + tuple(frame_shape), dtype=np.uint8)
+        self.frame_times = np.zeros(self.ring_size, dtype=np.float64)  # 各槽位的采集时间
+        self.frame_indices = np.full(self.ring_size, -1, dtype=np.int64)  # 各槽位在回放录制中的位置
+        self.frame_seq = 0  # 最新一帧的序号
+        self.frame_listener = None  # 共享内存推理模式下，每帧写完后以帧序号回调
+        self.frame_invalidator = None  # 共享内存推理模式下，开始写入槽位前以帧序号回调
+        self.generation = 0  # 每次 start 递增，旧的采集线程据此退出
         self.camera_initialized = False
 
     def start(self):
         with self.lock:
             if not self.active:
                 try:
-                    # 尝试多个摄像头索引
-                    for camera_index in [0, 1]:
-                        self.cap = cv2.VideoCapture(camera_index)
-                        if self.cap.isOpened():
-                            break
-                    
+                    self.cap = self.source_factory()
                     if not self.cap.isOpened():
                         logger.error("Failed to open camera")
                         return False
                     
-                    # Set camera properties with error checking
-                    props = {
-                        cv2.CAP_PROP_FRAME_WIDTH: 640,
-                        cv2.CAP_PROP_FRAME_HEIGHT: 480,
-                        cv2.CAP_PROP_FPS: 30,
-                        cv2.CAP_PROP_BUFFERSIZE: 1
-                    }
-                    
-                    for prop, value in props.items():
-                        if not self.cap.set(prop, value):
-                            logger.warning(f"Failed to set camera property {prop}")
-                    
                     # 确保可以读取帧
-                    ret, _ = self.cap.read()
+                    ret, probe = self.cap.read()
                     if not ret:
                         logger.error("Cannot read frame from camera")
                         self.cap.release()
                         return False
+                    if probe.shape != self.ring.shape[1:]:
+                        self._resize_ring(probe.shape)
                     
                     self.active = True
                     self.camera_initialized = True
-                    threading.Thread(target=self._capture_loop, daemon=True).start()
+                    self.generation += 1
+                    threading.Thread(target=self._capture_loop, args=(self.generation,), daemon=True).start()
                     return True
                 except Exception as e:
                     logger.error(f"Camera initialization error: {e}")
@@ -95,15 +109,51 @@ class CameraManager:
             if self.cap:
                 self.cap.release()
                 self.cap = None
+        with self.frame_cond:
+            self.frame_cond.notify_all()
+
+    def _resize_ring(self, frame_shape):
+        """摄像头实际分辨率与预设不同时重新分配环形缓冲区"""
+        logger.info(f"Reallocating frame ring for shape {frame_shape}")
+        with self.frame_cond:
+            if self.frame_listener is not None:
+                logger.warning("Frame shape changed, detaching shared frame ring")
+                self.frame_listener = self.frame_invalidator = None
+                self.frame_times = self.frame_times.copy()
+            self.ring = np.zeros((self.ring_size,) + tuple(frame_shape), dtype=np.uint8)
+
+    def attach_shared_ring(self, frames, times, listener, invalidator=None):
+        """改为直接采集到外部（共享内存）缓冲区，形状须与当前环形缓冲区一致
+
+        invalidator(seq) 在写入槽位之前调用，listener(seq) 在写完之后调用（seqlock）。
+        """
+        with self.frame_cond:
+            np.copyto(frames, self.ring)
+            np.copyto(times, self.frame_times)
+            self.ring = frames
+            self.frame_times = times
+            self.frame_listener = listener
+            self.frame_invalidator = invalidator
+
+    def detach_shared_ring(self):
+        with self.frame_cond:
+            if self.frame_listener is None:
+                return
+            self.frame_listener = self.frame_invalidator = None
+            self.ring = self.ring.copy()
+            self.frame_times = self.frame_times.copy()
 
-    def _capture_loop(self):
+    def _capture_loop(self, generation):
         retry_count = 0
-        while self.active:
+        while self.active and generation == self.generation:
             try:
+                if getattr(self.cap, 'finished', False):
+                    logger.info("Frame source finished")
+                    break
                 if not self.cap or not self.cap.isOpened():
                     if retry_count < 3:
                         logger.warning("Attempting to reopen camera...")
-                        self.cap = cv2.VideoCapture(0)
+                        self.cap = self.source_factory()
                         retry_count += 1
                         time.sleep(1)
                         continue
@@ -111,67 +161,176 @@ class CameraManager:
                         logger.error("Failed to reopen camera after 3 attempts")
                         break
 
-                ret, frame = self.cap.read()
+                # 直接解码到下一个槽位，避免每帧分配内存
+                invalidator = self.frame_invalidator
+                if invalidator is not None:
+                    invalidator(self.frame_seq + 1)
+                slot = self.ring[(self.frame_seq + 1) % self.ring_size]
+                read_start = time.perf_counter()
+                ret, frame = self.cap.read(slot)
+                CAMERA_READ_SECONDS.observe(time.perf_counter() - read_start)
                 if ret:
-                    with self.get_frame_lock:
-                        self.frame = frame
-                        retry_count = 0
+                    if frame is not slot:
+                        if frame.shape != slot.shape:
+                            self._resize_ring(frame.shape)
+                            slot = self.ring[(self.frame_seq + 1) % self.ring_size]
+                        np.copyto(slot, frame)
+                    with self.frame_cond:
+                        self.frame_times[(self.frame_seq + 1) % self.ring_size] = time.time()
+                        self.frame_indices[(self.frame_seq + 1) % self.ring_size] = getattr(self.cap, 'index', -1)
+                        self.frame_seq += 1
+                        if self.frame_listener is not None:
+                            self.frame_listener(self.frame_seq)
+                        self.frame_cond.notify_all()
+                    retry_count = 0
                 else:
                     logger.warning("Failed to read frame")
+                    CAMERA_READ_FAILURES.inc()
                     time.sleep(0.1)
             except Exception as e:
                 logger.error(f"Error in capture loop: {e}")
                 time.sleep(0.1)
 
+        # 帧源结束（回放完毕或无法重新打开摄像头）时标记为未运行，之后可以重新 start
+        with self.lock:
+            if self.active and generation == self.generation:
+                self.active = False
+                if self.cap:
+                    self.cap.release()
+                    self.cap = None
+        with self.frame_cond:
+            self.frame_cond.notify_all()
+
+    def _frame_view(self, seq):
+        view = self.ring[seq % self.ring_size].view()
+        view.flags.writeable = False
+        return view
+
+    def frame_view(self, seq):
+        """序号为 seq 的帧的只读视图；帧已被覆盖时返回 None"""
+        if not self.is_frame_valid(seq):
+            return None
+        return self._frame_view(seq)
+
     def get_frame(self):
-        with self.get_frame_lock:
-            return self.frame.copy() if self.frame is not None else None
+        """返回最新帧的只读视图"""
+        return self.get_frame_with_seq()[1]
+
+    def get_frame_with_seq(self):
+        """返回 (帧序号, 只读帧视图)，帧序号用于判断是否为新帧"""
+        with self.frame_cond:
+            if self.frame_seq == 0:
+                return 0, None
+            return self.frame_seq, self._frame_view(self.frame_seq)
+
+    def wait_for_frame(self, after_seq, timeout=None):
+        """阻塞等待序号大于 after_seq 的新帧
+
+        返回 (帧序号, 只读帧视图)；超时或摄像头停止时返回 (after_seq, None)。
+        返回的序号与 after_seq 之差减一即为读取方跳过的帧数。
+        """
+        with self.frame_cond:
+            self.frame_cond.wait_for(
+                lambda: not self.active or self.frame_seq > after_seq, timeout
+            )
+            if self.frame_seq <= after_seq:
+                return after_seq, None
+            return self.frame_seq, self._frame_view(self.frame_seq)
+
+    def frame_time(self, seq):
+        """序号为 seq 的帧的采集时间；帧已被覆盖时返回 None"""
+        if not self.is_frame_valid(seq):
+            return None
+        return float(self.frame_times[seq % self.ring_size])
+
+    def frame_landmarks(self, seq):
+        """回放录制带预计算关键点时返回该帧的关键点，否则返回 None"""
+        landmarks_at = getattr(self.cap, 'landmarks_at', None)
+        if landmarks_at is None or not self.is_frame_valid(seq):
+            return None
+        return landmarks_at(int(self.frame_indices[seq % self.ring_size]))
+
+    def is_frame_valid(self, seq):
+        """序号为 seq 的帧视图是否尚未被采集线程覆盖"""
+        return 0 < seq and self.frame_seq - seq <= self.ring_size - 2
 
 class VideoAudioProcessor:
-    def __init__(self, audio_processor):
-        self.audio_processor = audio_processor
-        self.original_audio = None
+    """视频音频播放；音频处理栈在首次上传视频或开始监控时才加载"""
+    def __init__(self, controller):
+        self.controller = controller
+        self.source = None
         self.processed_audio = None
+        self.playing = False
+        self.load_lock = threading.Lock()
+
+    @property
+    def audio_processor(self):
+        return self.controller.audio_processor
         
     def load_video_audio(self, video_path):
-        # 提取视频音频
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_audio:
-            os.system(f'ffmpeg -i "{video_path}" -vn -acodec pcm_s16le -ar 44100 -ac 2 "{temp_audio.name}"')
-            self.original_audio = AudioSegment.from_wav(temp_audio.name)
-        os.unlink(temp_audio.name)
+        # 流式提取视频音频，第一块解码完成即可处理
+        from audio_source import StreamingAudioSource
+        from audio_effects import media_key
+        with self.load_lock:
+            if self.source is not None:
+                self.source.close()
+            self.source = StreamingAudioSource(video_path, self.audio_processor.sample_rate).start()
+            self.audio_processor.attach_media(self.source, media_key(video_path))
+        return self.source
+
+    def seek(self, t):
+        """跟随播放器位置"""
+        if self.source is not None:
+            self.source.seek(t)
+            # 丢弃跳转前已排队的音频
+            while not self.audio_processor.audio_queue.empty():
+                try:
+                    self.audio_processor.audio_queue.get_nowait()
+                except Empty:
+                    break
+
+    def start_playback(self, block_seconds=0.1):
+        """后台线程按播放位置读取音频送入 AudioProcessor 的实时处理队列"""
+        if self.playing or self.source is None:
+            return
+        self.playing = True
+        threading.Thread(target=self._playback_loop, args=(block_seconds,), daemon=True).start()
+
+    def stop_playback(self):
+        self.playing = False
+
+    def _playback_loop(self, block_seconds):
+        block = int(self.audio_processor.sample_rate * block_seconds)
+        while self.playing:
+            source = self.source  # load_video_audio 可能随时替换并关闭旧的音源
+            if source is None:
+                break
+            position = source.cursor  # 块在媒体中的样本位置，用于查找预渲染变体
+            chunk = source.read(block)
+            if self.source is not source:
+                continue  # 读取期间音源已被替换，丢弃旧音源的数据
+            if len(chunk) == 0:
+                if source.at_end():
+                    self.playing = False
+                    break
+                continue  # 解码尚未跟上（启动较慢或 seek 后重启 ffmpeg），继续等待
+            while self.playing:
+                try:
+                    self.audio_processor.audio_queue.put((position, chunk), timeout=0.5)
+                    break
+                except Full:
+                    continue
         
     def process_audio(self, is_distracted):
-        if self.original_audio is None:
+        if self.source is None:
             return
             
-        chunk = self.original_audio[0:1000]  # 处理1秒的音频
+        chunk = self.source.read(self.audio_processor.sample_rate)  # 处理1秒的音频
+        if len(chunk) == 0:
+            return
         processed_chunk = self.audio_processor.process_audio(chunk, is_distracted)
         self.processed_audio = processed_chunk
 
-class NumpyEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.bool_):
-            return bool(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super().default(obj)
-
-def to_json_serializable(obj):
-    """转换数据为JSON可序列化格式"""
-    if isinstance(obj, dict):
-        return {k: to_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [to_json_serializable(i) for i in obj]
-    elif isinstance(obj, (np.integer, np.floating, np.bool_)):
-        return obj.item()
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    return obj
-
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
 app.config['JSON_AS_ASCII'] = False
@@ -190,8 +349,87 @@ socketio = SocketIO(
 )
 
 controller = AttentionController()
-camera_manager = CameraManager()
-video_processor = VideoAudioProcessor(controller.audio_processor)
+camera_manager = CameraManager(source_factory=source_factory_from_env())
+video_processor = VideoAudioProcessor(controller)
+# 推理与推流各自的 CPU 预算（单核比例）和结果新鲜度上限，可通过环境变量调整
+analysis_scheduler = AdaptiveRate(
+    'analysis',
+    cpu_budget=float(os.environ.get('MINDLESS_ANALYSIS_CPU', 0.5)),
+    deadline=float(os.environ.get('MINDLESS_DEADLINE_MS', 250)) / 1000,
+    max_rate=float(os.environ.get('MINDLESS_MAX_ANALYSIS_FPS', 15))
+)
+stream_scheduler = AdaptiveRate(
+    'stream',
+    cpu_budget=float(os.environ.get('MINDLESS_STREAM_CPU', 0.25)),
+    max_rate=float(os.environ.get('MINDLESS_MAX_STREAM_FPS', 30))
+)
+# MINDLESS_INFERENCE_PROCS=N 时在 N 个独立进程中推理，帧与结果经共享内存传递
+inference_procs = int(os.environ.get('MINDLESS_INFERENCE_PROCS', 0))
+if inference_procs > 0:
+    pipeline = SharedMemoryPipeline(controller, camera_manager, inference_procs, analysis_scheduler)
+else:
+    pipeline = InferencePipeline(controller, camera_manager, analysis_scheduler)
+controller.attach_pipeline(pipeline)
+mjpeg_hub = MJPEGBroadcastHub(pipeline, scheduler=stream_scheduler)
+pipeline.annotation_demand = mjpeg_hub.needs_annotation  # 没有观看标注画面的客户端时不绘制
+# 上传落盘与提取、分析任务；正在播放的视频文件不会被清理
+job_manager = JobManager(
+    max_workers=int(os.environ.get('MINDLESS_JOB_WORKERS', 2)),
+    max_upload_bytes=int(os.environ.get('MINDLESS_MAX_UPLOAD_MB', 2048)) << 20,
+    disk_quota_bytes=int(os.environ.get('MINDLESS_UPLOAD_QUOTA_MB', 8192)) << 20,
+    in_use=lambda path: video_processor.source is not None and video_processor.source.path == path
+)
+# 上传大小上限（留出 multipart 头部的余量），也约束 request.form / request.files 的解析
+app.config['MAX_CONTENT_LENGTH'] = job_manager.max_upload_bytes + (1 << 20)
+session_manager = SessionManager()  # 首次创建会话时才启动工作进程
+# 每次 start/stop 之间的逐帧结果与干预变更写入只追加的时间线；MINDLESS_STORE_DIR 设为空时不记录
+store_dir = default_root()
+session_store = SessionStore(store_dir) if store_dir else None
+if session_store is not None:
+    session_store.intervention = controller.intervention_type
+status_channel = StatusChannel(socketio, stats_provider=controller.attention_stats.snapshot)
+metrics_logger = metrics.MetricsLogger()
+
+# 队列深度与音频欠载等已有计数，采集 /metrics 时读取
+def _audio_metric(fn):
+    """音频栈尚未加载时不输出该指标，避免抓取 /metrics 触发加载"""
+    return lambda: fn(controller.audio_processor) if controller.audio_loaded else None
+
+metrics.callback('audio_underruns_total', 'Audio output buffer underruns',
+                 _audio_metric(lambda a: a.output.underruns), kind='counter')
+metrics.callback('audio_overruns_total', 'Audio blocks dropped on write timeout',
+                 _audio_metric(lambda a: a.output.overruns), kind='counter')
+metrics.callback('audio_output_buffered_seconds', 'Audio queued in the output ring buffer',
+                 _audio_metric(lambda a: a.output.ring.available() / a.output.sample_rate))
+metrics.callback('audio_input_queue_depth', 'Chunks waiting in the audio processing queue',
+                 _audio_metric(lambda a: a.audio_queue.qsize()))
+metrics.callback('mjpeg_clients', 'Connected MJPEG clients', lambda: len(mjpeg_hub.clients))
+metrics.callback('mjpeg_queue_depth', 'Encoded frames queued across MJPEG clients',
+                 lambda: sum(len(c.queue) for c in list(mjpeg_hub.clients)))
+metrics.callback('pipeline_analysis_rate_hz', 'Achieved inference rate',
+                 lambda: analysis_scheduler.achieved_rate)
+metrics.callback('mjpeg_stream_rate_hz', 'Achieved MJPEG encode rate',
+                 lambda: stream_scheduler.achieved_rate)
+metrics.callback('status_channel_clients', 'Connected status channel clients',
+                 lambda: len(status_channel.clients))
+
+STARTED_AT = time.time()
+
+@app.route('/healthz')
+def healthz():
+    """就绪检查：FaceMesh 预热完成前返回 503"""
+    ready = controller.detector_ready.is_set() and controller.warmup_error is None
+    body = {
+        'status': 'ok' if ready else ('error' if controller.warmup_error else 'starting'),
+        'detector_ready': ready,
+        'warmup_seconds': controller.warmup_seconds,
+        'warmup_error': controller.warmup_error,
+        'audio_loaded': controller.audio_loaded,
+        'camera_active': camera_manager.active,
+        'pipeline_active': pipeline.active,
+        'uptime_seconds': round(time.time() - STARTED_AT, 1),
+    }
+    return jsonify(body), 200 if ready else 503
 
 @app.route('/')
 def index():
@@ -201,6 +439,8 @@ def index():
 def set_intervention():
     intervention_type = request.json.get('type')
     controller.set_intervention_type(intervention_type)
+    if session_store is not None:
+        session_store.record_intervention(intervention_type)
     return jsonify({'status': 'success'})
 
 @app.route('/api/start', methods=['POST'])
@@ -208,96 +448,253 @@ def start_monitoring():
     if not camera_manager.start():
         return jsonify({'status': 'error', 'message': 'Failed to start camera'}), 500
     video_processor.audio_processor.start_processing()
-    threading.Thread(target=process_frames, daemon=True).start()
+    video_processor.start_playback()
+    if session_store is not None:
+        session_store.start_session()
+    pipeline.start()
     return jsonify({'status': 'success'})
 
 @app.route('/api/stop', methods=['POST'])
 def stop_monitoring():
+    pipeline.stop()
     camera_manager.stop()
-    video_processor.audio_processor.stop_processing()
+    video_processor.stop_playback()
+    if controller.audio_loaded:
+        video_processor.audio_processor.stop_processing()
+    if session_store is not None:
+        session_store.end_session()
     return jsonify({'status': 'success'})
 
+def _ingest_upload():
+    """把 multipart 的 video 字段或原始请求体按块写入任务目录，返回 (路径, 表单字段, 错误响应)
+
+    multipart 请求体边解析边写入，不经过 request.files（Werkzeug 会先把整个请求体写入临时文件）。
+    """
+    form = {}
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        # 直接读取 request.stream 时 Werkzeug 不检查 MAX_CONTENT_LENGTH，按声明的长度提前拒绝
+        return None, form, (jsonify({'error': 'Upload exceeds size limit'}), 413)
+    try:
+        if request.mimetype == 'multipart/form-data':
+            boundary = request.mimetype_params.get('boundary')
+            if not boundary:
+                return None, form, (jsonify({'error': 'Missing multipart boundary'}), 400)
+            upload = MultipartUpload(request.stream, boundary.encode('latin-1'))
+            if not upload.start():
+                return None, form, (jsonify({'error': 'No video file'}), 400)
+            suffix = os.path.splitext(upload.filename)[1] or '.mp4'
+            path = job_manager.ingest(upload, suffix)
+            form = upload.finish()
+        else:
+            path = job_manager.ingest(request.stream)
+    except JobLimitError as e:
+        return None, form, (jsonify({'error': str(e)}), 503)
+    except UploadTooLargeError as e:
+        return None, form, (jsonify({'error': str(e)}), 413)
+    except DiskQuotaError as e:
+        return None, form, (jsonify({'error': str(e)}), 507)
+    except ValueError as e:
+        return None, form, (jsonify({'error': f'Malformed upload: {e}'}), 400)
+    if os.path.getsize(path) == 0:
+        os.unlink(path)
+        return None, form, (jsonify({'error': 'No video file'}), 400)
+    return path, form, None
+
+def _submit_job(kind, run, files):
+    try:
+        job = job_manager.submit(kind, run, files)
+    except JobLimitError as e:
+        for path in files:
+            os.unlink(path)
+        return jsonify({'error': str(e)}), 503
+    return jsonify(job.to_dict()), 202
+
+def _load_playback(job, video_path):
+    """任务：为前端播放加载视频音频，进度为已解码时长比例"""
+    source = video_processor.load_video_audio(video_path)
+    while not source.finished:
+        if video_processor.source is not source:
+            return {'superseded': True}
+        job.set_progress(source.decoded_fraction())
+        time.sleep(0.25)
+    return {'duration': source.duration}
+
 @app.route('/api/upload_video', methods=['POST'])
 def upload_video():
-    if 'video' not in request.files:
-        return jsonify({'error': 'No video file'}), 400
-        
-    video = request.files['video']
-    video_path = os.path.join(tempfile.gettempdir(), 'temp_video.mp4')
-    video.save(video_path)
-    video_processor.load_video_audio(video_path)
+    """上传供播放的视频，立即返回任务 id，音频提取在任务线程池中进行"""
+    video_path, _, error = _ingest_upload()
+    if error:
+        return error
+    return _submit_job('playback', lambda job: _load_playback(job, video_path), [video_path])
+
+@app.route('/api/seek', methods=['POST'])
+def seek_video():
+    """前端播放器跳转时同步音频读取位置"""
+    video_processor.seek(float(request.json.get('time', 0)))
     return jsonify({'status': 'success'})
 
-def process_frames():
-    frame_count = 0
-    last_process_time = time.time()
-    
-    while camera_manager.active:
-        try:
-            current_time = time.time()
-            if current_time - last_process_time < 0.1:  # Limit to 10 updates per second
-                time.sleep(0.01)
-                continue
-                
-            frame = camera_manager.get_frame()
-            if frame is not None:
-                frame_count += 1
-                last_process_time = current_time
-                
-                # Process every 3rd frame
-                if frame_count % 3 == 0:
-                    distracted, result, vis_frame = controller.head_detector.is_distracted(frame)
-                    result = to_json_serializable(result)
-                    status_data = {
-                        'distracted': bool(distracted),
-                        'timestamp': datetime.now().isoformat(),
-                        'reason': result
-                    }
-                    try:
-                        socketio.emit('attention_status', status_data)
-                    except Exception as e:
-                        logger.error(f"Socket emit error: {e}")
-            time.sleep(0.1)
-        except Exception as e:
-            logger.error(f"Error in process_frames: {e}")
-            time.sleep(0.1)
-
-def generate_frames():
-    frame_count = 0
-    last_frame_time = time.time()
-    
-    while True:
-        try:
-            current_time = time.time()
-            if current_time - last_frame_time < 0.033:  # Limit to ~30 FPS
-                time.sleep(0.01)
-                continue
-                
-            frame = camera_manager.get_frame()
-            if frame is not None:
-                frame_count += 1
-                last_frame_time = current_time
-                
-                # Process every 3rd frame for visualization
-                if frame_count % 3 == 0:
-                    distracted, result, vis_frame = controller.head_detector.is_distracted(frame)
-                    if vis_frame is not None:
-                        ret, buffer = cv2.imencode('.jpg', vis_frame)
-                        if ret:
-                            frame_bytes = buffer.tobytes()
-                            yield (b'--frame\r\n'
-                                  b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
-                time.sleep(0.033)
-        except Exception as e:
-            logger.error(f"Error in generate_frames: {e}")
-            logger.error(traceback.format_exc())
-            time.sleep(0.1)
+@app.route('/api/audio_stats')
+def audio_stats():
+    """音频输出的缓冲、欠载与溢出计数，以及干预音效的变体缓存命中情况"""
+    if not controller.audio_loaded:
+        return jsonify({'loaded': False})  # 查询统计不触发音频栈加载
+    stats = controller.audio_processor.output.stats()
+    stats['effects'] = controller.audio_processor.effects.stats()
+    stats['loaded'] = True
+    return jsonify(to_json_serializable(stats))
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """为浏览器端采集的参与者创建独立会话"""
+    cpu_budget = (request.get_json(silent=True) or {}).get('cpu_budget')
+    try:
+        session = session_manager.create_session(cpu_budget)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except (SessionLimitError, SessionUnavailableError) as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(session.to_dict()), 201
+
+@app.route('/api/sessions', methods=['GET'])
+def list_sessions():
+    return jsonify(session_manager.stats())
+
+@app.route('/api/sessions/<session_id>/frame', methods=['POST'])
+def submit_session_frame(session_id):
+    """请求体为 JPEG 帧，返回该会话的检测结果"""
+    try:
+        result = session_manager.submit_frame(session_id, request.get_data())
+    except KeyError:
+        return jsonify({'error': 'Unknown session'}), 404
+    except SessionBusyError as e:
+        return jsonify({'error': str(e)}), 429
+    except SessionUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(to_json_serializable(result))
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    if not session_manager.close_session(session_id):
+        return jsonify({'error': 'Unknown session'}), 404
+    return jsonify({'status': 'success'})
+
+@app.route('/api/analyze_video', methods=['POST'])
+def analyze_video():
+    """离线分析上传的视频，立即返回任务 id"""
+    video_path, form, error = _ingest_upload()
+    if error:
+        return error
+    workers = request.args.get('workers', type=int)
+    if workers is None and form.get('workers', '').strip().isdigit():
+        workers = int(form['workers'])
+    if workers is not None:
+        workers = min(max(1, workers), os.cpu_count() or 1)  # 进程数不超过 CPU 核数
+    timeline_path = os.path.splitext(video_path)[0] + '_timeline.npz'
+
+    def run(job):
+        from batch_analysis import analyze_video as analyze
+        return analyze(video_path, job.add_file(timeline_path), workers, progress=job.set_progress)
+    return _submit_job('analysis', run, [video_path])
+
+@app.route('/api/jobs')
+def list_jobs():
+    return jsonify(to_json_serializable(job_manager.stats()))
+
+@app.route('/api/jobs/<job_id>')
+@app.route('/api/analyze_video/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(to_json_serializable(job.to_dict()))
+
+@app.route('/api/jobs/<job_id>/result')
+@app.route('/api/analyze_video/<job_id>/timeline')
+def job_result(job_id):
+    """分析任务返回时间线文件，其它任务返回结果 JSON"""
+    job = job_manager.get(job_id)
+    if job is None or job.status != 'done':
+        return jsonify({'error': 'Result not available'}), 404
+    if job.kind == 'analysis':
+        return send_file(job.result['output'], mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'{job_id}_timeline.npz')
+    return jsonify(to_json_serializable(job.result))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """取消排队中的任务，或删除已结束任务及其文件"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': 'Job is running'}), 409
+    return jsonify({'status': 'success'})
+
+@app.route('/api/stats')
+def attention_stats():
+    """最近 1/5/60 分钟的分心频率、分心时长与最长专注时长"""
+    stats = controller.attention_stats.snapshot(time.time())
+    stats['recent_onsets'] = controller.attention_stats.recent_onsets()
+    return jsonify(stats)
+
+@app.route('/api/scheduler')
+def scheduler_stats():
+    """推理与推流的实测耗时、目标频率与实际频率"""
+    return jsonify({
+        'analysis': analysis_scheduler.stats(),
+        'stream': stream_scheduler.stats(),
+    })
+
+@app.route('/api/cascade')
+def cascade_stats():
+    """分级检测各级解决的帧数与命中率（MINDLESS_CASCADE）"""
+    return jsonify(controller.cascade_stats())
+
+@app.route('/api/store/sessions')
+def store_sessions():
+    """已记录的会话时间线"""
+    if session_store is None:
+        return jsonify({'error': 'Session store disabled'}), 404
+    return jsonify(session_store.sessions())
+
+@app.route('/api/store/sessions/<session_id>/aggregates')
+def store_aggregates(session_id):
+    """会话的窗口聚合：?window=秒&start=&end=（时间戳）&min_episode=最短闭眼秒数"""
+    if session_store is None:
+        return jsonify({'error': 'Session store disabled'}), 404
+    try:
+        reader = session_store.reader(session_id)
+        return jsonify(reader.aggregate(request.args.get('window', 60.0, type=float),
+                                        request.args.get('start', type=float),
+                                        request.args.get('end', type=float),
+                                        request.args.get('min_episode', 0.0, type=float)))
+    except KeyError:
+        return jsonify({'error': 'Unknown session'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文本格式的阶段耗时直方图与计数器"""
+    return Response(metrics.REGISTRY.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/status_channel')
+def status_channel_stats():
+    """状态通道的发送、抑制与合并计数"""
+    return jsonify(status_channel.stats())
+
+pipeline.subscribe(status_channel.publish)
+pipeline.subscribe(lambda result: controller.set_distraction_state(result.distracted))
+if session_store is not None:
+    pipeline.subscribe(session_store.record_result)
 
 @app.route('/video_feed')
 def video_feed():
     try:
-        return Response(generate_frames(),
+        # ?tier=high|medium|low 选择画质档位，?overlay=client 推送原始画面由浏览器绘制叠加层
+        return Response(mjpeg_hub.stream(request.args.get('tier'), request.args.get('overlay')),
                        mimetype='multipart/x-mixed-replace; boundary=frame')
     except Exception as e:
         logger.error(f"Error in video_feed: {e}")
@@ -308,10 +705,23 @@ def video_feed():
 def handle_connect():
     logger.info("Client connected")
     socketio.emit('status', {'connected': True}, namespace='/')
+    status_channel.add_client(request.sid)
+
+@socketio.on('subscribe_status', namespace='/')
+def handle_subscribe_status(data):
+    """客户端声明每秒最多接收的状态消息数与是否接收叠加层关键点，例如 {"max_rate": 2, "overlay": true}"""
+    data = data or {}
+    status_channel.add_client(request.sid, data.get('max_rate'), bool(data.get('overlay')))
+
+@socketio.on('latency_probe', namespace='/')
+def handle_latency_probe(data):
+    """原样返回客户端数据，用于测量事件往返延迟（见 load_test.py）"""
+    return data
 
 @socketio.on('disconnect', namespace='/')
 def handle_disconnect():
     logger.info("Client disconnected")
+    status_channel.remove_client(request.sid)
     
 @socketio.on_error_default
 def default_error_handler(e):
@@ -320,7 +730,17 @@ def default_error_handler(e):
 
 def cleanup():
     """清理资源"""
+    if isinstance(pipeline, SharedMemoryPipeline):
+        pipeline.shutdown()
+    else:
+        pipeline.stop()
     camera_manager.stop()
+    session_manager.shutdown()
+    job_manager.shutdown()
+    if session_store is not None:
+        session_store.close()
+    if video_processor.source is not None:
+        video_processor.source.close()
     # Remove cv2.destroyAllWindows() since we're using headless OpenCV
 
 import traceback
@@ -328,17 +748,25 @@ import traceback
 # Update main execution
 if __name__ == '__main__':
     try:
-        port = find_free_port()
+        port = int(os.environ.get('MINDLESS_PORT') or find_free_port())
+        ws_port = os.environ.get('MINDLESS_WS_PORT')
+        if ws_port:
+            # 可选：在同一进程内运行 websocket 服务，共享推理结果
+            serve_in_thread(controller, port=int(ws_port))
+            logger.info(f"WebSocket server is running at ws://localhost:{ws_port}")
+        metrics_logger.start()
+        controller.start_warmup()  # 服务先开始监听，FaceMesh 在后台构建并预热
         logger.info(f"Server is running at http://localhost:{port}")
         logger.info(f"Please open http://localhost:{port} in your browser")
         
-        socketio.init_app(app)
+        # SocketIO(app, ...) 已完成初始化；再次 init_app 会新建服务端实例并丢失已注册的事件处理函数
         socketio.run(app, 
                     host='127.0.0.1',
                     port=port,
                     debug=False,
                     log_output=True,
-                    use_reloader=False)
+                    use_reloader=False,
+                    allow_unsafe_werkzeug=True)  # 仅监听本机，threading 模式使用 Werkzeug
     except Exception as e:
         logger.error(f"Error starting server: {e}")
         logger.error(traceback.format_exc())
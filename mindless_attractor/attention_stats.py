@@ -0,0 +1,152 @@
+"""固定内存的滚动注意力统计
+
+按秒分桶的环形数组覆盖最长统计窗口（默认 60 分钟），每个窗口维护增量累计值，
+秒数前进时减去移出窗口的桶，因此每次更新的开销与运行时长无关。
+最长专注时长用每个窗口的单调队列维护，每秒最多一项，长度不超过窗口秒数。
+"""
+import threading
+from collections import deque
+
+import numpy as np
+
+DEFAULT_WINDOWS = {'1m': 60, '5m': 300, '60m': 3600}
+
+class AttentionStats:
+    def __init__(self, windows=None, onset_capacity=1024, max_gap=2.0):
+        self.windows = dict(windows or DEFAULT_WINDOWS)
+        self.horizon = max(self.windows.values())
+        self.max_gap = max_gap  # 相邻两次观测间隔超过该值视为中断，不计入时长
+        self.lock = threading.Lock()
+
+        # 最近的分心开始时间（环形缓冲区）
+        self.onset_times = np.zeros(onset_capacity, dtype=np.float64)
+        self.total_onsets = 0
+
+        # 每秒一个桶：分心开始次数、分心秒数、观测秒数
+        self.bucket_onsets = np.zeros(self.horizon, dtype=np.int32)
+        self.bucket_distracted = np.zeros(self.horizon, dtype=np.float64)
+        self.bucket_observed = np.zeros(self.horizon, dtype=np.float64)
+        self.window_sums = {name: [0, 0.0, 0.0] for name in self.windows}
+        self.streaks = {name: deque() for name in self.windows}  # (结束秒, 时长)，时长单调递减
+        self.current_second = None
+
+        self.last_time = None
+        self.last_distracted = None
+        self.streak_start = None
+        self.total_frames = 0
+        self.total_distracted_frames = 0
+
+    def _advance(self, second):
+        """把当前秒推进到 second，移出各窗口过期的桶"""
+        if self.current_second is None:
+            self.current_second = second
+            return
+        steps = second - self.current_second
+        if steps <= 0:
+            return
+        if steps >= self.horizon:
+            self.bucket_onsets[:] = 0
+            self.bucket_distracted[:] = 0
+            self.bucket_observed[:] = 0
+            for sums in self.window_sums.values():
+                sums[:] = [0, 0.0, 0.0]
+        else:
+            for s in range(self.current_second + 1, second + 1):
+                for name, length in self.windows.items():
+                    leaving = (s - length) % self.horizon
+                    sums = self.window_sums[name]
+                    sums[0] -= self.bucket_onsets[leaving]
+                    sums[1] -= self.bucket_distracted[leaving]
+                    sums[2] -= self.bucket_observed[leaving]
+                i = s % self.horizon
+                self.bucket_onsets[i] = 0
+                self.bucket_distracted[i] = 0
+                self.bucket_observed[i] = 0
+        self.current_second = second
+        for name, length in self.windows.items():
+            streaks = self.streaks[name]
+            while streaks and streaks[0][0] <= second - length:
+                streaks.popleft()
+
+    def _add(self, onsets=0, distracted=0.0, observed=0.0):
+        i = self.current_second % self.horizon
+        self.bucket_onsets[i] += onsets
+        self.bucket_distracted[i] += distracted
+        self.bucket_observed[i] += observed
+        for sums in self.window_sums.values():
+            sums[0] += onsets
+            sums[1] += distracted
+            sums[2] += observed
+
+    def _end_streak(self, end_time):
+        length = end_time - self.streak_start
+        second = int(end_time)
+        for name, streaks in self.streaks.items():
+            if second <= self.current_second - self.windows[name]:
+                continue  # 中断后才结束的旧区间，已在窗口之外
+            while streaks and streaks[-1][1] <= length:
+                streaks.pop()
+            if not streaks or streaks[-1][0] != second:
+                streaks.append((second, length))
+        self.streak_start = None
+
+    def update(self, distracted, timestamp):
+        """记录一次检测结果（时间戳为秒）"""
+        distracted = bool(distracted)
+        with self.lock:
+            self._advance(int(timestamp))
+            self.total_frames += 1
+            if distracted:
+                self.total_distracted_frames += 1
+
+            gap = None if self.last_time is None else timestamp - self.last_time
+            if gap is not None and 0 <= gap <= self.max_gap:
+                # 两次观测之间的时长归于上一次的状态
+                self._add(distracted=gap if self.last_distracted else 0.0, observed=gap)
+            elif self.streak_start is not None:
+                self._end_streak(self.last_time)
+
+            if distracted and self.last_distracted is not True:
+                self.onset_times[self.total_onsets % len(self.onset_times)] = timestamp
+                self.total_onsets += 1
+                self._add(onsets=1)
+                if self.streak_start is not None:
+                    self._end_streak(timestamp)
+            elif not distracted and self.streak_start is None:
+                self.streak_start = timestamp
+
+            self.last_time = timestamp
+            self.last_distracted = distracted
+
+    def recent_onsets(self, limit=20):
+        with self.lock:
+            n = min(limit, self.total_onsets, len(self.onset_times))
+            idx = (self.total_onsets - n + np.arange(n)) % len(self.onset_times)
+            return self.onset_times[idx].tolist()
+
+    def snapshot(self, now=None):
+        """各窗口的分心频率、分心时长与最长专注时长"""
+        with self.lock:
+            if now is not None:
+                self._advance(int(now))
+            now = now if now is not None else self.last_time
+            current_streak = (now - self.streak_start) if self.streak_start is not None and now else 0.0
+            windows = {}
+            for name, length in self.windows.items():
+                onsets, distracted, observed = self.window_sums[name]
+                streaks = self.streaks[name]
+                longest = max(streaks[0][1] if streaks else 0.0, current_streak)
+                windows[name] = {
+                    'onsets': int(onsets),
+                    'rate_per_minute': onsets / (length / 60),
+                    'distracted_seconds': round(max(distracted, 0.0), 3),
+                    'observed_seconds': round(max(observed, 0.0), 3),
+                    'distracted_ratio': round(distracted / observed, 4) if observed > 0 else None,
+                    'longest_focus_streak': round(min(longest, length), 3),
+                }
+            return {
+                'total_frames': self.total_frames,
+                'total_distractions': self.total_distracted_frames,
+                'total_onsets': self.total_onsets,
+                'windows': windows,
+            }
@@ -0,0 +1,314 @@
+"""干预音效：四种模式的向量化实现、预渲染变体缓存与实时切换
+
+- volume_down / volume_up：逐样本增益（升音量时软限幅），无状态，实时计算开销可忽略
+- pitch_up / pitch_down：保持时长的变调，有状态且开销大，对已加载的视频在后台
+  按段预渲染，结果与原始音频逐样本对齐，放入按 (媒体哈希, 模式, 段号) 索引、
+  限制总字节数的 LRU 缓存
+实时路径上切换模式只是从缓存取另一份对齐的缓冲区，并在 CROSSFADE_SECONDS 内做等功率交叉淡化；
+缓存未命中（刚跳转、后台尚未渲染到）时退回流式变调引擎。
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from pitch_shifter import StreamingPitchShifter
+
+logger = logging.getLogger(__name__)
+
+EFFECTS = {
+    'volume_down': {'gain': 0.35},
+    'volume_up': {'gain': 1.8},
+    'pitch_up': {'pitch': 1.3},
+    'pitch_down': {'pitch': 0.77},
+}
+MODES = tuple(EFFECTS)
+PITCH_MODES = tuple(m for m in MODES if 'pitch' in EFFECTS[m])
+
+SEGMENT_SECONDS = 2.0
+SEGMENT_OVERLAP = 1024   # 每段多渲染的样本数，段边界处与下一段交叉淡化
+RENDER_PREROLL = 4096    # 渲染前先送入的历史样本，让变调引擎的状态进入稳态
+CROSSFADE_SECONDS = 0.03
+LIMIT_THRESHOLD = 0.8
+
+def apply_gain(x, gain):
+    """增益；放大时对超过 LIMIT_THRESHOLD 的部分软限幅，避免削波"""
+    y = x * np.float32(gain)
+    if gain <= 1.0:
+        return y
+    magnitude = np.abs(y)
+    knee = 1.0 - LIMIT_THRESHOLD
+    limited = np.sign(y) * (LIMIT_THRESHOLD + knee * np.tanh((magnitude - LIMIT_THRESHOLD) / knee))
+    return np.where(magnitude > LIMIT_THRESHOLD, limited, y).astype(np.float32)
+
+def render_pitch(audio, factor, sample_rate, preroll=0, block=4096):
+    """离线变调，输出与输入逐样本对齐（补偿流式引擎的固定延迟）
+
+    audio 的前 preroll 个样本只用于预热，不出现在输出中。
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    x = audio.reshape(len(audio), -1)
+    shifter = StreamingPitchShifter(sample_rate, x.shape[1])
+    shifter.set_factor(factor, immediate=True)
+    delay = shifter.prime_samples
+    padded = np.concatenate([x, np.zeros((delay, x.shape[1]), np.float32)])
+    out = np.concatenate([shifter.process(padded[i:i + block]) for i in range(0, len(padded), block)])
+    out = out[delay + preroll:delay + len(x)]
+    return out.reshape((len(out),) + audio.shape[1:])
+
+def media_key(path, sample_bytes=1 << 20):
+    """媒体内容哈希：文件大小加首尾各 sample_bytes 字节，足以区分不同上传且无需读完整个文件"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(sample_bytes, size - sample_bytes))
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+class VariantCache:
+    """(媒体哈希, 模式, 段号) -> 渲染好的音频段，按总字节数淘汰最久未用的段"""
+    def __init__(self, max_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            variant = self.entries.get(key)
+            if variant is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return variant
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, variant):
+        variant.flags.writeable = False
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self.entries[key] = variant
+            self.bytes += variant.nbytes
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'segments': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+            }
+
+class VariantRenderer:
+    """后台线程：在播放位置之后 lookahead 段内预渲染各变调模式
+
+    source 需提供 read_range(start, end)（见 StreamingAudioSource），
+    尚未解码的区间返回 None，稍后重试。优先渲染当前模式。
+    """
+    def __init__(self, cache, sample_rate, segment_seconds=SEGMENT_SECONDS, lookahead=4):
+        self.cache = cache
+        self.sample_rate = sample_rate
+        self.segment = int(segment_seconds * sample_rate)
+        self.lookahead = lookahead
+        self.cond = threading.Condition()
+        self.source = None
+        self.key = None
+        self.position = 0
+        self.preferred = None
+        self.rendered = 0
+        self.render_seconds = 0.0
+        self.thread = None
+
+    def attach(self, source, key):
+        with self.cond:
+            self.source, self.key, self.position = source, key, 0
+            self.cond.notify_all()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._render_loop, daemon=True)
+            self.thread.start()
+
+    def detach(self):
+        with self.cond:
+            self.source = self.key = None
+
+    def update(self, position, mode=None):
+        """播放位置（样本）与当前模式；只在跨段或模式变化时唤醒渲染线程"""
+        with self.cond:
+            moved = position // self.segment != self.position // self.segment
+            self.position = position
+            if mode in PITCH_MODES and mode != self.preferred:
+                self.preferred = mode
+                moved = True
+            if moved:
+                self.cond.notify_all()
+
+    def _pending(self):
+        """按优先级排列的待渲染 (模式, 段号)"""
+        first = self.position // self.segment
+        modes = sorted(PITCH_MODES, key=lambda m: m != self.preferred)
+        return [(mode, index) for index in range(first, first + self.lookahead) for mode in modes
+                if (self.key, mode, index) not in self.cache]
+
+    def _render_loop(self):
+        while True:
+            with self.cond:
+                source, key = self.source, self.key
+                pending = self._pending() if source is not None else []
+            rendered = False
+            for mode, index in pending:
+                variant = self._render(source, mode, index)
+                if variant is not None:
+                    self.cache.put((key, mode, index), variant)
+                    rendered = True
+                    break  # 每段渲染完重新计算优先级，跟随跳转与模式变化
+            if not rendered:
+                with self.cond:
+                    self.cond.wait(0.25)
+
+    def _render(self, source, mode, index):
+        start = index * self.segment
+        preroll = min(RENDER_PREROLL, start)
+        audio = source.read_range(start - preroll, start + self.segment + SEGMENT_OVERLAP)
+        if audio is None or len(audio) <= preroll:
+            return None
+        t0 = time.perf_counter()
+        variant = render_pitch(audio, EFFECTS[mode]['pitch'], self.sample_rate, preroll)
+        self.render_seconds += time.perf_counter() - t0
+        self.rendered += 1
+        return variant
+
+    def stats(self):
+        return {
+            'segment_seconds': self.segment / self.sample_rate,
+            'lookahead_segments': self.lookahead,
+            'rendered_segments': self.rendered,
+            'render_seconds': round(self.render_seconds, 3),
+        }
+
+class EffectEngine:
+    """实时路径：按模式取对齐的变体（缓存或即时计算），模式变化时交叉淡化"""
+    def __init__(self, sample_rate, cache=None, renderer=None, crossfade=CROSSFADE_SECONDS):
+        self.sample_rate = sample_rate
+        self.cache = cache
+        self.renderer = renderer
+        self.crossfade = max(1, int(crossfade * sample_rate))
+        self.key = None
+        self.mode = None
+        self.fade_from = None
+        self.fade_pos = self.crossfade  # 启动时没有需要淡化的切换
+        self.live = None       # 缓存未命中时的流式变调引擎
+        self.live_next = None  # live 引擎下一次期望的输入位置，不连续时重建
+        self.cached_blocks = 0
+        self.live_blocks = 0
+
+    def set_media(self, key):
+        self.key = key
+        self.live = None
+
+    def _cached(self, mode, position, n):
+        """从缓存拼出 [position, position + n) 的变体；段边界的重叠区域做线性交叉淡化"""
+        if self.key is None or position is None or self.cache is None or self.renderer is None:
+            return None
+        segment = self.renderer.segment
+        out = []
+        while n > 0:
+            index, offset = divmod(position, segment)
+            variant = self.cache.get((self.key, mode, index))
+            if variant is None:
+                return None
+            take = min(n, segment - offset, len(variant) - offset)
+            if take <= 0:
+                return None  # 文件末尾
+            chunk = variant[offset:offset + take]
+            if index > 0 and offset < SEGMENT_OVERLAP:
+                previous = self.cache.get((self.key, mode, index - 1))
+                if previous is not None:
+                    take = min(take, SEGMENT_OVERLAP - offset)
+                    tail = previous[segment + offset:segment + offset + take]
+                    if len(tail) == take:
+                        w = ((offset + np.arange(take)) / SEGMENT_OVERLAP).astype(np.float32)
+                        w = w.reshape((-1,) + (1,) * (chunk.ndim - 1))
+                        chunk = tail + (chunk[:take] - tail) * w
+                    else:
+                        chunk = chunk[:take]
+            out.append(chunk)
+            position += take
+            n -= take
+        return out[0] if len(out) == 1 else np.concatenate(out)
+
+    def _live_pitch(self, block, factor, position):
+        channels = 1 if block.ndim == 1 else block.shape[1]
+        if (self.live is None or self.live.channels != channels or
+                (position is not None and position != self.live_next)):
+            self.live = StreamingPitchShifter(self.sample_rate, channels)
+        self.live.set_factor(factor)
+        self.live_next = None if position is None else position + len(block)
+        return self.live.process(block)
+
+    def render(self, block, mode, position=None, live=True):
+        """单一模式下 block 的输出（mode 为 None 表示原声）；live=False 时缓存未命中返回原声"""
+        if mode is None:
+            return block
+        effect = EFFECTS[mode]
+        if 'gain' in effect:
+            return apply_gain(block, effect['gain'])
+        variant = self._cached(mode, position, len(block))
+        if variant is not None and variant.shape == block.shape:
+            self.cached_blocks += 1
+            return variant
+        if not live:
+            return block
+        self.live_blocks += 1
+        return self._live_pitch(block, effect['pitch'], position)
+
+    def process(self, block, mode, position=None):
+        block = np.asarray(block, dtype=np.float32)
+        if self.renderer is not None and position is not None:
+            self.renderer.update(position, mode)
+        if mode != self.mode:
+            self.fade_from, self.fade_pos = self.mode, 0
+            self.mode = mode
+        out = self.render(block, mode, position)
+        if self.fade_pos >= self.crossfade:
+            return out
+
+        # 等增益（线性）交叉淡化：两种模式的输出逐样本对齐且高度相关，等功率曲线会抬高约 3 dB
+        previous = self.render(block, self.fade_from, position, live=False)
+        n = min(len(block), self.crossfade - self.fade_pos)
+        w = ((self.fade_pos + np.arange(n)) / self.crossfade).astype(np.float32)
+        w = w.reshape((-1,) + (1,) * (block.ndim - 1))
+        out = np.array(out, dtype=np.float32)
+        out[:n] = previous[:n] + (out[:n] - previous[:n]) * w
+        self.fade_pos += n
+        return out
+
+    def stats(self):
+        stats = {'mode': self.mode, 'cached_blocks': self.cached_blocks, 'live_blocks': self.live_blocks}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        if self.renderer is not None:
+            stats['renderer'] = self.renderer.stats()
+        return stats
@@ -0,0 +1,126 @@
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SPSCRingBuffer:
+    """单生产者/单消费者 float32 环形缓冲区
+
+    读、写索引单调递增且各自只由一方修改，因此无需加锁：生产者只写 write_index，
+    回调线程只写 read_index（CPython 中整数属性赋值是原子的）。
+    """
+    def __init__(self, capacity, channels):
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, channels), dtype=np.float32)
+        self.write_index = 0
+        self.read_index = 0
+
+    def available(self):
+        return self.write_index - self.read_index
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, data):
+        """写入尽可能多的样本，返回实际写入数"""
+        n = min(len(data), self.free())
+        start = self.write_index % self.capacity
+        first = min(n, self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:n - first] = data[first:n]
+        self.write_index += n
+        return n
+
+    def read_into(self, out):
+        """读取到 out 中，返回实际读取数"""
+        n = min(len(out), self.available())
+        start = self.read_index % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:n] = self.buffer[:n - first]
+        self.read_index += n
+        return n
+
+class AudioOutputStream:
+    """基于 sounddevice 回调的实时输出
+
+    缓冲区中最多保留 target_latency 秒的音频，因此处理线程写入的效果
+    在 target_latency 内到达扬声器。
+    """
+    def __init__(self, sample_rate=44100, channels=2, target_latency=0.03, block_size=256):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.target_samples = max(block_size, int(sample_rate * target_latency))
+        self.ring = SPSCRingBuffer(self.target_samples + 4 * block_size, channels)
+        self.stream = None
+        self.underruns = 0         # 播放中缓冲区被取空的次数
+        self.playing = False
+        self.overruns = 0          # 写入超时被丢弃的块
+        self.device_underflows = 0  # PortAudio 报告的输出下溢
+
+    @property
+    def target_latency(self):
+        return self.target_samples / self.sample_rate
+
+    def start(self):
+        import sounddevice as sd
+        if self.stream is not None:
+            return
+        self.stream = sd.OutputStream(
+            samplerate=self.sample_rate,
+            channels=self.channels,
+            dtype='float32',
+            blocksize=self.block_size,
+            latency='low',
+            callback=self._callback
+        )
+        self.stream.start()
+        logger.info(f"Audio output started (target latency {self.target_latency * 1000:.0f} ms)")
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+            logger.info(f"Audio output stopped: {self.stats()}")
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.device_underflows += 1
+        n = self.ring.read_into(outdata)
+        if n < frames:
+            outdata[n:] = 0
+            if self.playing:
+                self.underruns += 1  # 每次断流只计一次，空闲时不计
+        self.playing = n == frames
+
+    def write(self, data, timeout=1.0):
+        """写入一块音频，缓冲区超过目标延迟时等待；超时则丢弃并计为 overrun"""
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim == 1:
+            data = np.repeat(data[:, None], self.channels, axis=1)
+        if len(data) > self.block_size:
+            results = [self.write(data[i:i + self.block_size], timeout)
+                       for i in range(0, len(data), self.block_size)]
+            return all(results)
+        deadline = time.monotonic() + timeout
+        pause = self.block_size / self.sample_rate / 4
+        while self.ring.available() + len(data) > self.target_samples + self.block_size:
+            if time.monotonic() > deadline:
+                self.overruns += 1
+                return False
+            time.sleep(pause)
+        self.ring.write(data)
+        return True
+
+    def stats(self):
+        return {
+            'target_latency_ms': self.target_latency * 1000,
+            'buffered_ms': self.ring.available() / self.sample_rate * 1000,
+            'underruns': self.underruns,
+            'overruns': self.overruns,
+            'device_underflows': self.device_underflows,
+        }
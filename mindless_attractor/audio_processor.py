@@ -1,60 +1,79 @@
 import numpy as np
-import sounddevice as sd
-from scipy import signal
 import random
 import threading
 import queue
 import time
+import logging
+from audio_effects import EffectEngine, VariantCache, VariantRenderer, MODES
+from audio_output import AudioOutputStream
+
+logger = logging.getLogger(__name__)
 
 class AudioProcessor:
-    def __init__(self):
+    def __init__(self, variant_cache_bytes=256 << 20):
         self.sample_rate = 44100
         self.chunk_size = 1024 * 4  # 增大缓冲区
         self.current_mode = None
         self.audio_queue = queue.Queue(maxsize=10)
-        self.output_queue = queue.Queue(maxsize=10)
+        self.output = AudioOutputStream(self.sample_rate, channels=2, target_latency=0.03)
         self.is_processing = False
         self.distracted = False
-        self.pitch_shift_factor = 1.3  # 分心时的音调变化因子
+        # 已加载视频的变调变体在后台预渲染，实时路径只取缓冲区并交叉淡化
+        self.variant_cache = VariantCache(variant_cache_bytes)
+        self.renderer = VariantRenderer(self.variant_cache, self.sample_rate)
+        self.effects = EffectEngine(self.sample_rate, self.variant_cache, self.renderer)
         
     def start_processing(self):
+        if self.is_processing:
+            return
         self.is_processing = True
+        try:
+            self.output.start()
+        except Exception as e:
+            logger.error(f"Audio output unavailable: {e}")
         threading.Thread(target=self._process_audio_loop, daemon=True).start()
         
     def stop_processing(self):
         self.is_processing = False
+        self.output.stop()
         
     def _process_audio_loop(self):
+        # 按输出块大小逐块处理，每块都读取最新的分心状态，
+        # 输出缓冲区只保留 target_latency 的音频，干预因此能在数十毫秒内生效
+        # 队列元素为 (媒体中的样本位置, 音频块)，位置用于查找预渲染变体；无位置时直接是音频块
+        block_size = self.output.block_size
         while self.is_processing:
             try:
-                audio_chunk = self.audio_queue.get(timeout=0.1)
-                processed = self.process_audio(audio_chunk, self.distracted)
-                self.output_queue.put(processed)
+                item = self.audio_queue.get(timeout=0.1)
             except queue.Empty:
                 continue
+            position, audio_chunk = item if isinstance(item, tuple) else (None, item)
+            for start in range(0, len(audio_chunk), block_size):
+                if not self.is_processing:
+                    break
+                processed = self.process_audio(audio_chunk[start:start + block_size], self.distracted,
+                                               None if position is None else position + start)
+                self.output.write(processed)
+
+    def attach_media(self, source, key):
+        """新视频的音频源：后台开始为其预渲染变体，key 为媒体内容哈希"""
+        self.renderer.attach(source, key)
+        self.effects.set_media(key)
                 
     def set_distraction_state(self, is_distracted):
         """更新分心状态"""
         if self.distracted != is_distracted:
             self.distracted = is_distracted
             if is_distracted:
-                self.current_mode = random.choice([
-                    'volume_down',
-                    'volume_up',
-                    'pitch_up',
-                    'pitch_down'
-                ])
+                self.current_mode = random.choice(MODES)
                 
-    def process_audio(self, audio_chunk, distracted):
-        """处理音频数据"""
-        if not distracted:
-            return audio_chunk
-            
-        # 分心时改变音调
-        return self.pitch_shift(audio_chunk, self.pitch_shift_factor)
+    def process_audio(self, audio_chunk, distracted, position=None):
+        """处理音频数据：分心时施加 current_mode 的干预效果，专注时输出原声
 
-    def pitch_shift(self, audio_chunk, factor):
-        return signal.resample(audio_chunk, int(len(audio_chunk) / factor))
+        position 为该块在已加载媒体中的样本位置，命中预渲染变体时不做 DSP。
+        """
+        mode = self.current_mode if distracted else None
+        return self.effects.process(audio_chunk, mode, position)
 
     def generate_beep(self, duration=0.1, frequency=440):
         t = np.linspace(0, duration, int(self.sample_rate * duration))
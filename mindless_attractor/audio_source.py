@@ -0,0 +1,190 @@
+import os
+import subprocess
+import tempfile
+import threading
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def probe_duration(path):
+    """用 ffprobe 读取媒体时长（秒），失败时返回 None"""
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', path],
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+        return float(output)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+class StreamingAudioSource:
+    """ffmpeg 管道流式解码到内存映射缓冲区，按播放位置 read/seek
+
+    解码在后台线程中进行，PCM 直接写入临时文件上的 np.memmap，
+    第一块解码完成即可开始读取。seek 到尚未解码的位置时从该位置重新启动 ffmpeg。
+    """
+    def __init__(self, path, sample_rate=44100, channels=2, read_size=16384):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_bytes = 2 * channels  # s16le
+        self.read_size = read_size - read_size % self.frame_bytes
+        self.cond = threading.Condition()
+        self.cursor = 0          # 下一次 read 的样本位置
+        self.decode_start = 0    # 当前连续已解码区间 [decode_start, decode_end)
+        self.decode_end = 0
+        self.finished = False    # 当前解码进程是否已到文件末尾
+        self.generation = 0      # 每次重启解码加一，旧线程据此退出
+        self.closed = False
+        self.proc = None
+        self.buffer = None
+        self.buffer_file = None
+        self.duration = None
+
+    def start(self, start_time=0.0):
+        duration = self.duration = probe_duration(self.path)
+        capacity = int((duration if duration else 600) * self.sample_rate) + self.sample_rate
+        fd, self.buffer_file = tempfile.mkstemp(suffix='.pcm')
+        os.close(fd)
+        self._allocate(capacity)
+        self._restart_decoder(int(start_time * self.sample_rate))
+        return self
+
+    def _allocate(self, capacity):
+        """分配/扩展磁盘后备的 memmap（调用方持有锁或尚未启动解码）"""
+        with open(self.buffer_file, 'r+b') as f:
+            f.truncate(capacity * self.frame_bytes)
+        self.buffer = np.memmap(self.buffer_file, dtype=np.int16, mode='r+',
+                                shape=(capacity, self.channels))
+
+    def _restart_decoder(self, start_sample):
+        with self.cond:
+            if self.closed:
+                return
+            self.generation += 1
+            generation = self.generation
+            if self.proc is not None:
+                self.proc.kill()
+            self.decode_start = self.decode_end = start_sample
+            self.finished = False
+            self.proc = subprocess.Popen(
+                ['ffmpeg', '-nostdin', '-v', 'error',
+                 '-ss', f'{start_sample / self.sample_rate:.3f}', '-i', self.path,
+                 '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+                 '-ar', str(self.sample_rate), '-ac', str(self.channels), '-'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            proc = self.proc
+        threading.Thread(target=self._decode_loop, args=(proc, generation), daemon=True).start()
+
+    def _decode_loop(self, proc, generation):
+        pending = bytearray()
+        try:
+            while True:
+                data = proc.stdout.read(self.read_size)
+                if not data:
+                    break
+                pending += data
+                usable = len(pending) - len(pending) % self.frame_bytes
+                if usable == 0:
+                    continue
+                samples = np.frombuffer(bytes(pending[:usable]), dtype=np.int16).reshape(-1, self.channels)
+                del pending[:usable]
+                with self.cond:
+                    if generation != self.generation:
+                        return
+                    end = self.decode_end + len(samples)
+                    if end > len(self.buffer):
+                        self.buffer.flush()
+                        self._allocate(max(end, len(self.buffer) * 2))
+                    self.buffer[self.decode_end:end] = samples
+                    self.decode_end = end
+                    self.cond.notify_all()
+        except Exception as e:
+            logger.error(f"Audio decode error: {e}")
+        finally:
+            proc.stdout.close()
+            with self.cond:
+                if generation == self.generation:
+                    self.finished = True
+                    self.cond.notify_all()
+
+    def read(self, n_samples, timeout=5.0):
+        """从当前位置读取最多 n_samples 个样本，返回 float32 (n, channels)
+
+        数据尚未解码时最多阻塞 timeout 秒；到达文件末尾、等待超时或已 close 时
+        返回较短（可能为空）的数组，用 at_end() 区分文件末尾与解码尚未跟上。
+        """
+        with self.cond:
+            if self.closed:
+                return np.zeros((0, self.channels), dtype=np.float32)
+            cursor = self.cursor
+            in_range = self.decode_start <= cursor <= self.decode_end
+        if not in_range:
+            self._restart_decoder(cursor)
+
+        with self.cond:
+            target = self.cursor + n_samples
+            self.cond.wait_for(lambda: self.closed or self.finished or self.decode_end >= target, timeout)
+            if self.closed:
+                return np.zeros((0, self.channels), dtype=np.float32)
+            end = min(target, self.decode_end)
+            chunk = self.buffer[self.cursor:end].astype(np.float32) / 32768.0
+            self.cursor = max(self.cursor, end)
+            return chunk
+
+    def at_end(self):
+        """读取位置是否已到文件末尾（解码已结束且已读完），close 之后也返回 True"""
+        with self.cond:
+            return self.closed or (self.finished and self.cursor >= self.decode_end)
+
+    def seek(self, t):
+        """跳转到 t 秒；已解码区间外的位置会从该处重新解码"""
+        sample = max(0, int(t * self.sample_rate))
+        with self.cond:
+            self.cursor = sample
+            in_range = self.decode_start <= sample <= self.decode_end
+        if not in_range:
+            self._restart_decoder(sample)
+
+    def read_range(self, start, end):
+        """不移动读取位置地读取 [start, end) 的样本，尚未解码时返回 None；文件末尾截短"""
+        with self.cond:
+            if self.buffer is None or start < self.decode_start:
+                return None
+            if end > self.decode_end:
+                if not self.finished:
+                    return None
+                end = self.decode_end
+            if end <= start:
+                return None
+            return self.buffer[start:end].astype(np.float32) / 32768.0
+
+    def decoded_fraction(self):
+        """当前解码区间覆盖到的时长比例；时长未知时只在解码结束后返回 1"""
+        with self.cond:
+            if self.finished:
+                return 1.0
+            if not self.duration:
+                return 0.0
+            return min(1.0, self.decode_end / (self.duration * self.sample_rate))
+
+    def tell(self):
+        """当前读取位置（秒）"""
+        return self.cursor / self.sample_rate
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.generation += 1
+            if self.proc is not None:
+                self.proc.kill()
+                self.proc = None
+            self.buffer = None
+            self.cond.notify_all()  # 唤醒阻塞在 read 中的播放线程
+        if self.buffer_file and os.path.exists(self.buffer_file):
+            os.unlink(self.buffer_file)
+        self.buffer_file = None
@@ -0,0 +1,177 @@
+"""离线批量分析录制视频，生成逐帧注意力时间线
+
+用法:
+    python batch_analysis.py session.mp4 -o session_timeline.npz --workers 4
+
+视频被切分为帧块，由进程池并行运行 FaceMesh 计算 yaw/pitch/EAR；
+闭眼持续时间依赖前后帧，因此在合并阶段按视频时间戳顺序计算。
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_FRAMES = 300
+
+_detector = None
+
+def _init_worker():
+    """每个工作进程持有自己的 HeadPoseDetector"""
+    global _detector
+    from head_pose_detector import HeadPoseDetector
+    _detector = HeadPoseDetector()
+
+def probe_video(video_path):
+    """返回 (总帧数, fps)"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    return frame_count, fps
+
+def analyze_chunk(video_path, start, end, fps):
+    """在工作进程中分析 [start, end) 帧，返回原始指标列"""
+    _detector.reset_state()  # 上一块的人脸区域与闭眼计时不属于这一块
+    n = end - start
+    timestamps = np.arange(start, end, dtype=np.float64) / fps
+    yaw = np.full(n, np.nan, dtype=np.float32)
+    pitch = np.full(n, np.nan, dtype=np.float32)
+    ear = np.full(n, np.nan, dtype=np.float32)
+    face = np.zeros(n, dtype=bool)
+    landmarks_batch = None  # (n, 478, 3)，整块收集后一次性计算指标
+
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    read = 0
+    while read < n:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        pos_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if pos_msec > 0:
+            timestamps[read] = pos_msec / 1000.0
+        landmarks = _detector.get_face_landmarks(frame)
+        if landmarks is not None:
+            if landmarks_batch is None:
+                landmarks_batch = np.empty((n,) + landmarks.shape, dtype=np.float64)
+            landmarks_batch[read] = landmarks
+            face[read] = True
+        read += 1
+    cap.release()
+
+    if landmarks_batch is not None:
+        detected = np.flatnonzero(face[:read])
+        yaw[detected], pitch[detected], ear[detected] = _detector.compute_metrics(landmarks_batch[detected])
+
+    return start, timestamps[:read], yaw[:read], pitch[:read], ear[:read], face[:read]
+
+def merge_timeline(chunks, yaw_threshold=15, pitch_threshold=20,
+                   ear_threshold=0.15, closed_eyes_time=2.0):
+    """按帧顺序合并各块结果并计算闭眼与分心标记
+
+    与 HeadPoseDetector.check_eyes_closed 一致：未检测到人脸的帧不改变闭眼计时。
+    """
+    chunks = sorted(chunks, key=lambda c: c[0])
+    timestamps = np.concatenate([c[1] for c in chunks])
+    yaw = np.concatenate([c[2] for c in chunks])
+    pitch = np.concatenate([c[3] for c in chunks])
+    ear = np.concatenate([c[4] for c in chunks])
+    face = np.concatenate([c[5] for c in chunks])
+    frame = np.concatenate([np.arange(c[0], c[0] + len(c[1])) for c in chunks]).astype(np.int32)
+
+    # 只在检测到人脸的帧上计算闭眼区间
+    face_idx = np.flatnonzero(face)
+    closed = ear[face_idx] < ear_threshold
+    run_start = closed & ~np.concatenate(([False], closed[:-1]))
+    start_time = np.where(run_start, timestamps[face_idx], -np.inf)
+    start_time = np.maximum.accumulate(start_time)
+    duration = np.where(closed, timestamps[face_idx] - start_time, 0.0)
+
+    closed_duration = np.zeros(len(frame), dtype=np.float32)
+    closed_duration[face_idx] = duration
+    eyes_closed = closed_duration >= closed_eyes_time
+
+    with np.errstate(invalid='ignore'):
+        distracted = (
+            ~face |
+            (np.abs(yaw) > yaw_threshold) |
+            (np.abs(pitch) > pitch_threshold) |
+            eyes_closed
+        )
+
+    return {
+        'frame': frame,
+        'timestamp': timestamps,
+        'yaw': yaw,
+        'pitch': pitch,
+        'ear': ear,
+        'face_detected': face,
+        'eyes_closed': eyes_closed,
+        'closed_duration': closed_duration,
+        'distracted': distracted,
+    }
+
+def analyze_video(video_path, output_path, workers=None, chunk_frames=DEFAULT_CHUNK_FRAMES,
+                  progress=None):
+    """并行分析整段视频并写出列式 .npz 时间线，返回摘要"""
+    frame_count, fps = probe_video(video_path)
+    if frame_count <= 0:
+        raise ValueError(f"Video has no frames: {video_path}")
+    workers = workers or os.cpu_count() or 1
+    bounds = [(s, min(s + chunk_frames, frame_count)) for s in range(0, frame_count, chunk_frames)]
+
+    start_time = time.time()
+    chunks = []
+    ctx = multiprocessing.get_context('spawn')  # mediapipe 不适合 fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker) as executor:
+        futures = [executor.submit(analyze_chunk, video_path, s, e, fps) for s, e in bounds]
+        for future in as_completed(futures):
+            chunks.append(future.result())
+            if progress:
+                progress(len(chunks) / len(futures))
+
+    timeline = merge_timeline(chunks)
+    np.savez_compressed(output_path, fps=np.float32(fps), **timeline)
+
+    elapsed = time.time() - start_time
+    analyzed = len(timeline['frame'])
+    summary = {
+        'frames': analyzed,
+        'fps': fps,
+        'duration': float(timeline['timestamp'][-1]) if analyzed else 0.0,
+        'distracted_ratio': float(timeline['distracted'].mean()) if analyzed else 0.0,
+        'elapsed': elapsed,
+        'frames_per_second': analyzed / elapsed if elapsed > 0 else 0.0,
+        'output': output_path,
+    }
+    logger.info(f"Analyzed {analyzed} frames in {elapsed:.1f}s "
+                f"({summary['frames_per_second']:.1f} fps, {workers} workers)")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline attention analysis of a recorded video')
+    parser.add_argument('video', help='input video file')
+    parser.add_argument('-o', '--output', help='output timeline (.npz), defaults to <video>_timeline.npz')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-frames', type=int, default=DEFAULT_CHUNK_FRAMES, help='frames per work chunk')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    output = args.output or os.path.splitext(args.video)[0] + '_timeline.npz'
+    summary = analyze_video(args.video, output, args.workers, args.chunk_frames,
+                            progress=lambda p: logger.info(f"Progress: {p:.0%}"))
+    logger.info(f"Timeline written to {summary['output']} "
+                f"(distracted {summary['distracted_ratio']:.1%} of {summary['frames']} frames)")
+
+if __name__ == '__main__':
+    main()
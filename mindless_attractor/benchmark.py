@@ -0,0 +1,357 @@
+"""无需摄像头/扬声器的热点路径基准测试
+
+用法:
+    python benchmark.py -o bench.json                 # 合成帧与音频
+    python benchmark.py --video session.mp4 --audio session.wav -o bench.json
+    python benchmark.py --recording rec/ -o bench.json  # frame_source.py 录制（可带 landmarks.bin）
+    python benchmark.py --compare baseline.json       # 与历史结果比较，回归时返回非零
+
+每个用例输出吞吐量与 p50/p99 延迟（毫秒），结果为 JSON，可跨提交比较。
+合成帧是噪声，FaceMesh 相关用例只能测到无人脸路径（ROI 跟踪不会触发）；
+pose_kernel.* 与 *[landmarks] 用例直接以关键点为输入，不依赖画面中有人脸。
+关键点依次取自录制的 landmarks.bin、对输入帧运行 FaceMesh 的结果、合成关键点。
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import wave
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {}
+
+def benchmark(name, iteration_scale=1.0):
+    """注册基准用例；用例函数返回一个无参可调用对象
+
+    iteration_scale 用于缩减开销大的用例（如 FaceMesh 推理）的迭代次数。
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, iteration_scale)
+        return setup
+    return register
+
+def load_frames(video_path=None, count=60, shape=(480, 640, 3)):
+    """从视频读取帧，未指定视频时生成合成帧"""
+    if video_path:
+        cap = cv2.VideoCapture(video_path)
+        frames = []
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+        if frames:
+            return frames
+        logger.warning(f"No frames read from {video_path}, using synthetic frames")
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(count)]
+
+def load_recording(path, count=60):
+    """读取录制目录的帧与预计算关键点（无人脸的帧跳过），没有 landmarks.bin 时关键点为空"""
+    from frame_source import Recording
+    recording = Recording(path)
+    n = min(count, len(recording))
+    frames = [np.array(recording.frame(i)) for i in range(n)]
+    landmarks = []
+    if recording.landmarks is not None:
+        landmarks = [np.array(recording.landmarks[i], dtype=np.float64)
+                     for i in range(min(n, len(recording.landmarks)))
+                     if not np.isnan(recording.landmarks[i, 0, 0])]
+    return frames, landmarks
+
+def detect_landmarks(detector, frames):
+    """对输入帧运行一次 FaceMesh，返回检测到人脸的帧的关键点"""
+    landmarks = []
+    for frame in frames:
+        points = detector.get_face_landmarks(frame)
+        if points is not None:
+            landmarks.append(np.array(points, dtype=np.float64))
+    detector.reset_state()
+    return landmarks
+
+def synthetic_landmarks(count=60, n_points=478, width=640, height=480):
+    """生成位于画面中央、带轻微抖动的 478 点关键点"""
+    rng = np.random.default_rng(1)
+    base = np.column_stack([
+        rng.uniform(width * 0.4, width * 0.6, n_points),
+        rng.uniform(height * 0.35, height * 0.65, n_points),
+        rng.uniform(-40, 40, n_points),
+    ])
+    return [base + rng.normal(0, 1.5, base.shape) for _ in range(count)]
+
+def load_audio(wav_path=None, seconds=5, sample_rate=44100):
+    """读取 16-bit PCM WAV 为 float32 (n, channels)，未指定时生成合成噪声"""
+    if wav_path:
+        with wave.open(wav_path, 'rb') as wav:
+            channels = wav.getnchannels()
+            data = wav.readframes(wav.getnframes())
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, channels)
+        return samples.astype(np.float32) / 32768.0
+    rng = np.random.default_rng(2)
+    return rng.uniform(-0.5, 0.5, (sample_rate * seconds, 2)).astype(np.float32)
+
+class Cycle:
+    """循环取样，避免每次迭代命中同一份缓存数据"""
+    def __init__(self, items):
+        self.items = items
+        self.index = 0
+
+    def next(self):
+        item = self.items[self.index % len(self.items)]
+        self.index += 1
+        return item
+
+@benchmark('detector.get_face_landmarks', iteration_scale=0.1)
+def bench_get_face_landmarks(ctx):
+    frames = Cycle(ctx['frames'])
+    return lambda: ctx['detector'].get_face_landmarks(frames.next())
+
+@benchmark('detector.get_face_landmarks[full_frame]', iteration_scale=0.1)
+def bench_get_face_landmarks_full_frame(ctx):
+    from head_pose_detector import HeadPoseDetector
+    detector = HeadPoseDetector(roi_tracking=False)
+    frames = Cycle(ctx['frames'])
+    return lambda: detector.get_face_landmarks(frames.next())
+
+@benchmark('detector.calculate_head_pose')
+def bench_calculate_head_pose(ctx):
+    landmarks = Cycle(ctx['landmarks'])
+    return lambda: ctx['detector'].calculate_head_pose(landmarks.next())
+
+@benchmark('detector.calculate_ear')
+def bench_calculate_ear(ctx):
+    detector = ctx['detector']
+    landmarks = Cycle(ctx['landmarks'])
+    return lambda: detector.calculate_ear(landmarks.next(), detector.LEFT_EYE_INDICES)
+
+@benchmark('detector.is_distracted', iteration_scale=0.1)
+def bench_is_distracted(ctx):
+    frames = Cycle(ctx['frames'])
+    return lambda: ctx['detector'].is_distracted(frames.next())
+
+@benchmark('detector.is_distracted[landmarks]')
+def bench_is_distracted_landmarks(ctx):
+    """跳过 FaceMesh、以关键点为输入的有人脸路径（回放预计算关键点时的推理路径）"""
+    frames = Cycle(ctx['frames'])
+    landmarks = Cycle(ctx['landmarks'])
+    return lambda: ctx['detector'].is_distracted(frames.next(), landmarks=landmarks.next(), annotate=False)
+
+@benchmark('pose_kernel.compute_metrics')
+def bench_compute_metrics(ctx):
+    from pose_kernel import compute_metrics
+    landmarks = Cycle(ctx['landmarks'])
+    return lambda: compute_metrics(landmarks.next())
+
+@benchmark('pose_kernel.compute_metrics[batch]')
+def bench_compute_metrics_batch(ctx):
+    from pose_kernel import compute_metrics
+    batch = np.stack(ctx['landmarks'])
+    return lambda: compute_metrics(batch)
+
+@benchmark('pose_kernel.extract')
+def bench_extract(ctx):
+    """MediaPipe 关键点对象到数组的提取；用与 MediaPipe 相同属性接口的对象模拟"""
+    from types import SimpleNamespace
+    from pose_kernel import LandmarkBuffer, LANDMARK_Z_SCALE
+    height, width = ctx['frames'][0].shape[:2]
+    scale = (width, height, LANDMARK_Z_SCALE)
+    faces = Cycle([[SimpleNamespace(x=x, y=y, z=z) for x, y, z in points / scale]
+                   for points in ctx['landmarks']])
+    buffer = LandmarkBuffer()
+    return lambda: buffer.extract(faces.next(), scale)
+
+@benchmark('visualisation.draw_and_encode')
+def bench_draw_and_encode(ctx):
+    detector = ctx['detector']
+    frames = Cycle(ctx['frames'])
+    landmarks = Cycle(ctx['landmarks'])
+
+    def run():
+        vis_frame = detector.draw_face_state(frames.next().copy(), landmarks.next(), False, 8.0)
+        cv2.imencode('.jpg', vis_frame)
+    return run
+
+@benchmark('serialization.to_json_serializable')
+def bench_to_json_serializable(ctx):
+    from serialization import to_json_serializable
+    reason = {
+        "head_pose": {"yaw": np.float64(8.2), "pitch": np.float64(-3.1)},
+        "eyes": {"closed": np.bool_(False), "closed_duration": None},
+        "attention_level": "focused"
+    }
+    return lambda: to_json_serializable(reason)
+
+def _effects_render_case(chunk_size):
+    def setup(ctx):
+        audio = ctx['audio']
+        n_chunks = max(1, len(audio) // chunk_size)
+        chunks = Cycle([audio[i * chunk_size:(i + 1) * chunk_size] for i in range(n_chunks)])
+        processor = ctx['audio_processor']
+        return lambda: processor.effects.render(chunks.next(), 'pitch_up')  # 未命中缓存的实时路径
+    return setup
+
+# 计时的是 EffectEngine.render（缓存未命中时的实时变调），与旧的 audio.pitch_shift[N] 不可比
+for _chunk_size in (512, 1024, 4096):
+    benchmark(f'audio.effects_render[{_chunk_size}]')(_effects_render_case(_chunk_size))
+
+@benchmark('audio.effects[cached_switch]')
+def bench_cached_effects(ctx):
+    """预渲染变体命中时的实时路径：每块切换一次模式（含交叉淡化）"""
+    from audio_effects import EffectEngine, VariantCache, VariantRenderer, render_pitch, PITCH_MODES, EFFECTS
+    audio_processor = ctx['audio_processor']
+    sample_rate = audio_processor.sample_rate
+    audio = ctx['audio'][:sample_rate * 2]
+    cache = VariantCache()
+    renderer = VariantRenderer(cache, sample_rate, segment_seconds=len(audio) / sample_rate)
+    for mode in PITCH_MODES:
+        cache.put(('bench', mode, 0), render_pitch(audio, EFFECTS[mode]['pitch'], sample_rate))
+    engine = EffectEngine(sample_rate, cache, renderer)
+    engine.set_media('bench')
+    block = 1024
+    positions = Cycle(list(range(0, len(audio) - block, block)))
+    modes = Cycle(['pitch_up', 'pitch_down', None, 'volume_up'])
+
+    def run():
+        position = positions.next()
+        engine.process(audio[position:position + block], modes.next(), position)
+    return run
+
+def measure(func, iterations, warmup):
+    """运行用例并统计延迟分布"""
+    for _ in range(warmup):
+        func()
+    latencies = np.empty(iterations, dtype=np.float64)
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        func()
+        latencies[i] = time.perf_counter() - t0
+    total = time.perf_counter() - start
+    return {
+        'iterations': iterations,
+        'throughput': iterations / total if total > 0 else 0.0,
+        'mean_ms': float(latencies.mean() * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def build_context(args):
+    from head_pose_detector import HeadPoseDetector
+    from audio_processor import AudioProcessor
+    detector = HeadPoseDetector()
+    landmarks = []
+    landmarks_source = 'synthetic'
+    if args.recording:
+        frames, landmarks = load_recording(args.recording, args.frames)
+        if landmarks:
+            landmarks_source = 'recording'
+    else:
+        frames = load_frames(args.video, args.frames)
+    if not landmarks and (args.recording or args.video):
+        landmarks = detect_landmarks(detector, frames)
+        landmarks_source = 'facemesh'
+    if not landmarks:
+        logger.warning("No face in the input frames: FaceMesh cases measure the no-face path only, "
+                       "landmark cases use synthetic landmarks")
+        landmarks = synthetic_landmarks(args.frames)
+        landmarks_source = 'synthetic'
+    return {
+        'frames': frames,
+        'landmarks': landmarks,
+        'landmarks_source': landmarks_source,
+        'audio': load_audio(args.audio),
+        'detector': detector,
+        'audio_processor': AudioProcessor(),
+    }
+
+def run_benchmarks(args):
+    ctx = build_context(args)
+    results = {}
+    for name, (setup, iteration_scale) in BENCHMARKS.items():
+        if args.only and not any(fnmatch.fnmatch(name, pattern) for pattern in args.only):
+            continue
+        iterations = max(1, int(args.iterations * iteration_scale))
+        results[name] = measure(setup(ctx), iterations, args.warmup)
+        logger.info(f"{name}: {results[name]['throughput']:.1f}/s "
+                    f"p50={results[name]['p50_ms']:.3f}ms p99={results[name]['p99_ms']:.3f}ms")
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'frame_source': args.recording or args.video or 'synthetic',
+            'landmarks_source': ctx['landmarks_source'],
+            'face_frames': len(ctx['landmarks']) if ctx['landmarks_source'] != 'synthetic' else 0,
+            'audio_source': args.audio or 'synthetic',
+        },
+        'results': results,
+    }
+
+def compare(report, baseline, tolerance):
+    """比较 p50 延迟，返回回归用例列表"""
+    regressions = []
+    for name, current in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or previous['p50_ms'] <= 0:
+            continue
+        ratio = current['p50_ms'] / previous['p50_ms']
+        status = 'REGRESSION' if ratio > 1 + tolerance else 'ok'
+        logger.info(f"{name}: p50 {previous['p50_ms']:.3f}ms -> {current['p50_ms']:.3f}ms "
+                    f"({ratio:.2f}x) {status}")
+        if status != 'ok':
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Camera-free benchmarks for the attention pipeline')
+    parser.add_argument('--video', help='replay frames from a recorded video instead of synthetic frames')
+    parser.add_argument('--recording', help='replay frames (and landmarks.bin if present) from a frame_source recording')
+    parser.add_argument('--audio', help='replay audio from a 16-bit PCM WAV instead of synthetic noise')
+    parser.add_argument('--frames', type=int, default=60, help='number of distinct frames to cycle through')
+    parser.add_argument('-n', '--iterations', type=int, default=1000, help='iterations per benchmark')
+    parser.add_argument('--warmup', type=int, default=10, help='warm-up iterations per benchmark')
+    parser.add_argument('--only', action='append', help='run benchmarks matching this glob (repeatable)')
+    parser.add_argument('-o', '--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed p50 slowdown before failing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Report written to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            logger.error(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -2,34 +2,191 @@ import asyncio
 import websockets
 import json
 import cv2
+import numpy as np
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from head_pose_detector import HeadPoseDetector
-from audio_processor import AudioProcessor
+from attention_stats import AttentionStats
+from status_codec import pack_result
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class AttentionController:
+MAX_FRAME_BYTES = 2 * 1024 * 1024  # 单条二进制消息（一帧 JPEG）的上限
+TRY_AGAIN_LATER = 1013  # websocket 关闭码：服务端暂时过载
+
+class FrameConnection:
+    """单个 websocket 连接的帧接入状态
+
+    只保留最新一帧：上一帧尚未开始推理时收到新帧，旧帧直接被替换并计入 dropped。
+    每个连接使用独立的 HeadPoseDetector，FaceMesh 跟踪状态和闭眼计时互不干扰；
+    发送帧的连接数受 AttentionController.max_frame_connections 限制，只订阅结果的连接不占名额。
+    """
     def __init__(self):
-        self.head_detector = HeadPoseDetector()
-        self.audio_processor = AudioProcessor()
+        self.admitted = False
+        self.pending = None
+        self.frame_ready = asyncio.Event()
+        self.detector = None
+        self.detector_lock = threading.Lock()  # close 须等待执行器中进行中的推理结束
+        self.closed = False
+        self.seq = 0
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def offer(self, jpeg):
+        self.received += 1
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = (jpeg, time.time())
+        self.frame_ready.set()
+
+    def take(self):
+        frame, self.pending = self.pending, None
+        self.frame_ready.clear()
+        return frame
+
+    def analyze(self, jpeg, timestamp):
+        """在执行器线程中运行：解码 JPEG 并推理"""
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError('Invalid JPEG frame')
+        with self.detector_lock:
+            if self.closed:
+                raise ValueError('Connection closed')
+            if self.detector is None:
+                from detection_cascade import build_detector
+                self.detector = build_detector()
+            distracted, reason, _ = self.detector.is_distracted(frame, timestamp, annotate=False)
+        return distracted, reason
+
+    def close(self):
+        """连接断开时释放 FaceMesh 图（在执行器线程中调用，等待进行中的推理）"""
+        with self.detector_lock:
+            self.closed = True
+            if self.detector is not None:
+                self.detector.close()
+                self.detector = None
+
+    def stats(self):
+        return {'received': self.received, 'processed': self.processed, 'dropped': self.dropped}
+
+class AttentionController:
+    """FaceMesh 与音频处理都在首次使用时才创建
+
+    start_warmup() 在后台线程中构建 FaceMesh 并用空白帧预热，
+    服务可以先开始接受请求，detector_ready 置位后即可推理。
+    """
+    def __init__(self, max_workers=4, max_frame_connections=None):
+        self._head_detector = None
+        self._audio_processor = None
+        self.init_lock = threading.Lock()
+        self.detector_ready = threading.Event()
+        self.warmup_seconds = None
+        self.warmup_error = None
         self.intervention_type = None
-        self.distraction_timestamps = []
+        self.attention_stats = AttentionStats()  # 固定内存的滚动统计
+        self.detector_lock = threading.Lock()  # HeadPoseDetector 不是线程安全的
+        self.pipeline = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ws-infer')
+        # 每个发送帧的连接持有一个 FaceMesh 图，超出上限的连接在发送首帧时被拒绝
+        self.max_frame_connections = max_frame_connections or int(
+            os.environ.get('MINDLESS_MAX_FRAME_CONNECTIONS', max_workers))
+        self.frame_connections = 0
+        self.rejected_connections = 0
+
+    @property
+    def head_detector(self):
+        """首次访问时构建 HeadPoseDetector（预热线程正在构建时等待其完成）
+
+        设置了 MINDLESS_CASCADE 时返回同接口的分级检测包装，见 detection_cascade。
+        """
+        if self._head_detector is None:
+            with self.init_lock:
+                if self._head_detector is None:
+                    from detection_cascade import build_detector
+                    self._head_detector = build_detector()
+        return self._head_detector
+
+    @property
+    def audio_processor(self):
+        if self._audio_processor is None:
+            with self.init_lock:
+                if self._audio_processor is None:
+                    from audio_processor import AudioProcessor
+                    self._audio_processor = AudioProcessor()
+        return self._audio_processor
+
+    @property
+    def audio_loaded(self):
+        return self._audio_processor is not None
+
+    def cascade_stats(self):
+        """分级检测各级命中率；未启用级联或检测器尚未构建时 tiers 为空"""
+        detector = self._head_detector
+        if detector is None or not hasattr(detector, 'stats'):
+            return {'tiers': []}
+        return detector.stats()
+
+    def set_distraction_state(self, distracted):
+        """把分心状态转发给音频处理；音频尚未使用时忽略"""
+        if self._audio_processor is not None:
+            self._audio_processor.set_distraction_state(distracted)
+
+    def warm_up(self, frame_shape=(480, 640, 3)):
+        """构建 FaceMesh 并用空白帧跑一次推理，让首个真实帧不再承担图初始化开销"""
+        start = time.time()
+        try:
+            detector = self.head_detector
+            with self.detector_lock:
+                detector.is_distracted(np.full(frame_shape, 127, dtype=np.uint8))
+                # 预热帧不应影响跟踪与闭眼计时
+                detector.reset_state()
+            self.warmup_seconds = time.time() - start
+            logger.info(f"FaceMesh warmed up in {self.warmup_seconds:.2f}s")
+        except Exception as e:
+            self.warmup_error = str(e)
+            logger.error(f"FaceMesh warm-up failed: {e}")
+        finally:
+            self.detector_ready.set()
+
+    def start_warmup(self):
+        thread = threading.Thread(target=self.warm_up, name='facemesh-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def analyze_frame(self, frame, landmarks=None, annotate=True):
+        """串行化对 HeadPoseDetector 的调用；landmarks 为回放录制中的预计算关键点
+
+        返回 (distracted, reason, vis_frame, overlay_points)，overlay_points 为
+        客户端绘制叠加层所需的关键点副本 (5, 2)，未检测到人脸时为 None。
+        """
+        with self.detector_lock:
+            detector = self.head_detector
+            distracted, reason, vis_frame = detector.is_distracted(frame, landmarks=landmarks, annotate=annotate)
+            overlay_points = None
+            if detector.last_landmarks is not None:
+                overlay_points = np.asarray(detector.last_landmarks)[detector.OVERLAY_INDICES, :2].astype(np.float32)
+        self.attention_stats.update(distracted, time.time())
+        return distracted, reason, vis_frame, overlay_points
+
+    def attach_pipeline(self, pipeline):
+        """让 websocket 客户端订阅共享推理结果"""
+        self.pipeline = pipeline
         
     def process_frame(self, frame):  # Remove async
         try:
-            distracted, reason, vis_frame = self.head_detector.is_distracted(frame)
+            distracted, reason, vis_frame, _ = self.analyze_frame(frame)
             timestamp = datetime.now().isoformat()
             
-            if distracted:
-                self.distraction_timestamps.append(timestamp)
-            
             return {
                 'distracted': bool(distracted),
                 'timestamp': timestamp,
-                'total_distractions': len(self.distraction_timestamps),
+                'total_distractions': self.attention_stats.total_distracted_frames,
                 'reason': reason
             }
         except Exception as e:
@@ -37,7 +194,7 @@ class AttentionController:
             return {
                 'distracted': True,
                 'timestamp': datetime.now().isoformat(),
-                'total_distractions': len(self.distraction_timestamps),
+                'total_distractions': self.attention_stats.total_distracted_frames,
                 'reason': {'error': str(e)}
             }
 
@@ -45,23 +202,109 @@ class AttentionController:
         """Set intervention type: 'mindless', 'warning', or 'control'"""
         self.intervention_type = type_name
 
-    async def websocket_handler(self, websocket, path):
+    async def websocket_handler(self, websocket, path=None):
+        """二进制消息为 JPEG 帧，回复 status_codec 编码的结果；文本消息为 JSON 控制命令
+
+        控制命令：{"subscribe": true} 订阅共享推理流水线的结果，{"stats": true} 查询本连接统计。
+        """
+        connection = FrameConnection()
+        process_task = asyncio.ensure_future(self._process_frames(websocket, connection))
+        forward_task = None
         try:
             async for message in websocket:
-                data = json.loads(message)
-                if 'frame' in data:
-                    frame = cv2.imdecode(np.frombuffer(data['frame'], np.uint8), cv2.IMREAD_COLOR)
-                    result = await self.process_frame(frame)
-                    await websocket.send(json.dumps(result))
+                if isinstance(message, bytes):
+                    if not connection.admitted:
+                        if self.frame_connections >= self.max_frame_connections:
+                            self.rejected_connections += 1
+                            logger.warning(f"Rejecting frame connection ({self.frame_connections} active)")
+                            await websocket.send(json.dumps({'error': 'Too many frame connections'}))
+                            await websocket.close(TRY_AGAIN_LATER, 'Too many frame connections')
+                            break
+                        connection.admitted = True
+                        self.frame_connections += 1
+                    connection.offer(message)
+                    continue
+                try:
+                    command = json.loads(message)
+                except ValueError:
+                    await websocket.send(json.dumps({'error': 'Invalid control message'}))
+                    continue
+                if command.get('subscribe') and forward_task is None and self.pipeline is not None:
+                    forward_task = asyncio.ensure_future(self._forward_pipeline_results(websocket))
+                if command.get('stats'):
+                    await websocket.send(json.dumps(connection.stats()))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            process_task.cancel()
+            if forward_task is not None:
+                forward_task.cancel()
+            if connection.admitted:
+                self.frame_connections -= 1
+            self.executor.submit(connection.close)
+            if connection.processed or connection.dropped:
+                logger.info(f"Frame connection closed: {connection.stats()}")
+
+    async def _process_frames(self, websocket, connection):
+        """逐帧推理；推理期间到达的帧只保留最新一帧"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await connection.frame_ready.wait()
+                jpeg, timestamp = connection.take()
+                connection.seq += 1
+                try:
+                    distracted, reason = await loop.run_in_executor(
+                        self.executor, connection.analyze, jpeg, timestamp)
+                except Exception as e:
+                    logger.warning(f"Frame rejected: {e}")
+                    distracted, reason = True, {}
+                connection.processed += 1
+                await websocket.send(pack_result(connection.seq, distracted, reason))
         except websockets.exceptions.ConnectionClosed:
             pass
 
+    async def _forward_pipeline_results(self, websocket):
+        """把共享推理结果推送给 websocket 客户端，只保留最新一条"""
+        loop = asyncio.get_running_loop()
+        latest = asyncio.Queue(maxsize=1)
+
+        def put_latest(result):
+            if latest.full():
+                latest.get_nowait()
+            latest.put_nowait(result)
+
+        def on_result(result):
+            loop.call_soon_threadsafe(put_latest, result)
+
+        self.pipeline.subscribe(on_result)
+        try:
+            while True:
+                result = await latest.get()
+                await websocket.send(pack_result(result.seq, result.distracted, result.reason))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.pipeline.unsubscribe(on_result)
+
+def serve_in_thread(controller, host="localhost", port=8765):
+    """在后台线程中运行 websocket 服务（供 app.py 共享推理结果）"""
+    async def run():
+        server = await websockets.serve(controller.websocket_handler, host, port,
+                                        max_size=MAX_FRAME_BYTES)
+        await server.wait_closed()
+
+    thread = threading.Thread(target=lambda: asyncio.run(run()), daemon=True)
+    thread.start()
+    return thread
+
 async def main():
     controller = AttentionController()
     server = await websockets.serve(
         controller.websocket_handler,
         "localhost",
-        8765
+        8765,
+        max_size=MAX_FRAME_BYTES
     )
     await server.wait_closed()
 
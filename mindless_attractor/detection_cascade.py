@@ -0,0 +1,213 @@
+"""分级检测：先用廉价的判断，只有结论取决于精细模型时才运行带细化的 FaceMesh
+
+各级（MINDLESS_CASCADE 以逗号分隔选择，留空则不启用级联）：
+    static    帧差门限：缩略图与上次完整分析的帧几乎相同，沿用上次的关键点（闭眼计时照常推进）
+    presence  未在跟踪人脸时，先用缩小输入的 FaceDetection 判断有无人脸与是否明显转头
+    mesh      不做细化的 FaceMesh；姿态明显超阈值或眼睛明显睁/闭时直接给出结论
+    refine    带虹膜/眼周细化的 FaceMesh（原有模型），只处理接近阈值的帧
+最终结论都经由同一个 HeadPoseDetector.is_distracted 得出，闭眼计时与 reason 结构不变。
+"""
+import logging
+import os
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+import metrics
+import pose_kernel
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('static', 'presence', 'mesh', 'refine')
+
+RESOLVED = {tier: metrics.counter(f'cascade_{tier}_resolved_total', f'Frames resolved by the {tier} cascade tier')
+            for tier in TIERS}
+TIER_SECONDS = {tier: metrics.histogram(f'cascade_{tier}_seconds', f'Time spent in the {tier} cascade tier')
+                for tier in TIERS}
+
+STATIC_THUMB_SIZE = (64, 48)
+STATIC_DIFF_THRESHOLD = 2.0   # 缩略图平均灰度差（0-255）
+STATIC_MAX_AGE = 0.5          # 沿用上次结果的最长时间（秒）
+PRESENCE_INPUT_WIDTH = 192
+PRESENCE_TURN_RATIO = 0.6     # 鼻尖偏离两眼中点超过眼距的该比例视为明显转头
+POSE_MARGIN = 5.0             # 姿态角距阈值小于该值（度）时需要细化模型
+EAR_MARGIN = 0.04             # EAR 距阈值小于该值时需要细化模型
+
+def tiers_from_env():
+    spec = os.environ.get('MINDLESS_CASCADE', '')
+    tiers = tuple(t.strip() for t in spec.split(',') if t.strip())
+    unknown = set(tiers) - set(TIERS)
+    if unknown:
+        raise ValueError(f"Unknown cascade tiers: {sorted(unknown)}")
+    return tiers
+
+def build_detector(tiers=None):
+    """按 tiers（默认读取 MINDLESS_CASCADE）返回 HeadPoseDetector 或其级联包装"""
+    from head_pose_detector import HeadPoseDetector
+    tiers = tiers_from_env() if tiers is None else tuple(tiers)
+    detector = HeadPoseDetector()
+    if not tiers:
+        return detector
+    logger.info(f"Detection cascade enabled: {', '.join(tiers)}")
+    return DetectionCascade(detector, tiers)
+
+class DetectionCascade:
+    """与 HeadPoseDetector 相同的 is_distracted / last_landmarks 接口"""
+    def __init__(self, detector, tiers=TIERS):
+        self.detector = detector
+        self.tiers = tuple(t for t in TIERS if t in tiers)
+        self.OVERLAY_INDICES = detector.OVERLAY_INDICES
+        self.fast_detector = None   # 不细化的 FaceMesh，首次使用时创建
+        self.face_detection = None
+        self.last_thumb = None
+        self.last_time = None
+        self.last_landmarks_copy = None  # 上次完整分析的关键点；NaN 表示无人脸
+        self.last_turned = None          # 上次由 presence 级判定为转头时的 reason
+        self.frames = 0
+        self.resolved = dict.fromkeys(TIERS, 0)
+
+    @property
+    def last_landmarks(self):
+        return self.detector.last_landmarks
+
+    def reset_state(self):
+        self.detector.reset_state()
+        if self.fast_detector is not None:
+            self.fast_detector.reset_state()
+        self.last_thumb = self.last_time = self.last_landmarks_copy = self.last_turned = None
+
+    def _resolve(self, tier, start):
+        TIER_SECONDS[tier].observe(perf_counter() - start)
+        RESOLVED[tier].inc()
+        self.resolved[tier] += 1
+
+    def is_distracted(self, frame, timestamp=None, landmarks=None, annotate=True):
+        if landmarks is not None:  # 回放的预计算关键点，无需任何检测
+            return self.detector.is_distracted(frame, timestamp, landmarks, annotate)
+        self.frames += 1
+        now = timestamp if timestamp is not None else perf_counter()
+
+        if 'static' in self.tiers:
+            start = perf_counter()
+            result = self._static(frame, timestamp, now, annotate)
+            if result is not None:
+                self._resolve('static', start)
+                return result
+
+        tracking = any(d is not None and d.last_face_box is not None
+                       for d in (self.detector, self.fast_detector))
+        if 'presence' in self.tiers and not tracking:
+            start = perf_counter()
+            result = self._presence(frame, timestamp, annotate)
+            if result is not None:
+                self._resolve('presence', start)
+                return result
+
+        if 'mesh' in self.tiers:
+            start = perf_counter()
+            landmarks = self._fast_landmarks(frame)
+            if landmarks is None or 'refine' not in self.tiers or not self._needs_refinement(landmarks):
+                result = self._judge(frame, timestamp, landmarks, annotate)
+                self._resolve('mesh', start)
+                return result
+
+        # 未启用 mesh 级时所有剩余帧都由细化模型处理
+        start = perf_counter()
+        landmarks = self.detector.get_face_landmarks(frame)
+        result = self._judge(frame, timestamp, landmarks, annotate)
+        self._resolve('refine', start)
+        return result
+
+    def _judge(self, frame, timestamp, landmarks, annotate):
+        """由给定关键点（None 表示无人脸）得出结论，并记录为静态帧可沿用的结果"""
+        if landmarks is None:
+            landmarks = np.full((468, 3), np.nan)
+        self.last_landmarks_copy = np.array(landmarks)
+        self.last_turned = None
+        return self.detector.is_distracted(frame, timestamp, self.last_landmarks_copy, annotate)
+
+    def _thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, STATIC_THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _static(self, frame, timestamp, now, annotate):
+        """画面与上次完整分析的帧几乎相同时沿用其关键点；否则更新参考帧并返回 None"""
+        thumb = self._thumbnail(frame)
+        reusable = (self.last_thumb is not None and now - self.last_time <= STATIC_MAX_AGE and
+                    (self.last_landmarks_copy is not None or self.last_turned is not None))
+        if reusable and np.abs(thumb - self.last_thumb).mean() < STATIC_DIFF_THRESHOLD:
+            if self.last_turned is not None:
+                self.detector.last_landmarks = None
+                return True, self.last_turned, frame.copy() if annotate else None
+            return self.detector.is_distracted(frame, timestamp, self.last_landmarks_copy, annotate)
+        self.last_thumb, self.last_time = thumb, now
+        return None
+
+    def _presence(self, frame, timestamp, annotate):
+        """缩小输入的人脸检测：无人脸或明显转头时直接给出结论"""
+        if self.face_detection is None:
+            import mediapipe as mp
+            self.face_detection = mp.solutions.face_detection.FaceDetection(
+                model_selection=0, min_detection_confidence=0.5)
+        h, w = frame.shape[:2]
+        small = frame
+        if w > PRESENCE_INPUT_WIDTH:
+            small = cv2.resize(frame, (PRESENCE_INPUT_WIDTH, int(h * PRESENCE_INPUT_WIDTH / w)),
+                               interpolation=cv2.INTER_AREA)
+        results = self.face_detection.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if not results.detections:
+            return self._judge(frame, timestamp, None, annotate)
+
+        # 关键点顺序：右眼、左眼、鼻尖、嘴、右耳屏、左耳屏（归一化坐标）
+        keypoints = results.detections[0].location_data.relative_keypoints
+        right_eye, left_eye, nose = keypoints[0], keypoints[1], keypoints[2]
+        eye_distance = abs(left_eye.x - right_eye.x)
+        ratio = (nose.x - (left_eye.x + right_eye.x) / 2) / max(eye_distance, 1e-6)
+        if abs(ratio) < PRESENCE_TURN_RATIO:
+            return None
+        self.detector.last_landmarks = None
+        self.last_landmarks_copy = None
+        self.last_turned = {
+            "head_pose": {"yaw": None, "pitch": None},
+            "eyes": {"closed": None, "closed_duration": None},
+            "attention_level": "distracted",
+            "reason": "Head turned away",
+            "turn_ratio": float(ratio)
+        }
+        return True, self.last_turned, frame.copy() if annotate else None
+
+    def _fast_landmarks(self, frame):
+        if self.fast_detector is None:
+            from head_pose_detector import HeadPoseDetector
+            self.fast_detector = HeadPoseDetector(refine_landmarks=False)
+        return self.fast_detector.get_face_landmarks(frame)
+
+    def _needs_refinement(self, landmarks):
+        """姿态已明显超阈值时结论确定；否则任一指标接近阈值都需要细化模型"""
+        yaw, pitch, ear = pose_kernel.compute_metrics(landmarks)
+        d = self.detector
+        if abs(yaw) > d.YAW_THRESHOLD + POSE_MARGIN or abs(pitch) > d.PITCH_THRESHOLD + POSE_MARGIN:
+            return False
+        return (abs(abs(yaw) - d.YAW_THRESHOLD) < POSE_MARGIN or
+                abs(abs(pitch) - d.PITCH_THRESHOLD) < POSE_MARGIN or
+                abs(ear - d.EAR_THRESHOLD) < EAR_MARGIN)
+
+    def close(self):
+        """释放各级使用的 MediaPipe 图"""
+        self.detector.close()
+        if self.fast_detector is not None:
+            self.fast_detector.close()
+        if self.face_detection is not None:
+            self.face_detection.close()
+            self.face_detection = None
+
+    def stats(self):
+        frames = self.frames
+        return {
+            'tiers': list(self.tiers),
+            'frames': frames,
+            'resolved': dict(self.resolved),
+            'hit_rates': {tier: (n / frames if frames else None) for tier, n in self.resolved.items()
+                          if tier in self.tiers},
+        }
@@ -0,0 +1,358 @@
+"""可插拔的帧源：摄像头、录制与回放
+
+所有帧源都提供与 cv2.VideoCapture 相同的 isOpened() / read(image) / release() 接口，
+CameraManager 通过 source_factory 创建帧源。
+
+录制格式为一个目录，索引与时间戳可直接 np.memmap：
+    meta.json       帧形状、dtype 与编码（jpeg 或 raw）
+    frames.bin      jpeg：逐帧 JPEG 数据首尾相接；raw：连续的原始帧 (N, H, W, C) uint8
+    offsets.bin     jpeg 编码时每帧数据的结束偏移 (N,) int64
+    timestamps.bin  采集时间 (N,) float64
+    landmarks.bin   可选，预计算关键点 (N, 478, 3) float32，无人脸的帧为 NaN
+640x480 30 fps 时 raw 约 27 MB/s，JPEG（质量 90）通常为 1-2 MB/s，因此默认使用 JPEG；
+raw 回放无需解码，适合对回放 CPU 开销敏感的基准测试（MINDLESS_RECORD_ENCODING=raw）。
+同一目录再次录制时在末尾追加（摄像头重连、多次开始/停止监控都写入同一录制）。
+
+用法:
+    python frame_source.py record session_dir --seconds 60
+    python frame_source.py precompute session_dir
+    MINDLESS_FRAME_SOURCE=replay:session_dir MINDLESS_REPLAY_SPEED=4 python app.py
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LANDMARK_SHAPE = (478, 3)
+LANDMARK_BYTES = int(np.prod(LANDMARK_SHAPE)) * 4  # 每帧 float32
+ENCODINGS = ('jpeg', 'raw')
+JPEG_QUALITY = 90
+REPLAY_MAX_GAP = 1.0  # 回放时录制中超过该间隔（秒）的停顿不等待，如两次监控之间
+
+class CameraSource:
+    """本地摄像头，依次尝试 indices 中的设备"""
+    def __init__(self, indices=(0, 1), width=640, height=480, fps=30):
+        self.cap = None
+        for camera_index in indices:
+            self.cap = cv2.VideoCapture(camera_index)
+            if self.cap.isOpened():
+                break
+        if not self.cap.isOpened():
+            return
+
+        props = {
+            cv2.CAP_PROP_FRAME_WIDTH: width,
+            cv2.CAP_PROP_FRAME_HEIGHT: height,
+            cv2.CAP_PROP_FPS: fps,
+            cv2.CAP_PROP_BUFFERSIZE: 1
+        }
+        for prop, value in props.items():
+            if not self.cap.set(prop, value):
+                logger.warning(f"Failed to set camera property {prop}")
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def read(self, image=None):
+        return self.cap.read(image)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+class FrameRecorder:
+    """把帧与时间戳追加写入录制目录；目录中已有录制时接着写入"""
+    def __init__(self, path, encoding='jpeg', quality=JPEG_QUALITY):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown recording encoding: {encoding}")
+        self.path = path
+        self.meta = None
+        self.encoding = encoding
+        self.quality = quality
+        self.count = 0
+        self.frame_bytes = 0  # frames.bin 中已写入的字节数
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self._file('meta.json')):
+            self._resume()
+        self.frames_file = open(self._file('frames.bin'), 'ab')
+        self.timestamps_file = open(self._file('timestamps.bin'), 'ab')
+        self.offsets_file = open(self._file('offsets.bin'), 'ab') if self.encoding == 'jpeg' else None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _resume(self):
+        """沿用已有录制的格式，并把各文件截断到最后一个完整的帧"""
+        recording = Recording(self.path)
+        self.meta = recording.meta
+        self.encoding = recording.encoding
+        self.count = len(recording)
+        self.frame_bytes = recording.frame_bytes_used()
+        landmark_count = len(recording.landmarks) if recording.landmarks is not None else 0
+        del recording  # 截断前释放内存映射
+        os.truncate(self._file('frames.bin'), self.frame_bytes)
+        os.truncate(self._file('timestamps.bin'), self.count * 8)
+        if self.encoding == 'jpeg':
+            os.truncate(self._file('offsets.bin'), self.count * 8)
+        if os.path.exists(self._file('landmarks.bin')):
+            # 只保留已有帧的预计算关键点，追加的帧没有关键点
+            os.truncate(self._file('landmarks.bin'), landmark_count * LANDMARK_BYTES)
+        logger.info(f"Appending to recording {self.path} ({self.count} frames)")
+
+    def append(self, frame, timestamp):
+        if self.meta is None:
+            self.meta = {'shape': list(frame.shape), 'dtype': str(frame.dtype), 'encoding': self.encoding}
+            self._write_meta()
+        elif list(frame.shape) != self.meta['shape']:
+            logger.warning(f"Skipping frame with shape {frame.shape} (recording {self.meta['shape']})")
+            return
+        if self.encoding == 'jpeg':
+            ok, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                logger.warning("Failed to encode frame, skipping")
+                return
+            self.frames_file.write(data.data)
+            self.frame_bytes += len(data)
+            self.offsets_file.write(np.int64(self.frame_bytes).tobytes())
+        else:
+            data = np.ascontiguousarray(frame)
+            self.frames_file.write(data.data)
+            self.frame_bytes += data.nbytes
+        self.timestamps_file.write(np.float64(timestamp).tobytes())
+        self.count += 1
+
+    def _write_meta(self):
+        with open(self._file('meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    def flush(self):
+        for f in (self.frames_file, self.offsets_file, self.timestamps_file):
+            if f is not None:
+                f.flush()
+
+    def close(self):
+        for f in (self.frames_file, self.offsets_file, self.timestamps_file):
+            if f is not None:
+                f.close()
+        logger.info(f"Recorded {self.count} frames to {self.path}")
+
+class RecordingSource:
+    """包装另一个帧源，读取到的每一帧同时写入录制目录
+
+    recorder 可以被多个 RecordingSource 先后共享（摄像头重连、重新开始监控），
+    release 只刷新文件；close_recorder=True 时 release 同时关闭录制。
+    """
+    def __init__(self, inner, recorder, close_recorder=False):
+        self.inner = inner
+        self.recorder = recorder
+        self.close_recorder = close_recorder
+
+    def isOpened(self):
+        return self.inner.isOpened()
+
+    def read(self, image=None):
+        ret, frame = self.inner.read(image)
+        if ret:
+            self.recorder.append(frame, time.time())
+        return ret, frame
+
+    def release(self):
+        self.inner.release()
+        if self.close_recorder:
+            self.recorder.close()
+        else:
+            self.recorder.flush()
+
+class Recording:
+    """以内存映射方式打开录制目录"""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.encoding = self.meta.get('encoding', 'raw')  # 早期录制没有 encoding 字段
+        # 以各文件中完整写入的帧数的最小值为准，录制进程异常退出时也能读取已写完的帧
+        data_size = os.path.getsize(self._file('frames.bin'))
+        count = os.path.getsize(self._file('timestamps.bin')) // 8
+        self.offsets = None
+        if self.encoding == 'jpeg':
+            count = min(count, os.path.getsize(self._file('offsets.bin')) // 8)
+            offsets = self._memmap('offsets.bin', np.int64, (count,))
+            count = int(np.searchsorted(offsets, data_size, 'right'))  # 数据未写完的帧不计入
+            self.offsets = offsets[:count]
+            self.frames = self._memmap('frames.bin', np.uint8, (data_size,))
+        else:
+            count = min(count, data_size // (int(np.prod(self.shape)) * self.dtype.itemsize))
+            self.frames = self._memmap('frames.bin', self.dtype, (count,) + self.shape)
+        self.timestamps = self._memmap('timestamps.bin', np.float64, (count,))
+        self.landmarks = None
+        if os.path.exists(self._file('landmarks.bin')):
+            # 预计算之后追加的帧不在 landmarks.bin 中，只映射已覆盖的部分
+            landmark_count = min(count, os.path.getsize(self._file('landmarks.bin')) // LANDMARK_BYTES)
+            self.landmarks = self._memmap('landmarks.bin', np.float32, (landmark_count,) + LANDMARK_SHAPE)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _memmap(self, name, dtype, shape):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)  # 空文件无法映射
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame_bytes_used(self):
+        """前 len(self) 帧在 frames.bin 中占用的字节数"""
+        if self.encoding == 'jpeg':
+            return int(self.offsets[-1]) if len(self) else 0
+        return len(self) * int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def frame(self, index):
+        """第 index 帧；raw 编码返回只读映射视图，jpeg 编码返回解码后的新数组"""
+        if self.encoding == 'raw':
+            return self.frames[index]
+        start = int(self.offsets[index - 1]) if index > 0 else 0
+        frame = cv2.imdecode(self.frames[start:int(self.offsets[index])], cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError(f"Corrupt frame {index} in {self.path}")
+        return frame
+
+class ReplaySource:
+    """按录制时的时间间隔回放；speed > 1 加速，speed <= 0 表示不等待、尽快回放"""
+    def __init__(self, path, speed=1.0, loop=False):
+        self.recording = Recording(path)
+        self.speed = speed
+        self.loop = loop
+        self.index = -1  # 最近一次 read 返回的帧在录制中的位置
+        self.finished = False
+        self.start_wall = None
+        self.start_stamp = None
+        self.last_stamp = None
+
+    def isOpened(self):
+        return len(self.recording) > 0 and not self.finished
+
+    def read(self, image=None):
+        i = self.index + 1
+        if i >= len(self.recording):
+            if not self.loop:
+                self.finished = True
+                return False, None
+            i = 0
+            self.start_wall = None
+
+        if self.speed > 0:
+            stamp = self.recording.timestamps[i]
+            if self.last_stamp is not None and not 0 <= stamp - self.last_stamp <= REPLAY_MAX_GAP:
+                self.start_wall = None  # 录制中的停顿不等待，从这一帧重新对齐
+            self.last_stamp = stamp
+            if self.start_wall is None:
+                self.start_wall, self.start_stamp = time.monotonic(), stamp
+            delay = self.start_wall + (stamp - self.start_stamp) / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        frame = self.recording.frame(i)
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+        elif self.recording.encoding == 'raw':
+            image = np.array(frame)
+        else:
+            image = frame
+        self.index = i
+        return True, image
+
+    def landmarks_at(self, index):
+        """录制中第 index 帧的预计算关键点；未预计算（包括预计算之后追加的帧）时返回 None"""
+        landmarks = self.recording.landmarks
+        if landmarks is None or not 0 <= index < len(landmarks):
+            return None
+        return self.recording.landmarks[index]
+
+    def release(self):
+        self.finished = True
+
+def precompute_landmarks(path, progress=None):
+    """对录制中的每一帧运行 FaceMesh 并写入 landmarks.bin"""
+    from head_pose_detector import HeadPoseDetector
+    recording = Recording(path)
+    detector = HeadPoseDetector()
+    out = np.memmap(recording._file('landmarks.bin'), dtype=np.float32, mode='w+',
+                    shape=(len(recording),) + LANDMARK_SHAPE)
+    for i in range(len(recording)):
+        points = detector.get_face_landmarks(np.array(recording.frame(i)))
+        if points is None or points.shape != LANDMARK_SHAPE:
+            out[i] = np.nan
+        else:
+            out[i] = points
+        if progress and i % 100 == 0:
+            progress(i, len(recording))
+    out.flush()
+    return len(recording)
+
+def source_factory_from_env():
+    """由 MINDLESS_FRAME_SOURCE 选择帧源：camera（默认）、replay:<目录>、record:<目录>"""
+    spec = os.environ.get('MINDLESS_FRAME_SOURCE', 'camera')
+    kind, _, path = spec.partition(':')
+    if kind == 'replay':
+        speed = float(os.environ.get('MINDLESS_REPLAY_SPEED', 1.0))
+        loop = os.environ.get('MINDLESS_REPLAY_LOOP', '0') == '1'
+        logger.info(f"Frame source: replay {path} (speed={speed}, loop={loop})")
+        return lambda: ReplaySource(path, speed=speed, loop=loop)
+    if kind == 'record':
+        # 录制器只创建一次，摄像头重连与重新开始监控都接着写入，不会覆盖之前的帧
+        encoding = os.environ.get('MINDLESS_RECORD_ENCODING', 'jpeg')
+        recorder = FrameRecorder(path, encoding)
+        logger.info(f"Frame source: camera, recording to {path} ({recorder.encoding})")
+        return lambda: RecordingSource(CameraSource(), recorder)
+    return CameraSource
+
+def main():
+    parser = argparse.ArgumentParser(description='录制、预计算与查看帧录制')
+    sub = parser.add_subparsers(dest='command', required=True)
+    record = sub.add_parser('record', help='从摄像头录制')
+    record.add_argument('path')
+    record.add_argument('--seconds', type=float, default=30.0)
+    record.add_argument('--encoding', choices=ENCODINGS, default='jpeg')
+    precompute = sub.add_parser('precompute', help='预计算关键点')
+    precompute.add_argument('path')
+    info = sub.add_parser('info', help='查看录制信息')
+    info.add_argument('path')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'record':
+        source = RecordingSource(CameraSource(), FrameRecorder(args.path, args.encoding), close_recorder=True)
+        if not source.isOpened():
+            raise SystemExit('Failed to open camera')
+        deadline = time.time() + args.seconds
+        try:
+            while time.time() < deadline:
+                source.read()
+        finally:
+            source.release()
+    elif args.command == 'precompute':
+        count = precompute_landmarks(args.path, progress=lambda i, n: print(f"{i}/{n}"))
+        print(f"Precomputed landmarks for {count} frames")
+    else:
+        recording = Recording(args.path)
+        duration = recording.timestamps[-1] - recording.timestamps[0] if len(recording) > 1 else 0.0
+        print(json.dumps({
+            'frames': len(recording),
+            'shape': recording.meta['shape'],
+            'encoding': recording.encoding,
+            'bytes': recording.frame_bytes_used(),
+            'duration_seconds': round(float(duration), 3),
+            'landmarks': recording.landmarks is not None,
+        }))
+
+if __name__ == '__main__':
+    main()
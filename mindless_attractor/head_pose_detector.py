@@ -1,19 +1,44 @@
 import cv2
 import mediapipe as mp
 import numpy as np
+import logging
 from collections import deque
-from time import time
+from time import time, perf_counter
+import metrics
+import pose_kernel
+from pose_kernel import LandmarkBuffer
+
+logger = logging.getLogger(__name__)
+
+LANDMARKS_SECONDS = metrics.histogram('detector_landmarks_seconds', 'FaceMesh landmark extraction time')
+POSE_SECONDS = metrics.histogram('detector_pose_seconds', 'Head pose and EAR computation time')
+DRAW_SECONDS = metrics.histogram('detector_draw_seconds', 'Visualisation frame copy and draw time')
 
 class HeadPoseDetector:
-    def __init__(self):
+    def __init__(self, roi_tracking=True, refine_landmarks=True):
         self.mp_face_mesh = mp.solutions.face_mesh
+        self.refine_landmarks = refine_landmarks  # False 时不做虹膜/眼周细化，输出 468 个关键点
         self.face_mesh = self.mp_face_mesh.FaceMesh(
             max_num_faces=1,
-            refine_landmarks=True,
+            refine_landmarks=refine_landmarks,
             min_detection_confidence=0.5,
             min_tracking_confidence=0.5,
             static_image_mode=False  # Add this for better performance
         )
+
+        # 人脸区域跟踪：用上一帧关键点裁剪人脸区域，只对裁剪区域做缩放和颜色转换
+        self.roi_tracking = roi_tracking
+        self.roi_face_mesh = None      # 裁剪输入使用独立实例，不干扰全帧实例的跟踪状态
+        self.ROI_PADDING = 0.4         # 关键点包围框每侧外扩比例
+        self.ROI_INPUT_SIZE = 256      # 裁剪区域缩放后的最大边长
+        self.ROI_EDGE_MARGIN = 0.05    # 关键点贴近裁剪边缘（比例）视为跟踪不可靠
+        self.ROI_MAX_SCALE_CHANGE = 1.5  # 相邻帧人脸尺寸变化上限
+        self.ROI_REFRESH_FRAMES = 60   # 每隔若干帧强制全帧搜索一次
+        self.last_face_box = None      # (x0, y0, x1, y1)，帧坐标
+        self.roi_frames = 0
+        self.roi_hits = 0
+        self.full_searches = 0
+        self.landmark_buffer = LandmarkBuffer()
         
         # 姿态角度阈值
         self.YAW_THRESHOLD = 15    # 左右偏转角度阈值
@@ -42,6 +67,10 @@ class HeadPoseDetector:
         self.LEFT_EYE_INDICES = [33, 160, 158, 133, 153, 144]  # 左眼6个关键点
         self.RIGHT_EYE_INDICES = [362, 385, 387, 263, 373, 380]  # 右眼6个关键点
 
+        # 客户端绘制叠加层所需的关键点：四个眼角（连线）与鼻尖（朝向箭头起点）
+        self.OVERLAY_INDICES = [33, 133, 362, 263, 1]
+        self.last_landmarks = None  # 最近一次 is_distracted 使用的关键点（复用缓冲区）
+
         self.DRAW_COLOR = {
             'normal': (0, 255, 0),  # 绿色
             'warning': (0, 165, 255),  # 橙色
@@ -49,19 +78,94 @@ class HeadPoseDetector:
         }
 
     def get_face_landmarks(self, frame):
+        """返回帧坐标关键点 (478, 3)；数组为复用缓冲区，需要保留时请复制"""
+        if self.roi_tracking and self.last_face_box is not None and self.roi_frames < self.ROI_REFRESH_FRAMES:
+            landmarks = self._track_face_roi(frame)
+            if landmarks is not None:
+                self.roi_frames += 1
+                self.roi_hits += 1
+                self.last_face_box = self._face_box(landmarks)
+                return landmarks
+
+        # 全帧搜索（首帧、跟踪失败或定期刷新）
+        self.full_searches += 1
+        self.roi_frames = 0
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         results = self.face_mesh.process(frame_rgb)
         
         if not results.multi_face_landmarks:
+            self.last_face_box = None
             return None
             
-        landmarks = results.multi_face_landmarks[0].landmark
-        return np.array([[lm.x * frame.shape[1], lm.y * frame.shape[0], lm.z * 3000] 
-                        for lm in landmarks])
+        h, w = frame.shape[:2]
+        landmarks = self.landmark_buffer.extract(
+            results.multi_face_landmarks[0].landmark, (w, h, pose_kernel.LANDMARK_Z_SCALE))
+        self.last_face_box = self._face_box(landmarks)
+        return landmarks
+
+    def reset_state(self):
+        """清除人脸跟踪与闭眼计时（如预热帧之后）"""
+        self.last_face_box = None
+        self.roi_frames = 0
+        self.last_closed_time = None
+
+    def _face_box(self, landmarks):
+        x0, y0 = landmarks[:, :2].min(axis=0)
+        x1, y1 = landmarks[:, :2].max(axis=0)
+        return x0, y0, x1, y1
+
+    def _track_face_roi(self, frame):
+        """在上一帧人脸附近的裁剪区域内检测，返回帧坐标关键点；跟踪不可靠时返回 None"""
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = self.last_face_box
+        # 外扩为正方形区域，保持人脸比例
+        size = max(x1 - x0, y1 - y0) * (1 + 2 * self.ROI_PADDING)
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        left, top = int(max(0, cx - size / 2)), int(max(0, cy - size / 2))
+        right, bottom = int(min(w, cx + size / 2)), int(min(h, cy + size / 2))
+        crop_w, crop_h = right - left, bottom - top
+        if crop_w < 32 or crop_h < 32:
+            return None
+
+        crop = frame[top:bottom, left:right]
+        scale = min(1.0, self.ROI_INPUT_SIZE / max(crop_w, crop_h))
+        if scale < 1.0:
+            crop = cv2.resize(crop, (int(crop_w * scale), int(crop_h * scale)), interpolation=cv2.INTER_AREA)
+        crop_rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+
+        if self.roi_face_mesh is None:
+            self.roi_face_mesh = self.mp_face_mesh.FaceMesh(
+                max_num_faces=1,
+                refine_landmarks=self.refine_landmarks,
+                min_detection_confidence=0.5,
+                min_tracking_confidence=0.5,
+                static_image_mode=False
+            )
+        results = self.roi_face_mesh.process(crop_rgb)
+        if not results.multi_face_landmarks:
+            return None
+
+        # 映射回帧坐标；z 与全帧模式一样以帧宽为尺度
+        landmarks = self.landmark_buffer.extract(
+            results.multi_face_landmarks[0].landmark,
+            (crop_w, crop_h, crop_w / w * pose_kernel.LANDMARK_Z_SCALE), (left, top, 0.0))
+
+        # 关键点贴近裁剪边缘说明人脸可能已移出区域
+        margin_x, margin_y = self.ROI_EDGE_MARGIN * crop_w, self.ROI_EDGE_MARGIN * crop_h
+        new_x0, new_y0, new_x1, new_y1 = self._face_box(landmarks)
+        if (new_x0 < left + margin_x or new_y0 < top + margin_y or
+                new_x1 > right - margin_x or new_y1 > bottom - margin_y):
+            return None
+
+        # 人脸尺寸突变视为跟踪到错误目标
+        ratio = (new_x1 - new_x0) / max(x1 - x0, 1e-6)
+        if not 1 / self.ROI_MAX_SCALE_CHANGE <= ratio <= self.ROI_MAX_SCALE_CHANGE:
+            return None
+        return landmarks
 
     def calculate_ear(self, landmarks, eye_indices):
         """计算眼睛纵横比 (Eye Aspect Ratio)"""
-        eye_points = np.array([[landmarks[idx][0], landmarks[idx][1]] for idx in eye_indices])
+        eye_points = landmarks[np.asarray(eye_indices), :2]
         
         # 垂直方向
         v1 = np.linalg.norm(eye_points[1] - eye_points[5])
@@ -128,9 +232,14 @@ class HeadPoseDetector:
         
         return yaw, pitch
 
-    def check_eyes_closed(self, avg_ear):
-        """检测持续闭眼状态"""
-        current_time = time()
+    def compute_metrics(self, landmarks):
+        """由关键点计算 (yaw, pitch, 平均EAR)；也接受 (N, 478, 3) 批量输入，返回三个数组"""
+        return pose_kernel.compute_metrics(landmarks)
+
+    def check_eyes_closed(self, avg_ear, current_time=None):
+        """检测持续闭眼状态，离线分析时可传入视频时间戳"""
+        if current_time is None:
+            current_time = time()
         
         if avg_ear < self.EAR_THRESHOLD:  # 眼睛闭合
             if self.last_closed_time is None:
@@ -142,9 +251,20 @@ class HeadPoseDetector:
         
         return False, 0
 
-    def is_distracted(self, frame):
+    def is_distracted(self, frame, timestamp=None, landmarks=None, annotate=True):
+        """landmarks 为预计算关键点时跳过 FaceMesh（全 NaN 表示该帧无人脸）
+
+        annotate=False 时不复制帧、不绘制，vis_frame 返回 None。
+        """
+        self.last_landmarks = None
         try:
-            landmarks = self.get_face_landmarks(frame)
+            if landmarks is None:
+                start = perf_counter()
+                landmarks = self.get_face_landmarks(frame)
+                LANDMARKS_SECONDS.observe(perf_counter() - start)
+            elif np.isnan(landmarks[0, 0]):
+                landmarks = None
+            self.last_landmarks = landmarks
             if landmarks is None:
                 return True, {
                     "head_pose": {"yaw": None, "pitch": None},
@@ -153,16 +273,13 @@ class HeadPoseDetector:
                     "reason": "No face detected"
                 }, None
                 
-            # 计算头部姿态
-            yaw, pitch = self.calculate_head_pose(landmarks)
-            
-            # 检测眼睛状态
-            left_ear = self.calculate_ear(landmarks, self.LEFT_EYE_INDICES)
-            right_ear = self.calculate_ear(landmarks, self.RIGHT_EYE_INDICES)
-            avg_ear = (left_ear + right_ear) / 2
+            # 计算头部姿态与眼睛状态
+            start = perf_counter()
+            yaw, pitch, avg_ear = self.compute_metrics(landmarks)
+            POSE_SECONDS.observe(perf_counter() - start)
             
             # 检测持续闭眼
-            eyes_closed, closed_duration = self.check_eyes_closed(avg_ear)
+            eyes_closed, closed_duration = self.check_eyes_closed(avg_ear, timestamp)
             
             # 判断分心状态 - 仅使用头部角度和闭眼状态
             is_distracted = (
@@ -171,9 +288,13 @@ class HeadPoseDetector:
                 (eyes_closed and closed_duration >= self.CLOSED_EYES_TIME)
             )
             
-            # 绘制可视化效果
-            vis_frame = frame.copy()
-            vis_frame = self.draw_face_state(vis_frame, landmarks, is_distracted, yaw)
+            # 绘制可视化效果（仅在需要服务端标注画面时）
+            vis_frame = None
+            if annotate:
+                start = perf_counter()
+                vis_frame = frame.copy()
+                vis_frame = self.draw_face_state(vis_frame, landmarks, is_distracted, yaw)
+                DRAW_SECONDS.observe(perf_counter() - start)
             
             return is_distracted, {
                 "head_pose": {
@@ -182,7 +303,8 @@ class HeadPoseDetector:
                 },
                 "eyes": {
                     "closed": bool(eyes_closed),
-                    "closed_duration": float(closed_duration) if closed_duration else None
+                    "closed_duration": float(closed_duration) if closed_duration else None,
+                    "ear": float(avg_ear)
                 },
                 "attention_level": "distracted" if is_distracted else "focused"
             }, vis_frame
@@ -196,5 +318,12 @@ class HeadPoseDetector:
                 "reason": str(e)
             }, None
 
+    def close(self):
+        """释放 FaceMesh 图，之后不能再推理；可重复调用"""
+        for mesh in (self.face_mesh, self.roi_face_mesh):
+            if mesh is not None:
+                mesh.close()
+        self.face_mesh = self.roi_face_mesh = None
+
     def __del__(self):
-        self.face_mesh.close()
+        self.close()
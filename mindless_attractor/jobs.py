@@ -0,0 +1,295 @@
+"""上传视频的后台任务：分块落盘、有界工作线程池、进度与结果查询
+
+上传按块流式写入 upload_dir 下唯一命名的文件，不在内存中缓存整个请求体，
+multipart 请求由 MultipartUpload 边解析边写入，不经过 Werkzeug 的临时文件；
+提取音频、离线分析等耗时步骤作为任务排队在固定大小的线程池中执行，
+请求立即返回任务 id。JobManager 限制同时上传数、排队任务数、单个上传大小
+与任务文件占用的磁盘总量，已结束的任务超过 retention 秒后连同文件一起清理。
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+MAX_FIELD_BYTES = 64 << 10  # multipart 中普通字段的大小上限，超出的字段被忽略
+
+class JobLimitError(Exception):
+    """并发上传数或排队任务数已满"""
+
+class UploadTooLargeError(Exception):
+    """单个上传超过大小上限"""
+
+class DiskQuotaError(Exception):
+    """任务文件占用的磁盘空间超过配额"""
+
+class MultipartUpload:
+    """从 multipart/form-data 请求体中流式读取一个文件字段
+
+    start() 解析到文件字段开始处（之前的普通字段存入 fields），之后 read() 依次返回
+    文件数据块，可直接交给 JobManager.ingest；finish() 解析剩余部分，收集其后的普通字段。
+    其他文件字段被跳过；请求体格式错误或中途断开时抛出 ValueError。
+    """
+    def __init__(self, stream, boundary, field='video', chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary)
+        self.field = field
+        self.chunk_size = chunk_size
+        self.fields = {}
+        self.filename = None
+        self.current = None  # 当前部分：'file'、普通字段名或 None（跳过）
+        self.value = bytearray()
+        self.file_done = False
+        self.ended = False
+
+    def _next_event(self):
+        """返回下一个 Data 或 File 事件；请求体结束时返回 None"""
+        while not self.ended:
+            event = self.decoder.next_event()
+            if isinstance(event, NeedData):
+                if self.decoder.complete:
+                    self.ended = True  # 请求体在结束边界之前中断
+                else:
+                    self.decoder.receive_data(self.stream.read(self.chunk_size) or None)
+                continue
+            if isinstance(event, Epilogue):
+                self.ended = True
+            elif isinstance(event, File):
+                found = event.name == self.field and self.filename is None
+                self.current = 'file' if found else None
+                if found:
+                    self.filename = event.filename or ''
+                    return event
+            elif isinstance(event, Field):
+                self.current, self.value = event.name, bytearray()
+            elif isinstance(event, Data):
+                if self.current == 'file':
+                    return event
+                if self.current is not None:
+                    self.value += event.data
+                    if len(self.value) > MAX_FIELD_BYTES:
+                        self.current = None
+                    elif not event.more_data:
+                        self.fields[self.current] = self.value.decode('utf-8', 'replace')
+        return None
+
+    def start(self):
+        """解析到文件字段开始处；请求中没有该字段时返回 False"""
+        while self.filename is None:
+            if self._next_event() is None:
+                return False
+        return True
+
+    def read(self, size=-1):
+        while not self.file_done:
+            event = self._next_event()
+            if event is None:
+                break
+            if not event.more_data:
+                self.file_done = True
+                self.current = None
+            if event.data:
+                return event.data
+        return b''
+
+    def finish(self):
+        """跳过文件剩余部分并收集其后的普通字段"""
+        while self.read():
+            pass
+        while self._next_event() is not None:
+            pass
+        return self.fields
+
+class Job:
+    """一个后台任务；run(job) 在工作线程中执行，通过 set_progress 报告进度"""
+    def __init__(self, kind, run, files=()):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.run = run
+        self.files = list(files)  # 任务拥有的文件，任务清理时删除
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def set_progress(self, value):
+        self.progress = min(1.0, max(0.0, float(value)))
+
+    def add_file(self, path):
+        self.files.append(path)
+        return path
+
+    @property
+    def done(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+    def disk_usage(self):
+        return sum(os.path.getsize(p) for p in self.files if os.path.exists(p))
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+class JobManager:
+    def __init__(self, upload_dir=None, max_workers=2, max_queued=8, max_uploads=4,
+                 max_upload_bytes=2 << 30, disk_quota_bytes=8 << 30, retention=3600.0, in_use=None):
+        self.upload_dir = upload_dir or os.path.join(tempfile.gettempdir(), 'mindless_uploads')
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.max_queued = max_queued
+        self.max_upload_bytes = max_upload_bytes
+        self.disk_quota_bytes = disk_quota_bytes
+        self.retention = retention
+        self.in_use = in_use or (lambda path: False)  # 仍被播放等使用的文件不清理
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.max_workers = max_workers
+        self.upload_slots = threading.BoundedSemaphore(max_uploads)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ingesting = 0  # 正在写入的上传字节数，计入磁盘配额
+
+    def new_path(self, suffix=''):
+        return os.path.join(self.upload_dir, uuid.uuid4().hex + suffix)
+
+    def disk_usage(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+            ingesting = self.ingesting
+        return sum(job.disk_usage() for job in jobs) + ingesting
+
+    def ingest(self, stream, suffix='.mp4'):
+        """把请求体按块写入唯一命名的文件，返回路径
+
+        超过单个上传上限或磁盘配额时删除已写入部分并抛出异常。
+        """
+        if not self.upload_slots.acquire(blocking=False):
+            raise JobLimitError('Too many concurrent uploads')
+        self.evict()
+        path = self.new_path(suffix)
+        written = 0
+        try:
+            base_usage = self.disk_usage()
+            with open(path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > self.max_upload_bytes:
+                        raise UploadTooLargeError(f'Upload exceeds {self.max_upload_bytes} bytes')
+                    if base_usage + written > self.disk_quota_bytes:
+                        raise DiskQuotaError('Upload disk quota exhausted')
+                    with self.lock:
+                        self.ingesting += len(chunk)
+                    f.write(chunk)
+            logger.info(f"Ingested upload {os.path.basename(path)} ({written} bytes)")
+            return path
+        except BaseException:
+            if os.path.exists(path):
+                os.unlink(path)
+            raise
+        finally:
+            with self.lock:
+                self.ingesting -= min(written, self.ingesting)
+            self.upload_slots.release()
+
+    def submit(self, kind, run, files=()):
+        """排队一个任务；排队与运行中的任务数超过上限时抛出 JobLimitError"""
+        job = Job(kind, run, files)
+        with self.lock:
+            pending = sum(1 for j in self.jobs.values() if not j.done)
+            if pending >= self.max_queued + self.max_workers:
+                raise JobLimitError('Job queue is full')
+            self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        if job.status == 'cancelled':
+            return
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            job.result = job.run(job)
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"{job.kind} job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = 'error'
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """取消尚未开始的任务，并删除任务及其文件；运行中的任务返回 False"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        if job.status == 'queued' and job.future.cancel():
+            job.status = 'cancelled'
+            job.finished = time.time()
+        if job.status == 'running':
+            return False
+        self._remove(job)
+        return True
+
+    def _remove(self, job):
+        with self.lock:
+            self.jobs.pop(job.id, None)
+        for path in job.files:
+            if os.path.exists(path) and not self.in_use(path):
+                os.unlink(path)
+
+    def evict(self):
+        """清理超过保留期的已结束任务"""
+        cutoff = time.time() - self.retention
+        with self.lock:
+            expired = [j for j in self.jobs.values() if j.done and j.finished < cutoff]
+        for job in expired:
+            if any(self.in_use(p) for p in job.files):
+                continue
+            self._remove(job)
+
+    def stats(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        free = shutil.disk_usage(self.upload_dir).free
+        return {
+            'jobs': [job.to_dict() for job in jobs],
+            'counts': counts,
+            'workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'disk_usage_bytes': self.disk_usage(),
+            'disk_quota_bytes': self.disk_quota_bytes,
+            'disk_free_bytes': free,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
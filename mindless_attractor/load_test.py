@@ -0,0 +1,389 @@
+"""合成客户端负载测试：评估单个 app.py 实例能服务多少观看者与状态订阅者
+
+启动 app.py（帧源为循环回放的录制，无需摄像头），逐级增加模拟的 /video_feed
+MJPEG 客户端与 Socket.IO 状态订阅者，每级测量：
+    - 每个 MJPEG 客户端实际收到的帧率与帧间隔抖动
+    - 状态包与叠加层包各自的到达频率
+    - 从摄像头采集到订阅者收到状态包的端到端延迟（状态包携带采集时间，
+      与本机时钟比较；--url 指向其他主机时两端时钟需同步），以及 latency_probe 事件往返延迟
+    - 服务端（含子进程）CPU 占用与 RSS
+结果写入 JSON 报告，可按阈值给出满足要求的最大客户端数。
+
+用法:
+    python load_test.py -o load.json                          # 合成录制，1..32 个客户端
+    python load_test.py --recording session_dir --levels 1 4 16 --duration 20
+    python load_test.py --url http://127.0.0.1:5000 --levels 8  # 测试已在运行的实例
+
+Socket.IO 客户端需要 pip install "python-socketio[client]"；CPU/RSS 通过 /proc 读取（仅 Linux）。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from frame_source import FrameRecorder
+from status_codec import unpack_result
+
+logger = logging.getLogger(__name__)
+
+BOUNDARY = b'--frame\r\n'
+
+def synthesize_recording(path, count=90, shape=(480, 640, 3), fps=30.0):
+    """生成移动渐变的合成录制，供回放帧源循环使用"""
+    recorder = FrameRecorder(path)
+    h, w = shape[:2]
+    base = np.add.outer(np.arange(h) // 2, np.arange(w) // 2).astype(np.uint8)
+    start = time.time()
+    for i in range(count):
+        frame = np.empty(shape, dtype=np.uint8)
+        for c in range(shape[2]):
+            frame[..., c] = base + np.uint8((i * 4 + c * 60) % 256)
+        recorder.append(frame, start + i / fps)
+    recorder.close()
+    return path
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if len(values) else None
+
+class ServerProcess:
+    """以回放帧源启动 app.py 子进程"""
+    def __init__(self, recording, port, extra_env=None):
+        env = dict(os.environ)
+        env.update({
+            'MINDLESS_FRAME_SOURCE': f'replay:{recording}',
+            'MINDLESS_REPLAY_LOOP': '1',
+            'MINDLESS_PORT': str(port),
+        })
+        env.update(extra_env or {})
+        self.url = f'http://127.0.0.1:{port}'
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [sys.executable, 'app.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout=120.0):
+        """等待 /healthz 返回 200（FaceMesh 预热完成）"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"app.py exited with code {self.process.returncode}:\n{self.tail()}")
+            try:
+                with urllib.request.urlopen(f'{self.url}/healthz', timeout=1.0) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"app.py not ready after {timeout}s:\n{self.tail()}")
+
+    def tail(self, size=4000):
+        self.log.seek(0, os.SEEK_END)
+        self.log.seek(max(0, self.log.tell() - size))
+        return self.log.read().decode(errors='replace')
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+class ProcessUsage:
+    """从 /proc 读取进程及其子进程（会话、推理工作进程）的 CPU 时间与 RSS"""
+    def __init__(self, pid):
+        self.pid = pid
+        self.tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _pids(self):
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            try:
+                with open(f'/proc/{pid}/task/{pid}/children') as f:
+                    stack.extend(int(p) for p in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def sample(self):
+        """返回 (CPU 秒数, RSS 字节)；非 Linux 返回 None"""
+        if not os.path.exists(f'/proc/{self.pid}'):
+            return None
+        cpu = rss = 0
+        for pid in self._pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            cpu += (int(fields[11]) + int(fields[12])) / self.tick  # utime + stime
+            rss += int(fields[21]) * self.page
+        return cpu, rss
+
+class MJPEGClient(threading.Thread):
+    """读取 /video_feed 并记录每个 multipart 片段的到达时间"""
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.url = url
+        self.arrivals = []
+        self.bytes = 0
+        self.error = None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=10.0) as response:
+                tail = b''
+                while not self.stop_event.is_set():
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        break
+                    now = time.perf_counter()
+                    self.bytes += len(chunk)
+                    data = tail + chunk
+                    self.arrivals.extend([now] * data.count(BOUNDARY))
+                    tail = data[-(len(BOUNDARY) - 1):]
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.error = str(e)
+
+    def stop(self):
+        self.stop_event.set()
+
+class StatusSubscriber:
+    """Socket.IO 状态订阅者：分别统计状态包与叠加层包的到达时间，
+    由状态包中的采集时间计算端到端延迟，并周期性测量事件往返延迟"""
+    def __init__(self, url, max_rate=None, overlay=False, probe_interval=0.5):
+        import socketio
+        self.url = url
+        self.arrivals = []          # attention_packet
+        self.overlay_arrivals = []  # overlay_packet
+        self.capture_latencies = []  # (到达时刻, 采集到收到的秒数)
+        self.round_trips = []
+        self.error = None
+        self.probe_interval = probe_interval
+        self.stop_event = threading.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('attention_packet', self._on_packet)
+        self.sio.on('overlay_packet', self._on_overlay)
+        self.subscription = {'max_rate': max_rate, 'overlay': overlay}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _on_packet(self, data):
+        now = time.perf_counter()
+        self.arrivals.append(now)
+        capture_time = unpack_result(data)['capture_time']
+        if capture_time is not None:  # 订阅时补发的关键帧不带采集时间
+            self.capture_latencies.append((now, time.time() - capture_time))
+
+    def _on_overlay(self, data):
+        self.overlay_arrivals.append(time.perf_counter())
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.sio.connect(self.url, transports=['websocket', 'polling'], wait_timeout=10)
+            self.sio.emit('subscribe_status', self.subscription)
+            while not self.stop_event.wait(self.probe_interval):
+                start = time.perf_counter()
+                self.sio.call('latency_probe', {'t': start}, timeout=5)
+                self.round_trips.append(time.perf_counter() - start)
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.error = str(e)
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(2.0)
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+def _window(arrivals, start, end):
+    return [t for t in arrivals if start <= t < end]
+
+def _stream_stats(clients, start, end, attr='arrivals'):
+    """汇总各客户端测量窗口内的到达频率与间隔抖动"""
+    duration = end - start
+    rates, intervals, jitters = [], [], []
+    for client in clients:
+        arrivals = _window(getattr(client, attr), start, end)
+        rates.append(len(arrivals) / duration)
+        gaps = np.diff(arrivals) * 1000
+        if len(gaps) > 1:
+            intervals.extend(gaps)
+            jitters.append(float(np.std(gaps)))
+    return {
+        'clients': len(clients),
+        'errors': sum(1 for c in clients if c.error),
+        'fps_mean': round(float(np.mean(rates)), 2) if rates else None,
+        'fps_min': round(float(np.min(rates)), 2) if rates else None,
+        'interval_p50_ms': _percentile(intervals, 50),
+        'interval_p99_ms': _percentile(intervals, 99),
+        'jitter_ms': round(float(np.mean(jitters)), 2) if jitters else None,
+    }
+
+def _get_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5.0) as response:
+            return json.load(response)
+    except OSError as e:
+        logger.warning(f"GET {url} failed: {e}")
+        return None
+
+def run_level(base_url, mjpeg_clients, status_clients, duration, warmup, usage,
+              tier='medium', overlay='client', max_rate=None):
+    """以给定客户端数运行一级负载，返回该级测量结果"""
+    viewers = [MJPEGClient(f'{base_url}/video_feed?tier={tier}&overlay={overlay}') for _ in range(mjpeg_clients)]
+    subscribers = [StatusSubscriber(base_url, max_rate, overlay == 'client') for _ in range(status_clients)]
+    for client in viewers:
+        client.start()
+    for client in subscribers:
+        client.start()
+    try:
+        time.sleep(warmup)
+        start, usage_start = time.perf_counter(), usage.sample() if usage else None
+        rss_peak = 0
+        while time.perf_counter() - start < duration:
+            time.sleep(0.5)
+            sample = usage.sample() if usage else None
+            if sample:
+                rss_peak = max(rss_peak, sample[1])
+        end, usage_end = time.perf_counter(), usage.sample() if usage else None
+    finally:
+        for client in viewers:
+            client.stop()
+        for client in subscribers:
+            client.stop()
+
+    round_trips = [rt * 1000 for c in subscribers for rt in c.round_trips]
+    latencies = [latency * 1000 for c in subscribers for t, latency in c.capture_latencies if start <= t < end]
+    level = {
+        'mjpeg': _stream_stats(viewers, start, end),
+        'status': _stream_stats(subscribers, start, end),
+        'overlay': _stream_stats(subscribers, start, end, 'overlay_arrivals') if overlay == 'client' else None,
+        'capture_to_client_p50_ms': _percentile(latencies, 50),
+        'capture_to_client_p99_ms': _percentile(latencies, 99),
+        'event_rtt_p50_ms': _percentile(round_trips, 50),
+        'event_rtt_p99_ms': _percentile(round_trips, 99),
+        'scheduler': _get_json(f'{base_url}/api/scheduler'),
+    }
+    if usage_start and usage_end:
+        level['server_cpu_percent'] = round((usage_end[0] - usage_start[0]) / (end - start) * 100, 1)
+        level['server_rss_mb'] = round(rss_peak / 2**20, 1)
+    errors = [c.error for c in viewers + subscribers if c.error]
+    if errors:
+        level['client_errors'] = errors[:5]
+    return level
+
+def capacity(levels, min_fps=None, max_jitter_ms=None, max_rtt_ms=None, max_latency_ms=None):
+    """满足全部阈值的最大客户端数（未指定阈值时返回 None）"""
+    if min_fps is None and max_jitter_ms is None and max_rtt_ms is None and max_latency_ms is None:
+        return None
+    best = 0
+    for level in levels:
+        mjpeg = level['mjpeg']
+        ok = (
+            (min_fps is None or (mjpeg['fps_min'] or 0) >= min_fps) and
+            (max_jitter_ms is None or (mjpeg['jitter_ms'] or 0) <= max_jitter_ms) and
+            (max_rtt_ms is None or (level['event_rtt_p99_ms'] or 0) <= max_rtt_ms) and
+            (max_latency_ms is None or (level['capture_to_client_p99_ms'] or 0) <= max_latency_ms)
+        )
+        if not ok:
+            break
+        best = level['clients']
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='MJPEG 与 Socket.IO 客户端负载测试')
+    parser.add_argument('--url', help='测试已在运行的实例，不启动 app.py')
+    parser.add_argument('--recording', help='回放的录制目录，默认生成合成录制')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='每级的客户端数')
+    parser.add_argument('--status-ratio', type=float, default=1.0,
+                        help='每个 MJPEG 客户端对应的 Socket.IO 订阅者数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每级测量秒数')
+    parser.add_argument('--warmup', type=float, default=2.0, help='每级开始测量前的等待秒数')
+    parser.add_argument('--tier', default='medium')
+    parser.add_argument('--overlay', default='client', choices=('server', 'client'))
+    parser.add_argument('--max-rate', type=float, help='订阅者声明的每秒最大状态包数')
+    parser.add_argument('--min-fps', type=float, help='容量阈值：每个观看者的最低帧率')
+    parser.add_argument('--max-jitter-ms', type=float, help='容量阈值：帧间隔抖动上限')
+    parser.add_argument('--max-rtt-ms', type=float, help='容量阈值：事件往返延迟 p99 上限')
+    parser.add_argument('--max-latency-ms', type=float, help='容量阈值：采集到订阅者收到状态包的 p99 上限')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='传给 app.py 的额外环境变量，如 MINDLESS_INFERENCE_PROCS=2')
+    parser.add_argument('-o', '--output', help='报告 JSON 路径')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = None
+    usage = None
+    base_url = args.url
+    tmpdir = None
+    try:
+        if base_url is None:
+            recording = args.recording
+            if recording is None:
+                tmpdir = tempfile.TemporaryDirectory()
+                recording = synthesize_recording(os.path.join(tmpdir.name, 'synthetic'))
+            server = ServerProcess(recording, args.port, dict(kv.split('=', 1) for kv in args.env))
+            server.wait_ready()
+            base_url = server.url
+            usage = ProcessUsage(server.process.pid)
+        request = urllib.request.Request(f'{base_url}/api/start', method='POST')
+        with urllib.request.urlopen(request, timeout=30.0) as response:
+            logger.info(f"Monitoring started: {response.status}")
+
+        levels = []
+        for n in args.levels:
+            n_status = int(round(n * args.status_ratio))
+            logger.info(f"Running level: {n} MJPEG clients, {n_status} status subscribers")
+            level = run_level(base_url, n, n_status, args.duration, args.warmup, usage,
+                              args.tier, args.overlay, args.max_rate)
+            level['clients'] = n
+            levels.append(level)
+            logger.info(f"  fps_min={level['mjpeg']['fps_min']} jitter={level['mjpeg']['jitter_ms']}ms "
+                        f"latency_p99={level['capture_to_client_p99_ms']}ms "
+                        f"rtt_p99={level['event_rtt_p99_ms']}ms cpu={level.get('server_cpu_percent')}% "
+                        f"rss={level.get('server_rss_mb')}MB")
+    finally:
+        if server is not None:
+            server.stop()
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    report = {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args),
+        'levels': levels,
+        'capacity': capacity(levels, args.min_fps, args.max_jitter_ms, args.max_rtt_ms,
+                             args.max_latency_ms),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""轻量级运行时指标：固定分桶直方图、计数器与仪表
+
+模块级 REGISTRY 在进程内共享，热路径只做一次 perf_counter 与一次分桶计数。
+render_prometheus() 输出 Prometheus 文本格式，MetricsLogger 定期在日志中打印各阶段 p50/p99。
+"""
+import bisect
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 秒为单位的延迟分桶：0.5 ms 到 2.5 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.035,
+                   0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """由分桶线性插值估计分位数；落在 +Inf 桶时返回最大边界"""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, c in enumerate(counts):
+            if cumulative + c >= rank and c > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / c
+            cumulative += c
+        return self.buckets[-1]
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, value_sum = self.count, self.sum
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f'{self.name}_sum {value_sum}')
+        lines.append(f'{self.name}_count {total}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter',
+                f'{self.name} {self.value}']
+
+class CallbackMetric:
+    """采集时调用 fn 取值，用于队列深度等已有状态（kind 为 gauge 或 counter）"""
+    def __init__(self, name, help_text, fn, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug(f"Metric {self.name} unavailable: {e}")
+            return []
+        if value is None:
+            return []
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}',
+                f'{self.name} {value}']
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = factory()
+            return metric
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help_text, buckets))
+
+    def counter(self, name, help_text):
+        return self._get_or_create(name, lambda: Counter(name, help_text))
+
+    def callback(self, name, help_text, fn, kind='gauge'):
+        """注册（或替换）回调指标"""
+        with self.lock:
+            self.metrics[name] = CallbackMetric(name, help_text, fn, kind)
+            return self.metrics[name]
+
+    def render_prometheus(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """各直方图的次数与 p50/p99（毫秒）"""
+        with self.lock:
+            histograms = [m for m in self.metrics.values() if isinstance(m, Histogram)]
+        summary = {}
+        for h in histograms:
+            if h.count:
+                summary[h.name] = {
+                    'count': h.count,
+                    'p50_ms': round(h.quantile(0.5) * 1000, 2),
+                    'p99_ms': round(h.quantile(0.99) * 1000, 2),
+                }
+        return summary
+
+REGISTRY = MetricsRegistry()
+histogram = REGISTRY.histogram
+counter = REGISTRY.counter
+callback = REGISTRY.callback
+
+class MetricsLogger:
+    """后台线程，每 interval 秒在日志中输出一次阶段耗时摘要"""
+    def __init__(self, registry=REGISTRY, interval=60.0):
+        self.registry = registry
+        self.interval = interval
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            summary = self.registry.summary()
+            if summary:
+                stages = ', '.join(f"{name}: p50={s['p50_ms']}ms p99={s['p99_ms']}ms n={s['count']}"
+                                   for name, s in summary.items())
+                logger.info(f"Latency summary - {stages}")
@@ -0,0 +1,162 @@
+import cv2
+import threading
+import time
+import logging
+from collections import deque
+
+import metrics
+from scheduler import AdaptiveRate
+
+logger = logging.getLogger(__name__)
+
+ENCODE_SECONDS = metrics.histogram('mjpeg_encode_seconds', 'MJPEG resize and JPEG encode time per tier')
+DROPPED_PARTS = metrics.counter('mjpeg_dropped_frames_total', 'MJPEG frames dropped for slow clients')
+
+# 画质档位：JPEG 质量与输出宽度（None 表示保持原始分辨率）
+STREAM_TIERS = {
+    'high': {'quality': 90, 'width': None},
+    'medium': {'quality': 75, 'width': 480},
+    'low': {'quality': 60, 'width': 320},
+}
+
+# 叠加层模式：server 推送服务端绘制的标注画面，client 推送原始画面、由浏览器绘制叠加层
+OVERLAY_MODES = ('server', 'client')
+
+class StreamClient:
+    """单个 MJPEG 客户端的有界队列，慢速客户端丢弃旧帧"""
+    def __init__(self, tier, max_queue=2, overlay='server'):
+        self.tier = tier
+        self.overlay = overlay
+        self.queue = deque(maxlen=max_queue)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, part):
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+                DROPPED_PARTS.inc()
+            self.queue.append(part)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.closed or self.queue, timeout)
+            return self.queue.popleft() if self.queue else None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class MJPEGBroadcastHub:
+    """每个标注帧每个档位只编码一次，再把同一份字节分发给所有客户端
+
+    编码频率由 scheduler 控制，到期时编码最新的推理结果，中间的结果直接跳过。
+    overlay='client' 的客户端收到推理所用的原始帧（从摄像头环形缓冲区读取），
+    只有存在 overlay='server' 的客户端时推理阶段才需要绘制标注画面。
+    """
+    def __init__(self, pipeline, tiers=None, default_tier='high', max_queue=2, scheduler=None):
+        self.pipeline = pipeline
+        self.scheduler = scheduler or AdaptiveRate('stream', cpu_budget=0.25, max_rate=30.0)
+        self.tiers = tiers or STREAM_TIERS
+        self.default_tier = default_tier
+        self.max_queue = max_queue
+        self.clients = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_client(self, tier=None, overlay=None):
+        tier = tier if tier in self.tiers else self.default_tier
+        overlay = overlay if overlay in OVERLAY_MODES else 'server'
+        client = StreamClient(tier, self.max_queue, overlay)
+        with self.lock:
+            self.clients.append(client)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+                self.thread.start()
+        logger.info(f"MJPEG client connected (tier={tier}, overlay={overlay}, clients={len(self.clients)})")
+        return client
+
+    def remove_client(self, client):
+        client.close()
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        logger.info(f"MJPEG client disconnected (dropped={client.dropped})")
+
+    def needs_annotation(self):
+        """是否有客户端需要服务端绘制的标注画面"""
+        with self.lock:
+            return any(client.overlay == 'server' for client in self.clients)
+
+    def stream(self, tier=None, overlay=None):
+        """供 Flask Response 使用的 multipart 生成器"""
+        client = self.add_client(tier, overlay)
+        try:
+            while not client.closed:
+                part = client.get(timeout=1.0)
+                if part is not None:
+                    yield part
+        finally:
+            self.remove_client(client)
+
+    def encode(self, frame, tier):
+        """按档位缩放并编码为 multipart 片段"""
+        settings = self.tiers[tier]
+        width = settings.get('width')
+        if width and frame.shape[1] > width:
+            height = int(frame.shape[0] * width / frame.shape[1])
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, settings['quality']])
+        if not ret:
+            return None
+        return (b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+
+    def _raw_frame_valid(self, result):
+        return self.pipeline.camera_manager.is_frame_valid(result.seq)
+
+    def _source_frame(self, result, overlay):
+        if overlay == 'server' and result.vis_frame is not None:
+            return result.vis_frame
+        # 没有标注画面（无人脸，或共享内存推理模式不绘制）时退回原始帧
+        return self.pipeline.camera_manager.frame_view(result.seq)
+
+    def _encode_loop(self):
+        last_seq = -1
+        while True:
+            with self.lock:
+                if not self.clients:
+                    self.thread = None
+                    return
+                clients = list(self.clients)
+
+            self.scheduler.wait()
+            result = self.pipeline.wait_for_result(last_seq, timeout=1.0)
+            if result is None:
+                if not self.pipeline.active:
+                    time.sleep(0.1)
+                continue
+            last_seq = result.seq
+
+            start = self.scheduler.begin()
+            try:
+                parts = {}
+                for client in clients:
+                    key = (client.tier, client.overlay)
+                    if key not in parts:
+                        frame = self._source_frame(result, client.overlay)
+                        if frame is None:
+                            parts[key] = None
+                        else:
+                            with ENCODE_SECONDS.time():
+                                parts[key] = self.encode(frame, client.tier)
+                            if client.overlay == 'client' and not self._raw_frame_valid(result):
+                                parts[key] = None  # 编码期间槽位被采集线程覆盖
+                    if parts[key] is not None:
+                        client.put(parts[key])
+            except Exception as e:
+                logger.error(f"Error in MJPEG encode loop: {e}")
+            self.scheduler.end(start, result.capture_time)
@@ -0,0 +1,153 @@
+import threading
+import time
+import logging
+
+import metrics
+from scheduler import AdaptiveRate
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_SECONDS = metrics.histogram('pipeline_inference_seconds', 'analyze_frame time per frame')
+CAPTURE_TO_RESULT_SECONDS = metrics.histogram('pipeline_capture_to_result_seconds',
+                                              'Time from camera capture to published result')
+SKIPPED_FRAMES = metrics.counter('pipeline_skipped_frames_total', 'Camera frames never analysed')
+STALE_RESULTS = metrics.counter('pipeline_stale_results_total',
+                                'Results dropped because the frame was overwritten during inference')
+
+class InferenceResult:
+    """单帧推理结果，按帧序号标识"""
+    __slots__ = ('seq', 'timestamp', 'distracted', 'reason', 'vis_frame', 'capture_time',
+                 'overlay_points', 'frame_shape')
+
+    def __init__(self, seq, timestamp, distracted, reason, vis_frame, capture_time=None,
+                 overlay_points=None, frame_shape=None):
+        self.seq = seq
+        self.overlay_points = overlay_points  # 客户端绘制叠加层的关键点 (5, 2)
+        self.frame_shape = frame_shape
+        self.capture_time = capture_time  # 摄像头采集时间（time.time()），用于端到端延迟
+        self.timestamp = timestamp
+        self.distracted = distracted
+        self.reason = reason
+        self.vis_frame = vis_frame
+
+class InferencePipeline:
+    """共享推理阶段：每个新帧只推理一次，结果发布给所有订阅者
+
+    订阅方式有两种：
+    - subscribe(callback)：在推理线程中同步回调，回调必须足够快
+    - wait_for_result(after_seq, timeout)：阻塞等待比 after_seq 更新的结果
+
+    推理频率由 scheduler（AdaptiveRate）按实测耗时决定，每次都取最新一帧。
+    只有 annotation_demand() 为真（有客户端需要服务端标注画面）时才绘制 vis_frame。
+    """
+    def __init__(self, controller, camera_manager, scheduler=None):
+        self.controller = controller
+        self.camera_manager = camera_manager
+        self.scheduler = scheduler or AdaptiveRate('analysis', cpu_budget=0.5, deadline=0.25, max_rate=15.0)
+        self.annotation_demand = lambda: True
+        self.active = False
+        self.generation = 0  # 每次 start 递增，快速 stop/start 时旧的推理线程据此退出
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.result_cond = threading.Condition()
+        self.latest = None
+        self.thread = None
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def start(self):
+        with self.lock:
+            if self.active:
+                return
+            self.active = True
+            self.generation += 1
+            self.thread = threading.Thread(target=self._run_loop, args=(self.generation,), daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.active = False
+        with self.result_cond:
+            self.result_cond.notify_all()
+
+    def wait_for_result(self, after_seq=-1, timeout=None):
+        """等待帧序号大于 after_seq 的结果，超时或停止时返回 None"""
+        with self.result_cond:
+            self.result_cond.wait_for(
+                lambda: not self.active or (self.latest is not None and self.latest.seq > after_seq),
+                timeout
+            )
+            latest = self.latest
+        if latest is not None and latest.seq > after_seq:
+            return latest
+        return None
+
+    def _publish(self, result):
+        with self.result_cond:
+            self.latest = result
+            self.result_cond.notify_all()
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error(f"Subscriber error: {e}")
+
+    def _running(self, generation):
+        return self.active and generation == self.generation
+
+    def _run_loop(self, generation):
+        last_seq = 0
+        while self._running(generation):
+            try:
+                seq, frame = self.camera_manager.wait_for_frame(last_seq, timeout=0.5)
+                if frame is None:
+                    if not self.camera_manager.active:
+                        time.sleep(0.1)
+                    continue
+                capture_time = self.camera_manager.frame_time(seq)
+                if self.scheduler.is_stale(capture_time):
+                    # 采集已超过 deadline（如采集线程卡顿），等待更新的帧而不是推理它
+                    logger.debug(f"Skipping stale frame {seq}")
+                    SKIPPED_FRAMES.inc(seq - last_seq if last_seq else 1)
+                    last_seq = seq
+                    continue
+                start = self.scheduler.begin()
+                start_time = time.time()
+                if last_seq > 0 and seq - last_seq > 1:
+                    logger.debug(f"Inference skipped {seq - last_seq - 1} frames")
+                    SKIPPED_FRAMES.inc(seq - last_seq - 1)
+                last_seq = seq
+                landmarks = self.camera_manager.frame_landmarks(seq)
+
+                distracted, reason, vis_frame, overlay_points = self.controller.analyze_frame(
+                    frame, landmarks, annotate=self.annotation_demand())
+                if not self.camera_manager.is_frame_valid(seq):
+                    # 推理期间环形缓冲区已转过一圈，frame 视图可能已被部分覆盖
+                    logger.debug(f"Dropping result for overwritten frame {seq}")
+                    STALE_RESULTS.inc()
+                    self.scheduler.end(start, capture_time)
+                    continue
+                if not self._running(generation):
+                    break  # 推理期间已 stop（或已被新的 start 取代），不再发布
+                now = time.time()
+                INFERENCE_SECONDS.observe(now - start_time)
+                if capture_time:
+                    CAPTURE_TO_RESULT_SECONDS.observe(now - capture_time)
+                self._publish(InferenceResult(seq, now, bool(distracted), reason, vis_frame, capture_time,
+                                              overlay_points, frame.shape))
+
+                self.scheduler.end(start, capture_time)
+                self.scheduler.wait()
+            except Exception as e:
+                logger.error(f"Error in inference pipeline: {e}")
+                time.sleep(0.1)
@@ -0,0 +1,179 @@
+"""流式变调引擎：保持时长的实时 pitch shift
+
+处理链为 WSOLA 时间拉伸（按变调因子拉长）+ 多相重采样（按同一因子压缩），
+两级都在块之间保留状态，因此不会在块边界产生咔嗒声或时长漂移。
+"""
+import numpy as np
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
+
+@lru_cache(maxsize=32)
+def polyphase_filter_bank(taps, phases, cutoff):
+    """返回 (phases + 1, taps) 的加窗 sinc 滤波器组，每行对应一个分数延迟"""
+    half = taps // 2
+    offsets = np.arange(-half + 1, half + 1)
+    frac = np.arange(phases + 1) / phases
+    x = offsets[None, :] - frac[:, None]
+    window = 0.42 + 0.5 * np.cos(np.pi * x / half) + 0.08 * np.cos(2 * np.pi * x / half)
+    window[np.abs(x) > half] = 0.0
+    bank = cutoff * np.sinc(cutoff * x) * window
+    bank /= bank.sum(axis=1, keepdims=True)  # 各相位直流增益为 1
+    bank = bank.astype(np.float32)
+    bank.flags.writeable = False
+    return bank
+
+class PolyphaseResampler:
+    """流式分数倍重采样，ratio 为每个输出样本消耗的输入样本数"""
+    def __init__(self, channels, taps=16, phases=128):
+        self.taps = taps
+        self.phases = phases
+        self.left = taps // 2 - 1
+        self.right = taps // 2
+        self.history = np.zeros((self.left, channels), dtype=np.float32)
+        self.pos = float(self.left)
+
+    def process(self, x, ratio):
+        buf = np.concatenate([self.history, x])
+        last = len(buf) - 1 - self.right
+        if last < self.pos:
+            self.history = buf
+            return np.zeros((0, buf.shape[1]), dtype=np.float32)
+
+        n = int((last - self.pos) // ratio) + 1
+        positions = self.pos + np.arange(n) * ratio
+        index = np.floor(positions).astype(np.int64)
+        phase = np.rint((positions - index) * self.phases).astype(np.int64)
+
+        # 下变频时降低截止频率以抗混叠；量化后可以命中缓存
+        cutoff = round(min(1.0, 1.0 / ratio) * 0.95, 2)
+        bank = polyphase_filter_bank(self.taps, self.phases, cutoff)
+        # windows[k] 为 (channels, taps) 视图，批量矩阵乘代替逐样本卷积
+        windows = sliding_window_view(buf, self.taps, axis=0)[index - self.left]
+        out = np.matmul(windows, bank[phase][:, :, None])[..., 0]
+
+        self.pos += n * ratio
+        keep = int(np.floor(self.pos)) - self.left
+        self.history = buf[keep:]
+        self.pos -= keep
+        return out.astype(np.float32, copy=False)
+
+class WSOLAStretcher:
+    """流式 WSOLA 时间拉伸，stretch > 1 时输出变长"""
+    def __init__(self, channels, frame_size=1024, hop=256, tolerance=128):
+        self.frame_size = frame_size
+        self.hop = hop
+        self.tolerance = tolerance
+        self.overlap = frame_size // 2
+        self.window = np.hanning(frame_size + 1)[:-1].astype(np.float32)[:, None]
+        self.downmix = np.full(channels, 1.0 / channels, dtype=np.float32)
+        self.gain = 2.0 * hop / frame_size  # 周期 Hann 窗叠加和为 frame_size / (2 * hop)
+        self.inbuf = np.zeros((tolerance, channels), dtype=np.float32)
+        self.ana_pos = float(tolerance)
+        self.acc = np.zeros((frame_size, channels), dtype=np.float32)
+        self.prev_tail = None
+
+    def _best_offset(self, nominal):
+        """在 ±tolerance 内寻找与上一帧自然延续最相似的起点"""
+        tol = self.tolerance
+        region = self.inbuf[nominal - tol:nominal + tol + self.overlap] @ self.downmix
+        corr = np.correlate(region, self.prev_tail, mode='valid')
+        energy = np.cumsum(np.concatenate(([0.0], region.astype(np.float64) ** 2)))
+        energy = energy[self.overlap:] - energy[:-self.overlap]
+        score = corr / np.sqrt(energy + 1e-9)
+        return int(np.argmax(score)) - tol
+
+    def process(self, x, stretch):
+        self.inbuf = np.concatenate([self.inbuf, x])
+        analysis_hop = self.hop / stretch
+        n, hop, tol = self.frame_size, self.hop, self.tolerance
+        out = []
+        while True:
+            nominal = int(round(self.ana_pos))
+            if nominal + tol + n > len(self.inbuf):
+                break
+            start = nominal
+            if self.prev_tail is not None:
+                start += self._best_offset(nominal)
+
+            self.acc += self.inbuf[start:start + n] * self.window
+            out.append(self.acc[:hop] * self.gain)
+            self.acc = np.concatenate([self.acc[hop:], np.zeros_like(self.acc[:hop])])
+            self.prev_tail = self.inbuf[start + hop:start + hop + self.overlap] @ self.downmix
+            self.ana_pos += analysis_hop
+
+        drop = max(0, int(self.ana_pos) - tol)
+        self.inbuf = self.inbuf[drop:]
+        self.ana_pos -= drop
+        if not out:
+            return np.zeros((0, x.shape[1]), dtype=np.float32)
+        return np.concatenate(out)
+
+class StreamingPitchShifter:
+    """保持时长的流式变调
+
+    - 每次 process() 返回与输入块等长的输出块
+    - 输出 FIFO 预填 prime_samples 个静音样本，端到端延迟恰好为 prime_samples，
+      与块大小和因子无关（默认参数下 1424 个样本，44.1 kHz 约 32 ms）
+    - set_factor() 在 glide_time 秒内线性过渡到新因子，避免切换时的突变
+    - 拉伸与重采样在同一块内使用同一因子，长期无漂移；因子切换造成的个位数样本误差
+      若累积到超出 FIFO 余量，则补零（underruns）或丢弃（overruns）
+    """
+    def __init__(self, sample_rate=44100, channels=2, frame_size=1024, hop=256,
+                 tolerance=128, taps=16, glide_time=0.05):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.glide_time = glide_time
+        self.stretcher = WSOLAStretcher(channels, frame_size, hop, tolerance)
+        self.resampler = PolyphaseResampler(channels, taps)
+        self.prime_samples = frame_size + hop + tolerance + taps
+        self.fifo = np.zeros((self.prime_samples, channels), dtype=np.float32)
+        self.factor = 1.0
+        self.target_factor = 1.0
+        self.glide_rate = 0.0  # 每秒因子变化量
+        self.underruns = 0
+        self.overruns = 0
+
+    @property
+    def latency(self):
+        """端到端固定延迟（秒）"""
+        return self.prime_samples / self.sample_rate
+
+    def set_factor(self, factor, immediate=False):
+        """设置目标变调因子（>1 升调，<1 降调）"""
+        if float(factor) == self.target_factor and not immediate:
+            return
+        self.target_factor = float(factor)
+        if immediate or self.glide_time <= 0:
+            self.factor = self.target_factor
+        else:
+            self.glide_rate = abs(self.target_factor - self.factor) / self.glide_time
+
+    def _advance_factor(self, n_samples):
+        if self.factor == self.target_factor:
+            return
+        step = self.glide_rate * n_samples / self.sample_rate
+        if abs(self.target_factor - self.factor) <= step:
+            self.factor = self.target_factor
+        else:
+            self.factor += step if self.target_factor > self.factor else -step
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        x = block.reshape(len(block), -1)
+        if x.shape[1] != self.channels:
+            raise ValueError(f"Expected {self.channels} channels, got {x.shape[1]}")
+
+        self._advance_factor(len(x))
+        stretched = self.stretcher.process(x, self.factor)
+
+        self.fifo = np.concatenate([self.fifo, self.resampler.process(stretched, self.factor)])
+
+        n = len(x)
+        if len(self.fifo) < n:
+            self.underruns += 1
+            self.fifo = np.concatenate([self.fifo, np.zeros((n - len(self.fifo), self.channels), np.float32)])
+        out, self.fifo = self.fifo[:n], self.fifo[n:]
+        if len(self.fifo) > self.prime_samples + n:
+            self.overruns += 1
+            self.fifo = self.fifo[len(self.fifo) - self.prime_samples:]
+        return out.reshape(block.shape)
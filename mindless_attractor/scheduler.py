@@ -0,0 +1,106 @@
+"""按实测耗时自适应调整处理频率
+
+每个阶段（推理、MJPEG 编码）用 EWMA 跟踪单次处理耗时，频率取
+cpu_budget / 耗时，并限制在 [min_rate, max_rate] 之间。deadline 不影响频率
+（单次耗时超过 deadline 时降频也无法让结果更新鲜），而是由调用方在处理前用
+is_stale 丢弃采集时间已超过 deadline 的帧；超时的结果只计入 deadline_misses。
+调用方总是处理最新一帧，不再按固定步长跳帧。
+"""
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveRate:
+    def __init__(self, name, cpu_budget=0.5, deadline=None, min_rate=1.0, max_rate=30.0,
+                 smoothing=0.2):
+        self.name = name
+        self.cpu_budget = cpu_budget  # 该阶段可占用的单核比例
+        self.deadline = deadline      # 新鲜度上限（秒），None 表示不限制
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.cost = None       # 单次耗时 EWMA
+        self.staleness = None  # 新鲜度 EWMA
+        self.period = None     # 实际间隔 EWMA
+        self.interval = 1.0 / max_rate
+        self.last_start = None
+        self.next_due = 0.0
+        self.runs = 0
+        self.deadline_misses = 0
+        self.stale_skips = 0
+
+    def _ewma(self, old, value):
+        return value if old is None else old + self.smoothing * (value - old)
+
+    def begin(self):
+        """开始一次处理，返回开始时间"""
+        now = time.monotonic()
+        with self.lock:
+            if self.last_start is not None:
+                self.period = self._ewma(self.period, now - self.last_start)
+            self.last_start = now
+        return now
+
+    def is_stale(self, capture_time):
+        """采集于 capture_time 的帧是否已超过 deadline，超过时调用方应跳过它"""
+        if self.deadline is None or not capture_time or time.time() - capture_time <= self.deadline:
+            return False
+        with self.lock:
+            self.stale_skips += 1
+        return True
+
+    def end(self, start, capture_time=None):
+        """记录一次处理的耗时与（可选的）结果新鲜度，更新处理间隔"""
+        now = time.monotonic()
+        with self.lock:
+            self.runs += 1
+            self.cost = self._ewma(self.cost, now - start)
+            if capture_time is not None:
+                staleness = time.time() - capture_time
+                self.staleness = self._ewma(self.staleness, staleness)
+                if self.deadline is not None and staleness > self.deadline:
+                    self.deadline_misses += 1
+            interval = max(1.0 / self.max_rate, self.cost / self.cpu_budget)
+            self.interval = min(interval, 1.0 / self.min_rate)
+            self.next_due = start + self.interval
+
+    def delay(self):
+        """距下一次处理还需等待的秒数"""
+        return max(0.0, self.next_due - time.monotonic())
+
+    def due(self):
+        return self.delay() == 0.0
+
+    def wait(self, stop_event=None):
+        """等待到下一次处理时间；stop_event 被设置时提前返回"""
+        delay = self.delay()
+        if delay > 0:
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+
+    @property
+    def target_rate(self):
+        return 1.0 / self.interval
+
+    @property
+    def achieved_rate(self):
+        return 1.0 / self.period if self.period else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'cpu_budget': self.cpu_budget,
+                'deadline_ms': self.deadline * 1000 if self.deadline is not None else None,
+                'cost_ms': round(self.cost * 1000, 2) if self.cost is not None else None,
+                'staleness_ms': round(self.staleness * 1000, 2) if self.staleness is not None else None,
+                'target_rate_hz': round(1.0 / self.interval, 2),
+                'achieved_rate_hz': round(1.0 / self.period, 2) if self.period else 0.0,
+                'runs': self.runs,
+                'deadline_misses': self.deadline_misses,
+                'stale_skips': self.stale_skips,
+            }
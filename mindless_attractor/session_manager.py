@@ -0,0 +1,306 @@
+"""多会话服务：每个会话独立的检测器状态，调度到工作进程池
+
+每个工作进程最多承载 sessions_per_worker 个会话，每个会话持有自己的
+HeadPoseDetector（FaceMesh 跟踪状态与闭眼计时互不干扰）。会话固定分配到一个
+工作进程，JPEG 解码与推理都在工作进程内完成，因此会话数增加时负载分摊到多核。
+"""
+import itertools
+import logging
+import multiprocessing
+import numbers
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+class SessionLimitError(Exception):
+    """超出会话数或 CPU 预算，拒绝接入"""
+
+class SessionBusyError(Exception):
+    """会话仍有帧在处理或已超出 CPU 预算，本帧被丢弃"""
+
+class SessionUnavailableError(Exception):
+    """工作进程未在时限内响应或已退出"""
+
+WARMUP_FRAME_SHAPE = (240, 320, 3)
+
+def _worker_main(worker_id, requests, responses):
+    """工作进程主循环"""
+    import cv2
+    import numpy as np
+    from detection_cascade import build_detector
+
+    detectors = {}
+    while True:
+        message = requests.get()
+        kind = message[0]
+        if kind == 'shutdown':
+            break
+        if kind == 'open':
+            # 打开会话时先推理一帧空白画面，FaceMesh 图的初始化不计入会话第一帧
+            _, session_id, request_id = message
+            try:
+                detector = build_detector()
+                detector.is_distracted(np.zeros(WARMUP_FRAME_SHAPE, np.uint8), annotate=False)
+                detector.reset_state()
+                detectors[session_id] = detector
+                result = {'opened': True}
+            except Exception as e:
+                result = {'error': str(e)}
+            result['cpu_ms'] = 0.0
+            responses.put((request_id, result))
+        elif kind == 'close':
+            detectors.pop(message[1], None)
+        elif kind == 'frame':
+            _, session_id, request_id, jpeg, timestamp = message
+            cpu_start = time.process_time()
+            try:
+                detector = detectors[session_id]
+                frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                if frame is None:
+                    raise ValueError('Invalid JPEG frame')
+                distracted, reason, _ = detector.is_distracted(frame, timestamp, annotate=False)
+                result = {'distracted': bool(distracted), 'reason': reason}
+            except Exception as e:
+                result = {'error': str(e)}
+            result['cpu_ms'] = (time.process_time() - cpu_start) * 1000
+            responses.put((request_id, result))
+
+class Session:
+    """主进程中的会话记录与 CPU 令牌桶"""
+    def __init__(self, session_id, worker_id, cpu_budget, burst=0.5):
+        self.id = session_id
+        self.worker_id = worker_id
+        self.cpu_budget = cpu_budget  # 每秒可用的 CPU 秒数（单核占比）
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.last_seen = self.last_refill
+        self.in_flight = False
+        self.frames = 0
+        self.dropped = 0
+        self.cpu_seconds = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.cpu_budget)
+        self.last_refill = now
+        self.last_seen = now
+
+    def to_dict(self):
+        return {
+            'session_id': self.id,
+            'worker': self.worker_id,
+            'cpu_budget': self.cpu_budget,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'cpu_seconds': round(self.cpu_seconds, 3),
+        }
+
+class SessionManager:
+    """会话接入控制与工作进程调度"""
+    def __init__(self, workers=None, sessions_per_worker=4, default_cpu_budget=0.25,
+                 idle_timeout=60.0, open_timeout=30.0):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.sessions_per_worker = sessions_per_worker
+        self.default_cpu_budget = default_cpu_budget
+        self.idle_timeout = idle_timeout
+        self.open_timeout = open_timeout  # 首个会话需等待工作进程导入 mediapipe 并构建 FaceMesh
+        self.sessions = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.processes = []
+        self.request_queues = []
+        self.response_queue = None
+        self.ctx = None
+        self.dispatcher = None
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.ctx = multiprocessing.get_context('spawn')  # mediapipe 不适合 fork
+            self.response_queue = self.ctx.Queue()
+            self.request_queues = [None] * self.workers
+            self.processes = [None] * self.workers
+            for worker_id in range(self.workers):
+                self._spawn_worker(worker_id)
+            self.dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self.dispatcher.start()
+            self.started = True
+        logger.info(f"Session workers started ({self.workers} x {self.sessions_per_worker} sessions)")
+
+    def _spawn_worker(self, worker_id):
+        requests = self.ctx.Queue()
+        process = self.ctx.Process(target=_worker_main, args=(worker_id, requests, self.response_queue),
+                                   daemon=True)
+        process.start()
+        self.request_queues[worker_id] = requests
+        self.processes[worker_id] = process
+
+    def _check_workers(self):
+        """工作进程异常退出时：结束其未完成的请求，重启进程并重新打开其会话（检测器状态重置）"""
+        with self.lock:
+            if not self.started:
+                return
+            for worker_id, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                logger.error(f"Session worker {worker_id} exited with code {process.exitcode}, restarting")
+                for request_id, (session, future) in list(self.pending.items()):
+                    if session.worker_id == worker_id:
+                        del self.pending[request_id]
+                        session.in_flight = False
+                        future.set_exception(SessionUnavailableError('Session worker exited'))
+                self._spawn_worker(worker_id)
+                for session in self.sessions.values():
+                    if session.worker_id == worker_id:
+                        self.request_queues[worker_id].put(('open', session.id, None))
+
+    def shutdown(self, timeout=2.0):
+        with self.lock:
+            if not self.started:
+                return
+            self.started = False
+            for requests in self.request_queues:
+                requests.put(('shutdown',))
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.response_queue.put(None)
+        self.dispatcher.join(timeout)
+        self.processes = []
+        self.request_queues = []
+        self.sessions.clear()
+
+    def _dispatch_loop(self):
+        last_check = time.monotonic()
+        while True:
+            try:
+                item = self.response_queue.get(timeout=1.0)
+            except queue.Empty:
+                item = ()
+            if time.monotonic() - last_check >= 1.0:
+                self._check_workers()
+                last_check = time.monotonic()
+            if item is None:
+                break
+            if not item:
+                continue
+            request_id, result = item
+            with self.lock:
+                entry = self.pending.pop(request_id, None)
+            if entry is None:
+                continue
+            session, future = entry
+            with self.lock:
+                session.in_flight = False
+                session.tokens -= result['cpu_ms'] / 1000
+                session.cpu_seconds += result['cpu_ms'] / 1000
+            future.set_result(result)
+
+    def _worker_load(self):
+        load = [[0, 0.0] for _ in range(self.workers)]
+        for session in self.sessions.values():
+            load[session.worker_id][0] += 1
+            load[session.worker_id][1] += session.cpu_budget
+        return load
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if not session.in_flight and now - session.last_seen > self.idle_timeout:
+                logger.info(f"Closing idle session {session_id}")
+                self.request_queues[session.worker_id].put(('close', session_id))
+                del self.sessions[session_id]
+
+    def create_session(self, cpu_budget=None):
+        """接入一个会话并等待工作进程完成预热
+
+        cpu_budget 须为 (0, 1] 内的数，否则抛出 ValueError；工作进程会话数或 CPU 预算
+        （每进程一核）不足时抛出 SessionLimitError；预热超时或失败时抛出 SessionUnavailableError。
+        """
+        if cpu_budget is None:
+            cpu_budget = self.default_cpu_budget
+        if (isinstance(cpu_budget, bool) or not isinstance(cpu_budget, numbers.Real)
+                or not 0 < cpu_budget <= 1):
+            raise ValueError('cpu_budget must be a number in (0, 1]')
+        self.start()
+        future = Future()
+        with self.lock:
+            self._expire_idle()
+            load = self._worker_load()
+            candidates = [
+                worker_id for worker_id, (count, budget) in enumerate(load)
+                if count < self.sessions_per_worker and budget + cpu_budget <= 1.0
+            ]
+            if not candidates:
+                raise SessionLimitError('No worker capacity for a new session')
+            worker_id = min(candidates, key=lambda w: load[w][1])
+            session = Session(uuid.uuid4().hex, worker_id, cpu_budget)
+            self.sessions[session.id] = session
+            request_id = next(self.request_ids)
+            self.pending[request_id] = (session, future)
+            self.request_queues[worker_id].put(('open', session.id, request_id))
+        try:
+            result = future.result(self.open_timeout)
+        except (FutureTimeoutError, SessionUnavailableError):
+            result = {'error': 'Session worker did not respond'}
+        if 'error' in result:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            self.close_session(session.id)
+            raise SessionUnavailableError(f"Failed to open session: {result['error']}")
+        logger.info(f"Session {session.id} admitted on worker {worker_id}")
+        return session
+
+    def close_session(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self.request_queues[session.worker_id].put(('close', session_id))
+        return True
+
+    def submit_frame(self, session_id, jpeg, timestamp=None, timeout=5.0):
+        """提交一帧 JPEG 并等待结果
+
+        会话不存在时抛出 KeyError；上一帧未完成或 CPU 令牌耗尽时抛出 SessionBusyError；
+        超时或工作进程退出时抛出 SessionUnavailableError，会话可继续提交下一帧。
+        """
+        future = Future()
+        with self.lock:
+            session = self.sessions[session_id]
+            session.refill()
+            if session.in_flight or session.tokens <= 0:
+                session.dropped += 1
+                raise SessionBusyError('Session is busy or over its CPU budget')
+            session.in_flight = True
+            session.frames += 1
+            request_id = next(self.request_ids)
+            self.pending[request_id] = (session, future)
+            self.request_queues[session.worker_id].put(
+                ('frame', session_id, request_id, jpeg, timestamp))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                self.pending.pop(request_id, None)
+                session.in_flight = False
+            raise SessionUnavailableError('Session worker timed out')
+
+    def stats(self):
+        with self.lock:
+            load = self._worker_load()
+            return {
+                'workers': self.workers,
+                'sessions_per_worker': self.sessions_per_worker,
+                'worker_load': [{'sessions': c, 'cpu_budget': b} for c, b in load],
+                'sessions': [s.to_dict() for s in self.sessions.values()],
+            }
@@ -0,0 +1,383 @@
+"""持久化的会话时间线：只追加的定长二进制记录与窗口聚合查询
+
+每个会话一个目录：
+    meta.json          会话 id、开始时间、记录格式与每段记录数
+    seg_000000.bin     定长记录（RECORD_DTYPE，32 字节），写满 segment_records 条后换下一段
+记录分两类：逐帧检测结果（标志位与 yaw/pitch/EAR/闭眼时长，标志位与 status_codec 相同）
+与干预类型变更。写入先进入内存批次，批次写满或每 fsync_interval 秒落盘并 fsync；
+进程异常退出最多丢失最近一个周期，段文件末尾不完整的记录在读取时忽略。
+
+查询逐段以 np.memmap 打开，按时间戳二分定位范围，分段累加窗口聚合，
+内存占用与会话长度无关。
+
+用法:
+    python session_store.py list
+    python session_store.py aggregate <session_id> --window 300
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from status_codec import FLAG_DISTRACTED, FLAG_FACE, FLAG_EYES_CLOSED, result_fields
+
+logger = logging.getLogger(__name__)
+
+RECORD_DTYPE = np.dtype({
+    'names': ['timestamp', 'yaw', 'pitch', 'ear', 'closed_duration', 'kind', 'flags', 'intervention'],
+    'formats': ['<f8', '<f4', '<f4', '<f4', '<f4', 'u1', 'u1', 'u1'],
+    'offsets': [0, 8, 12, 16, 20, 24, 25, 26],
+    'itemsize': 32,
+})
+KIND_FRAME = 0
+KIND_INTERVENTION = 1
+
+# 干预类型编码（set_intervention_type 的取值）；0 表示未设置，255 表示未知类型
+INTERVENTION_CODES = {None: 0, 'mindless': 1, 'warning': 2, 'control': 3}
+INTERVENTION_NAMES = {code: name for name, code in INTERVENTION_CODES.items()}
+UNKNOWN_INTERVENTION = 255
+
+SEGMENT_RECORDS = 1 << 16  # 每段 2 MB，15 fps 下约 73 分钟
+MAX_WINDOWS = 10000  # 单次聚合的窗口数上限，防止过小的 window 分配过大的数组
+
+def default_root():
+    return os.environ.get('MINDLESS_STORE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.mindless_attractor', 'sessions'))
+
+class SessionWriter:
+    """单个会话的追加写入；线程安全"""
+    def __init__(self, path, session_id, segment_records=SEGMENT_RECORDS, batch_records=256):
+        self.path = path
+        self.session_id = session_id
+        self.segment_records = segment_records
+        self.batch = np.zeros(batch_records, dtype=RECORD_DTYPE)
+        self.batch_len = 0
+        self.lock = threading.Lock()
+        self.records = 0
+        self.syncs = 0
+        self.closed = False
+        os.makedirs(path, exist_ok=False)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                'session_id': session_id,
+                'started': time.time(),
+                'record_dtype': RECORD_DTYPE.descr,
+                'record_size': RECORD_DTYPE.itemsize,
+                'segment_records': segment_records,
+            }, f)
+        self.segment_index = 0
+        self.segment_count = 0
+        self.file = open(self._segment_path(0), 'ab')
+
+    def _segment_path(self, index):
+        return os.path.join(self.path, f'seg_{index:06d}.bin')
+
+    def append(self, timestamp, kind=KIND_FRAME, flags=0, yaw=np.nan, pitch=np.nan, ear=np.nan,
+               closed_duration=np.nan, intervention=0):
+        with self.lock:
+            if self.closed:
+                return
+            self.batch[self.batch_len] = (timestamp, yaw, pitch, ear, closed_duration, kind, flags, intervention)
+            self.batch_len += 1
+            self.records += 1
+            if self.batch_len == len(self.batch):
+                self._write_batch()
+
+    def record_result(self, timestamp, distracted, reason, intervention=None):
+        """追加一帧 is_distracted 的结果"""
+        flags, yaw, pitch, ear, closed_duration = result_fields(distracted, reason)
+        self.append(timestamp, KIND_FRAME, flags, yaw, pitch, ear, closed_duration,
+                    INTERVENTION_CODES.get(intervention, UNKNOWN_INTERVENTION))
+
+    def record_intervention(self, timestamp, intervention):
+        self.append(timestamp, KIND_INTERVENTION,
+                    intervention=INTERVENTION_CODES.get(intervention, UNKNOWN_INTERVENTION))
+
+    def _write_batch(self):
+        """把内存批次写入段文件，跨越段边界时换段（调用方持有锁）"""
+        offset = 0
+        while offset < self.batch_len:
+            take = min(self.batch_len - offset, self.segment_records - self.segment_count)
+            self.file.write(self.batch[offset:offset + take].tobytes())
+            self.segment_count += take
+            offset += take
+            if self.segment_count == self.segment_records:
+                self._roll()
+        self.batch_len = 0
+
+    def _roll(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.segment_index += 1
+        self.segment_count = 0
+        self.file = open(self._segment_path(self.segment_index), 'ab')
+
+    def flush(self, sync=True):
+        with self.lock:
+            if self.closed:
+                return
+            self._write_batch()
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+                self.syncs += 1
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.closed = True
+            self.file.close()
+
+class SessionReader:
+    """以内存映射方式逐段读取会话"""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.segment_paths = sorted(glob.glob(os.path.join(path, 'seg_*.bin')))
+
+    def segments(self):
+        """依次返回各段的 memmap（不完整的末尾记录被忽略）"""
+        for path in self.segment_paths:
+            count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+            if count:
+                yield np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+
+    def __len__(self):
+        return sum(os.path.getsize(p) // RECORD_DTYPE.itemsize for p in self.segment_paths)
+
+    def time_range(self):
+        first = last = None
+        for segment in self.segments():
+            if first is None:
+                first = float(segment['timestamp'][0])
+            last = float(segment['timestamp'][-1])
+        return first, last
+
+    def records(self, start=None, end=None):
+        """按时间范围 [start, end) 逐段返回记录切片（时间戳按写入顺序递增）"""
+        for segment in self.segments():
+            timestamps = segment['timestamp']
+            if start is not None and timestamps[-1] < start:
+                continue
+            if end is not None and timestamps[0] >= end:
+                break
+            lo = 0 if start is None else int(np.searchsorted(timestamps, start, 'left'))
+            hi = len(segment) if end is None else int(np.searchsorted(timestamps, end, 'left'))
+            if hi > lo:
+                yield segment[lo:hi]
+
+    def aggregate(self, window=60.0, start=None, end=None, min_episode=0.0):
+        """按 window 秒分窗统计分心比例、平均 yaw/pitch 与闭眼片段
+
+        闭眼片段为连续带 FLAG_EYES_CLOSED 的帧。该标志在持续闭眼 CLOSED_EYES_TIME 之后才置位，
+        因此片段开始时间由首帧的 closed_duration 回推到实际闭眼的时刻。时长不短于
+        min_episode 秒的片段才计入，归属到片段开始所在的窗口。
+        window 不为正或窗口数超过 MAX_WINDOWS 时抛出 ValueError。
+        """
+        if not window > 0:
+            raise ValueError('window must be positive')
+        first, last = self.time_range()
+        if first is None:
+            return {'session_id': self.meta['session_id'], 'window': window, 'windows': [], 'interventions': []}
+        origin = first if start is None else start
+        stop = last if end is None else min(end, last)
+        n = max(1, int((stop - origin) // window) + 1)
+        if n > MAX_WINDOWS:
+            raise ValueError(f'window too small: {n} windows exceeds the limit of {MAX_WINDOWS}')
+        frames = np.zeros(n, dtype=np.int64)
+        distracted = np.zeros(n, dtype=np.int64)
+        faces = np.zeros(n, dtype=np.int64)
+        yaw_sum = np.zeros(n)
+        pitch_sum = np.zeros(n)
+        episodes = np.zeros(n, dtype=np.int64)
+        closed_seconds = np.zeros(n)
+        interventions = []
+        run_start = run_last = None  # 跨段延续的闭眼片段
+
+        def close_episode(begin, finish):
+            if finish - begin >= min_episode:
+                i = min(n - 1, max(0, int((begin - origin) // window)))
+                episodes[i] += 1
+                closed_seconds[i] += finish - begin
+
+        for chunk in self.records(start, end):
+            kinds = chunk['kind']
+            for record in chunk[kinds == KIND_INTERVENTION]:
+                interventions.append({
+                    'timestamp': float(record['timestamp']),
+                    'type': INTERVENTION_NAMES.get(int(record['intervention']), 'unknown'),
+                })
+            chunk = chunk[kinds == KIND_FRAME]
+            if not len(chunk):
+                continue
+            ts = chunk['timestamp']
+            flags = chunk['flags']
+            index = np.clip(((ts - origin) // window).astype(np.int64), 0, n - 1)
+            face = (flags & FLAG_FACE) != 0
+            frames += np.bincount(index, minlength=n)
+            distracted += np.bincount(index, weights=(flags & FLAG_DISTRACTED) != 0, minlength=n).astype(np.int64)
+            faces += np.bincount(index[face], minlength=n)
+            yaw_sum += np.bincount(index[face], weights=chunk['yaw'][face], minlength=n)
+            pitch_sum += np.bincount(index[face], weights=chunk['pitch'][face], minlength=n)
+
+            # 闭眼片段：标志位的上升沿开始、下降沿结束
+            closed = ((flags & FLAG_EYES_CLOSED) != 0).astype(np.int8)
+            edges = np.diff(closed, prepend=np.int8(run_start is not None))
+            rising = np.flatnonzero(edges == 1)
+            starts = list(ts[rising] - np.nan_to_num(chunk['closed_duration'][rising]))
+            ends = [ts[i - 1] if i > 0 else run_last for i in np.flatnonzero(edges == -1)]
+            if run_start is not None:
+                starts.insert(0, run_start)
+            if closed[-1]:
+                run_start, run_last = starts.pop(), float(ts[-1])
+            else:
+                run_start = run_last = None
+            for begin, finish in zip(starts, ends):
+                close_episode(float(begin), float(finish))
+        if run_start is not None:
+            close_episode(run_start, run_last)
+
+        windows = []
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = distracted / frames
+            mean_yaw = yaw_sum / faces
+            mean_pitch = pitch_sum / faces
+        for i in range(n):
+            if not frames[i]:
+                continue
+            windows.append({
+                'start': origin + i * window,
+                'frames': int(frames[i]),
+                'distraction_ratio': float(ratio[i]),
+                'face_ratio': float(faces[i] / frames[i]),
+                'mean_yaw': float(mean_yaw[i]) if faces[i] else None,
+                'mean_pitch': float(mean_pitch[i]) if faces[i] else None,
+                'eyes_closed_episodes': int(episodes[i]),
+                'eyes_closed_seconds': float(closed_seconds[i]),
+            })
+        total = int(frames.sum())
+        return {
+            'session_id': self.meta['session_id'],
+            'window': window,
+            'start': origin,
+            'end': stop,
+            'frames': total,
+            'distraction_ratio': float(distracted.sum() / total) if total else None,
+            'eyes_closed_episodes': int(episodes.sum()),
+            'windows': windows,
+            'interventions': interventions,
+        }
+
+class SessionStore:
+    """会话目录的根；同一时间最多一个活动会话，后台线程定期落盘并 fsync"""
+    def __init__(self, root=None, fsync_interval=5.0, segment_records=SEGMENT_RECORDS):
+        self.root = root or default_root()
+        os.makedirs(self.root, exist_ok=True)
+        self.fsync_interval = fsync_interval
+        self.segment_records = segment_records
+        self.lock = threading.Lock()
+        self.writer = None
+        self.intervention = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sync_loop, daemon=True)
+        self.thread.start()
+
+    def start_session(self):
+        """开始新会话（已有活动会话时直接返回它）；首条记录为当前干预类型"""
+        with self.lock:
+            if self.writer is None:
+                session_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+                self.writer = SessionWriter(os.path.join(self.root, session_id), session_id,
+                                            self.segment_records)
+                self.writer.record_intervention(time.time(), self.intervention)
+                logger.info(f"Recording session {session_id}")
+            return self.writer
+
+    def end_session(self):
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+            logger.info(f"Closed session {writer.session_id} ({writer.records} records)")
+
+    def record_result(self, result):
+        """流水线订阅回调：把推理结果追加到活动会话"""
+        writer = self.writer
+        if writer is not None:
+            writer.record_result(result.timestamp, result.distracted, result.reason, self.intervention)
+
+    def record_intervention(self, intervention):
+        self.intervention = intervention
+        writer = self.writer
+        if writer is not None:
+            writer.record_intervention(time.time(), intervention)
+
+    def _sync_loop(self):
+        while not self.stop_event.wait(self.fsync_interval):
+            writer = self.writer
+            if writer is not None:
+                try:
+                    writer.flush()
+                except Exception as e:
+                    logger.error(f"Session store flush failed: {e}")
+
+    def sessions(self):
+        """所有会话的概要（按开始时间）"""
+        summaries = []
+        for path in sorted(glob.glob(os.path.join(self.root, '*', 'meta.json'))):
+            reader = SessionReader(os.path.dirname(path))
+            first, last = reader.time_range()
+            summaries.append({
+                'session_id': reader.meta['session_id'],
+                'started': reader.meta['started'],
+                'records': len(reader),
+                'first': first,
+                'last': last,
+                'active': self.writer is not None and self.writer.session_id == reader.meta['session_id'],
+            })
+        return summaries
+
+    def reader(self, session_id):
+        path = os.path.join(self.root, os.path.basename(session_id))
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            raise KeyError(session_id)
+        if self.writer is not None and self.writer.session_id == session_id:
+            self.writer.flush(sync=False)  # 查询活动会话时包含最近的批次
+        return SessionReader(path)
+
+    def close(self):
+        self.stop_event.set()
+        self.end_session()
+
+def main():
+    parser = argparse.ArgumentParser(description='查看会话时间线')
+    parser.add_argument('--root', default=None, help='会话根目录，默认 MINDLESS_STORE_DIR')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='列出会话')
+    aggregate = sub.add_parser('aggregate', help='窗口聚合')
+    aggregate.add_argument('session_id')
+    aggregate.add_argument('--window', type=float, default=60.0)
+    aggregate.add_argument('--min-episode', type=float, default=0.0)
+    args = parser.parse_args()
+
+    root = args.root or default_root()
+    if args.command == 'list':
+        for path in sorted(glob.glob(os.path.join(root, '*', 'meta.json'))):
+            reader = SessionReader(os.path.dirname(path))
+            first, last = reader.time_range()
+            print(json.dumps({'session_id': reader.meta['session_id'], 'records': len(reader),
+                              'first': first, 'last': last}))
+    else:
+        reader = SessionReader(os.path.join(root, args.session_id))
+        print(json.dumps(reader.aggregate(args.window, min_episode=args.min_episode), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+"""共享内存多进程推理
+
+摄像头帧直接写入 multiprocessing.shared_memory 中的环形缓冲区，推理工作进程
+映射同一块内存零拷贝读取最新帧，结果写回共享结果表（每个工作进程一行，版本号
+为奇数表示正在写入）。Web 进程只负责采集与 I/O，推理不再与 Flask、编码线程争用 GIL。
+
+SharedMemoryPipeline 与 InferencePipeline 接口相同，可直接替换；设置环境变量
+MINDLESS_INFERENCE_PROCS=N 启用。该模式下不在服务端绘制标注画面，
+MJPEG 推送原始帧，叠加层由浏览器绘制。
+
+各工作进程交替处理同一路视频的帧，因此依赖连续帧的闭眼计时不在工作进程中判断：
+工作进程只上报 EAR 与姿态是否超阈值，父进程按帧序号顺序计时并给出最终结论。
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pipeline import InferenceResult, INFERENCE_SECONDS, CAPTURE_TO_RESULT_SECONDS, SKIPPED_FRAMES
+from scheduler import AdaptiveRate
+
+logger = logging.getLogger(__name__)
+
+RESULT_DTYPE = np.dtype([
+    ('version', np.int64),
+    ('seq', np.int64),
+    ('timestamp', np.float64),
+    ('capture_time', np.float64),
+    ('cost', np.float64),
+    ('distracted', np.bool_),
+    ('face', np.bool_),
+    ('pose_distracted', np.bool_),
+    ('yaw', np.float32),
+    ('pitch', np.float32),
+    ('ear', np.float32),
+    ('points', np.float32, (5, 2)),
+])
+
+class SharedFrameRing:
+    """共享内存帧环：latest | 每槽位帧序号 | 每槽位采集时间 | 帧数据"""
+    def __init__(self, shm, ring_size, frame_shape, owner):
+        self.shm = shm
+        self.ring_size = ring_size
+        self.frame_shape = tuple(frame_shape)
+        self.owner = owner
+        buf = shm.buf
+        offset = 0
+        self.header = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8
+        self.seqs = np.ndarray((ring_size,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * ring_size
+        self.times = np.ndarray((ring_size,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += 8 * ring_size
+        self.frames = np.ndarray((ring_size,) + self.frame_shape, dtype=np.uint8, buffer=buf, offset=offset)
+
+    @staticmethod
+    def nbytes(ring_size, frame_shape):
+        return 8 + 16 * ring_size + ring_size * int(np.prod(frame_shape))
+
+    @classmethod
+    def create(cls, ring_size, frame_shape):
+        shm = shared_memory.SharedMemory(create=True, size=cls.nbytes(ring_size, frame_shape))
+        ring = cls(shm, ring_size, frame_shape, owner=True)
+        ring.header[0] = 0
+        ring.seqs[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, ring_size, frame_shape):
+        return cls(shared_memory.SharedMemory(name=name), ring_size, frame_shape, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def invalidate(self, seq):
+        """采集线程开始写入槽位前调用：槽位序号置为 -1，正在读取旧帧的工作进程据此丢弃结果"""
+        self.seqs[seq % self.ring_size] = -1
+
+    def publish(self, seq):
+        """采集线程写完槽位后调用：先写槽位序号，再更新 latest"""
+        self.seqs[seq % self.ring_size] = seq
+        self.header[0] = seq
+
+    def latest(self):
+        return int(self.header[0])
+
+    def valid(self, seq):
+        return seq > 0 and self.seqs[seq % self.ring_size] == seq
+
+    def view(self, seq):
+        """返回 (帧视图, 采集时间)；槽位已被覆盖时返回 (None, None)"""
+        slot = seq % self.ring_size
+        if self.seqs[slot] != seq:
+            return None, None
+        return self.frames[slot], float(self.times[slot])
+
+    def close(self):
+        del self.header, self.seqs, self.times, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class SharedResultTable:
+    """每个工作进程一行的结果表，用版本号（seqlock）保证读到完整的一行"""
+    def __init__(self, shm, rows, owner):
+        self.shm = shm
+        self.owner = owner
+        self.rows = np.ndarray((rows,), dtype=RESULT_DTYPE, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, rows):
+        shm = shared_memory.SharedMemory(create=True, size=rows * RESULT_DTYPE.itemsize)
+        table = cls(shm, rows, owner=True)
+        table.rows[:] = np.zeros(rows, dtype=RESULT_DTYPE)
+        return table
+
+    @classmethod
+    def attach(cls, name, rows):
+        return cls(shared_memory.SharedMemory(name=name), rows, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, row, **values):
+        record = self.rows[row]
+        record['version'] += 1  # 奇数：写入中
+        for key, value in values.items():
+            record[key] = value
+        record['version'] += 1
+
+    def read(self, row):
+        """读取一行的副本；正在写入或读取期间被改写时返回 None"""
+        record = self.rows[row]
+        version = int(record['version'])
+        if version % 2:
+            return None
+        copy = record.copy()
+        if int(record['version']) != version:
+            return None
+        return copy
+
+    def close(self):
+        del self.rows
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _inference_worker(worker_id, ring_name, ring_size, frame_shape, table_name, rows,
+                      frame_cond, claimed, notify, running, stop_event, max_rate):
+    """工作进程：认领最新一帧，零拷贝读取并推理，结果写回共享结果表
+
+    没有可认领的新帧或流水线已停止时阻塞在 frame_cond 上，新帧、start 与 shutdown 都会唤醒。
+    """
+    from detection_cascade import build_detector
+
+    ring = SharedFrameRing.attach(ring_name, ring_size, frame_shape)
+    table = SharedResultTable.attach(table_name, rows)
+    detector = build_detector()
+    thresholds = getattr(detector, 'detector', detector)  # 级联包装内的 HeadPoseDetector
+    rate = AdaptiveRate(f'worker-{worker_id}', cpu_budget=1.0, max_rate=max_rate)
+
+    def claim():
+        latest = ring.latest()
+        if not running.is_set() or latest <= claimed.value:
+            return None
+        claimed.value = latest
+        return latest
+
+    try:
+        while not stop_event.is_set():
+            with frame_cond:
+                seq = claim()
+                if seq is None:
+                    frame_cond.wait(0.5)
+                    seq = claim()
+            if seq is None:
+                continue
+
+            frame, capture_time = ring.view(seq)
+            if frame is None:
+                continue
+            start = rate.begin()
+            distracted, reason, _ = detector.is_distracted(frame, capture_time, annotate=False)
+            if not ring.valid(seq):
+                continue  # 推理期间槽位被覆盖，结果不可信
+            cost = time.monotonic() - start
+
+            landmarks = detector.last_landmarks
+            head_pose, eyes = reason.get('head_pose', {}), reason.get('eyes', {})
+            yaw, pitch = head_pose.get('yaw'), head_pose.get('pitch')
+            face = landmarks is not None and yaw is not None
+            table.write(
+                worker_id,
+                seq=seq,
+                timestamp=time.time(),
+                capture_time=capture_time,
+                cost=cost,
+                distracted=bool(distracted),
+                face=face,
+                pose_distracted=face and (abs(yaw) > thresholds.YAW_THRESHOLD or
+                                          abs(pitch) > thresholds.PITCH_THRESHOLD),
+                yaw=yaw if yaw is not None else np.nan,
+                pitch=pitch if pitch is not None else np.nan,
+                ear=eyes.get('ear') if eyes.get('ear') is not None else np.nan,
+                points=landmarks[detector.OVERLAY_INDICES, :2] if landmarks is not None else 0.0,
+            )
+            notify.release()
+            rate.end(start)
+            rate.wait(stop_event)
+    finally:
+        ring.close()
+        table.close()
+
+class EyeClosureTimer:
+    """父进程中的持续闭眼计时，与 HeadPoseDetector.check_eyes_closed 一致；须按帧顺序调用"""
+    def __init__(self, ear_threshold=0.15, closed_eyes_time=2.0):
+        self.ear_threshold = ear_threshold
+        self.closed_eyes_time = closed_eyes_time
+        self.closed_since = None
+
+    def update(self, ear, timestamp):
+        """返回 (是否持续闭眼, 闭眼时长)"""
+        if ear < self.ear_threshold:
+            if self.closed_since is None:
+                self.closed_since = timestamp
+            elif timestamp - self.closed_since >= self.closed_eyes_time:
+                return True, timestamp - self.closed_since
+        else:
+            self.closed_since = None
+        return False, 0.0
+
+def _reason_from_row(row, distracted, eyes_closed, closed_duration):
+    """由结果表的一行与父进程的闭眼判断重建与 HeadPoseDetector.is_distracted 相同结构的 reason"""
+    if not row['face']:
+        return {
+            "head_pose": {"yaw": None, "pitch": None},
+            "eyes": {"closed": None, "closed_duration": None},
+            "attention_level": "unknown",
+            "reason": "No face detected"
+        }
+    return {
+        "head_pose": {"yaw": float(row['yaw']), "pitch": float(row['pitch'])},
+        "eyes": {
+            "closed": eyes_closed,
+            "closed_duration": closed_duration or None,
+            "ear": float(row['ear'])
+        },
+        "attention_level": "distracted" if distracted else "focused"
+    }
+
+class SharedMemoryPipeline:
+    """多进程推理流水线，对外接口与 InferencePipeline 一致"""
+    def __init__(self, controller, camera_manager, workers=2, scheduler=None):
+        self.controller = controller
+        self.camera_manager = camera_manager
+        self.workers = workers
+        # 工作进程按 max_rate / workers 限速；这里的实例只用于统计实际频率与新鲜度
+        self.scheduler = scheduler or AdaptiveRate('analysis', cpu_budget=float(workers), max_rate=15.0)
+        self.annotation_demand = lambda: False
+        self.active = False
+        self.generation = 0  # 每次 start 递增，快速 stop/start 时旧的收集线程据此退出
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.result_cond = threading.Condition()
+        self.latest = None
+        self.ring = None
+        self.table = None
+        self.processes = []
+        self.collector = None
+        self.ctx = multiprocessing.get_context('spawn')  # mediapipe 不适合 fork
+        self.stop_event = None
+        self.running = None
+        self.notify = None
+        self.frame_cond = None
+        self.claimed = None
+        self.eye_timer = EyeClosureTimer()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _launch(self):
+        """分配共享内存并启动工作进程（首次 start 时）"""
+        frame_shape = self.camera_manager.ring.shape[1:]
+        ring_size = self.camera_manager.ring_size
+        self.ring = SharedFrameRing.create(ring_size, frame_shape)
+        self.table = SharedResultTable.create(self.workers)
+
+        # 同步原语须由父进程持有，子进程完成反序列化前被回收会导致 attach 失败
+        self.stop_event = self.ctx.Event()
+        self.running = self.ctx.Event()  # 清除时工作进程阻塞等待，不再轮询
+        self.notify = self.ctx.Semaphore(0)
+        self.frame_cond = self.ctx.Condition()  # 同时保护帧认领
+        self.claimed = self.ctx.Value('q', 0, lock=False)  # 已被认领的最新帧序号
+        self.camera_manager.attach_shared_ring(self.ring.frames, self.ring.times, self._on_frame,
+                                               self.ring.invalidate)
+        max_rate = self.scheduler.max_rate / self.workers
+        for worker_id in range(self.workers):
+            process = self.ctx.Process(
+                target=_inference_worker,
+                args=(worker_id, self.ring.name, ring_size, frame_shape, self.table.name, self.workers,
+                      self.frame_cond, self.claimed, self.notify, self.running, self.stop_event, max_rate),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        logger.info(f"Started {self.workers} inference processes on shared frame ring {self.ring.name}")
+
+    def _on_frame(self, seq):
+        """采集线程写完一帧后调用：发布帧序号并唤醒一个等待中的工作进程"""
+        self.ring.publish(seq)
+        with self.frame_cond:
+            self.frame_cond.notify()
+
+    def _wake_workers(self):
+        with self.frame_cond:
+            self.frame_cond.notify_all()
+
+    def start(self):
+        with self.lock:
+            if self.active:
+                return
+            if not self.processes:
+                self._launch()
+            self.active = True
+            self.eye_timer = EyeClosureTimer()
+            self.running.set()
+            self._wake_workers()
+            self.generation += 1
+            self.collector = threading.Thread(target=self._collect_loop, args=(self.generation,), daemon=True)
+            self.collector.start()
+
+    def stop(self):
+        with self.lock:
+            self.active = False
+            if self.running is not None:
+                self.running.clear()
+        with self.result_cond:
+            self.result_cond.notify_all()
+
+    def shutdown(self, timeout=2.0):
+        """停止工作进程并释放共享内存"""
+        self.stop()
+        if not self.processes:
+            return
+        self.stop_event.set()
+        self._wake_workers()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.collector is not None:
+            self.collector.join(timeout)
+        self.camera_manager.detach_shared_ring()
+        self.ring.close()
+        self.table.close()
+        self.ring = self.table = None
+
+    def wait_for_result(self, after_seq=-1, timeout=None):
+        """等待帧序号大于 after_seq 的结果，超时或停止时返回 None"""
+        with self.result_cond:
+            self.result_cond.wait_for(
+                lambda: not self.active or (self.latest is not None and self.latest.seq > after_seq),
+                timeout
+            )
+            latest = self.latest
+        if latest is not None and latest.seq > after_seq:
+            return latest
+        return None
+
+    def _publish(self, result):
+        with self.result_cond:
+            self.latest = result
+            self.result_cond.notify_all()
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error(f"Subscriber error: {e}")
+
+    def _running(self, generation):
+        return self.active and generation == self.generation
+
+    def _collect_loop(self, generation):
+        last_seq = 0
+        while self._running(generation):
+            if not self.notify.acquire(timeout=0.5):
+                continue
+            if not self._running(generation):
+                self.notify.release()  # 通知留给新的收集线程
+                break
+            rows = [self.table.read(i) for i in range(self.workers)]
+            rows = [r for r in rows if r is not None and r['seq'] > last_seq]
+            if not rows:
+                continue
+            row = max(rows, key=lambda r: r['seq'])  # 多个工作进程可能乱序完成，只发布更新的帧
+            seq = int(row['seq'])
+            if last_seq > 0 and seq - last_seq > 1:
+                SKIPPED_FRAMES.inc(seq - last_seq - 1)
+            last_seq = seq
+
+            capture_time = float(row['capture_time'])
+            timestamp = float(row['timestamp'])
+            eyes_closed, closed_duration = False, 0.0
+            if row['face']:
+                # 结果按帧序号递增发布，闭眼计时看到的是单一有序的帧流
+                eyes_closed, closed_duration = self.eye_timer.update(float(row['ear']), capture_time)
+                distracted = bool(row['pose_distracted']) or eyes_closed
+            else:
+                distracted = bool(row['distracted'])
+            INFERENCE_SECONDS.observe(float(row['cost']))
+            CAPTURE_TO_RESULT_SECONDS.observe(time.time() - capture_time)
+            start = self.scheduler.begin()
+            self.scheduler.end(start - float(row['cost']), capture_time)
+            self.controller.attention_stats.update(distracted, timestamp)
+
+            self._publish(InferenceResult(
+                seq, timestamp, distracted, _reason_from_row(row, distracted, eyes_closed, closed_duration),
+                None, capture_time,
+                np.array(row['points']) if row['face'] else None, self.ring.frame_shape
+            ))
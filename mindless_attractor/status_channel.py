@@ -0,0 +1,195 @@
+"""变化驱动的 Socket.IO 状态通道
+
+只有状态翻转（分心、检测到人脸、闭眼）或数值变化超过阈值时才广播，
+另外每 keyframe_interval 秒发送一次关键帧。每个客户端只保留最新一条待发送
+消息，按客户端的最小发送间隔合并中间更新。消息为 status_codec 编码的二进制。
+提供 stats_provider 时，每个关键帧同时广播一次滚动统计（stats_event，JSON）。
+订阅了叠加层的客户端还会收到每个推理结果的关键点包（overlay_event），由浏览器绘制。
+"""
+import math
+import threading
+import time
+import logging
+
+import metrics
+from status_codec import FLAG_KEYFRAME, pack_fields, pack_overlay, result_fields
+
+logger = logging.getLogger(__name__)
+
+SERIALIZE_SECONDS = metrics.histogram('status_serialize_seconds', 'Status packet encoding time')
+EMIT_SECONDS = metrics.histogram('status_emit_seconds', 'socketio.emit time per client packet')
+CAPTURE_TO_EMIT_SECONDS = metrics.histogram('status_capture_to_emit_seconds',
+                                            'End-to-end time from camera capture to status emit')
+
+# 数值变化超过阈值才发送
+CHANGE_THRESHOLDS = {
+    'yaw': 2.0,
+    'pitch': 2.0,
+    'ear': 0.02,
+    'closed_duration': 0.5,
+}
+FIELD_INDEX = {'yaw': 1, 'pitch': 2, 'ear': 3, 'closed_duration': 4}
+
+class StatusClient:
+    def __init__(self, sid, min_interval, overlay=False):
+        self.sid = sid
+        self.min_interval = min_interval
+        self.overlay = overlay
+        self.pending = None  # (packet, capture_time)
+        self.pending_overlay = None
+        self.last_sent = 0.0
+        self.sent = 0
+        self.coalesced = 0
+
+    def due(self, now):
+        return self.last_sent + self.min_interval - now
+
+class StatusChannel:
+    """订阅 InferencePipeline，把结果按需推送给已连接的客户端"""
+    def __init__(self, socketio, event='attention_packet', keyframe_interval=2.0,
+                 min_interval=0.1, thresholds=None, stats_provider=None, stats_event='attention_stats',
+                 overlay_event='overlay_packet'):
+        self.socketio = socketio
+        self.overlay_event = overlay_event
+        self.stats_provider = stats_provider
+        self.stats_event = stats_event
+        self.event = event
+        self.keyframe_interval = keyframe_interval
+        self.min_interval = min_interval
+        self.thresholds = thresholds or CHANGE_THRESHOLDS
+        self.clients = {}
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stats_due = False
+        self.last_fields = None
+        self.last_seq = 0
+        self.last_keyframe = 0.0
+        self.published = 0
+        self.suppressed = 0
+
+    def add_client(self, sid, max_rate=None, overlay=False):
+        """注册客户端并立即排队一个关键帧
+
+        max_rate 为该客户端每秒最多接收的消息数，overlay 表示同时接收叠加层关键点包。
+        """
+        min_interval = 1.0 / max_rate if max_rate else self.min_interval
+        with self.cond:
+            client = self.clients.get(sid)
+            if client is None:
+                client = self.clients[sid] = StatusClient(sid, min_interval, overlay)
+            else:
+                client.min_interval = min_interval
+                client.overlay = overlay
+            if self.last_fields is not None:
+                client.pending = (pack_fields(self.last_seq, self.last_fields, keyframe=True), None)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._send_loop, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def remove_client(self, sid):
+        with self.cond:
+            self.clients.pop(sid, None)
+
+    def _changed(self, fields):
+        last = self.last_fields
+        if last is None or (fields[0] & ~FLAG_KEYFRAME) != last[0]:
+            return True
+        for name, threshold in self.thresholds.items():
+            i = FIELD_INDEX[name]
+            a, b = fields[i], last[i]
+            if math.isnan(a) != math.isnan(b):
+                return True
+            if not math.isnan(a) and abs(a - b) > threshold:
+                return True
+        return False
+
+    def publish(self, result):
+        """流水线订阅回调"""
+        start = time.perf_counter()
+        fields = result_fields(result.distracted, result.reason)
+        now = time.monotonic()
+        with self.cond:
+            overlay_clients = [c for c in self.clients.values() if c.overlay]
+            if overlay_clients and getattr(result, 'frame_shape', None) is not None:
+                overlay = pack_overlay(result.seq, result.distracted, fields[1],
+                                       result.overlay_points, result.frame_shape)
+                for client in overlay_clients:
+                    if client.pending_overlay is not None:
+                        client.coalesced += 1
+                    client.pending_overlay = overlay
+                self.cond.notify()
+            keyframe = now - self.last_keyframe >= self.keyframe_interval
+            if not keyframe and not self._changed(fields):
+                self.suppressed += 1
+                return
+            if keyframe:
+                self.last_keyframe = now
+                self.stats_due = self.stats_provider is not None
+            self.last_fields = fields
+            self.last_seq = result.seq
+            self.published += 1
+            capture_time = getattr(result, 'capture_time', None) or None
+            packet = pack_fields(result.seq, fields, keyframe, capture_time)
+            keyframe_packet = packet if keyframe else pack_fields(result.seq, fields, True, capture_time)
+            SERIALIZE_SECONDS.observe(time.perf_counter() - start)
+            for client in self.clients.values():
+                replaces_keyframe = False
+                if client.pending is not None:
+                    client.coalesced += 1
+                    # 被合并掉的关键帧标记要保留下来（flags 位于第 5 字节）
+                    replaces_keyframe = bool(client.pending[0][4] & FLAG_KEYFRAME)
+                client.pending = (keyframe_packet if replaces_keyframe else packet, capture_time)
+            self.cond.notify()
+
+    def _send_loop(self):
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                ready = []
+                wait = None
+                for client in self.clients.values():
+                    if client.pending is None and client.pending_overlay is None:
+                        continue
+                    delay = client.due(now)
+                    if delay <= 0:
+                        ready.append((client.sid, client.pending, client.pending_overlay))
+                        client.pending = None
+                        client.pending_overlay = None
+                        client.last_sent = now
+                        client.sent += 1
+                    elif wait is None or delay < wait:
+                        wait = delay
+                stats_due, self.stats_due = self.stats_due, False
+                if not ready and not stats_due:
+                    self.cond.wait(wait if wait is not None else 1.0)
+                    continue
+            if stats_due and self.clients:
+                try:
+                    self.socketio.emit(self.stats_event, self.stats_provider())
+                except Exception as e:
+                    logger.error(f"Stats emit error: {e}")
+            for sid, pending, overlay in ready:
+                try:
+                    if overlay is not None:
+                        self.socketio.emit(self.overlay_event, overlay, to=sid)
+                    if pending is not None:
+                        packet, capture_time = pending
+                        start = time.perf_counter()
+                        self.socketio.emit(self.event, packet, to=sid)
+                        EMIT_SECONDS.observe(time.perf_counter() - start)
+                        if capture_time:
+                            CAPTURE_TO_EMIT_SECONDS.observe(time.time() - capture_time)
+                except Exception as e:
+                    logger.error(f"Status emit error: {e}")
+
+    def stats(self):
+        with self.cond:
+            return {
+                'published': self.published,
+                'suppressed': self.suppressed,
+                'clients': [
+                    {'sid': c.sid, 'sent': c.sent, 'coalesced': c.coalesced, 'overlay': c.overlay}
+                    for c in self.clients.values()
+                ],
+            }
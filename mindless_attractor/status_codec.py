@@ -0,0 +1,88 @@
+"""紧凑的二进制检测结果编码
+
+布局（小端，21 字节）：
+    uint32 seq | uint8 flags | float32 yaw | float32 pitch | float32 ear | float32 closed_duration
+未知数值编码为 NaN。状态通道的包在末尾追加 float64 采集时间（Unix 秒，共 29 字节），
+用于测量从摄像头采集到客户端收到的延迟；按固定偏移解码的客户端可忽略。
+"""
+import math
+import struct
+
+FLAG_DISTRACTED = 1
+FLAG_FACE = 2
+FLAG_EYES_CLOSED = 4
+FLAG_KEYFRAME = 8  # 周期性完整状态，客户端据此重新同步
+
+RESULT_STRUCT = struct.Struct('<IBffff')
+CAPTURE_TIME_STRUCT = struct.Struct('<d')
+
+def _value(v):
+    return float(v) if v is not None else math.nan
+
+def _optional(v):
+    return None if math.isnan(v) else v
+
+def result_fields(distracted, reason):
+    """提取 (flags, yaw, pitch, ear, closed_duration)，缺失值为 NaN"""
+    head_pose = reason.get('head_pose') or {}
+    eyes = reason.get('eyes') or {}
+    flags = 0
+    if distracted:
+        flags |= FLAG_DISTRACTED
+    if head_pose.get('yaw') is not None:
+        flags |= FLAG_FACE
+    if eyes.get('closed'):
+        flags |= FLAG_EYES_CLOSED
+    return (flags, _value(head_pose.get('yaw')), _value(head_pose.get('pitch')),
+            _value(eyes.get('ear')), _value(eyes.get('closed_duration')))
+
+def pack_fields(seq, fields, keyframe=False, capture_time=None):
+    flags, yaw, pitch, ear, closed_duration = fields
+    if keyframe:
+        flags |= FLAG_KEYFRAME
+    packet = RESULT_STRUCT.pack(seq & 0xFFFFFFFF, flags, yaw, pitch, ear, closed_duration)
+    if capture_time is not None:
+        packet += CAPTURE_TIME_STRUCT.pack(capture_time)
+    return packet
+
+def pack_result(seq, distracted, reason, keyframe=False):
+    """把 is_distracted 的结果打包为二进制"""
+    return pack_fields(seq, result_fields(distracted, reason), keyframe)
+
+# 叠加层包（小端，53 字节）：
+#     uint32 seq | uint8 flags | uint16 width | uint16 height | float32 yaw | float32[5][2] 关键点
+# 关键点依次为左眼外角、左眼内角、右眼内角、右眼外角、鼻尖（帧像素坐标）
+OVERLAY_STRUCT = struct.Struct('<IBHHf10f')
+OVERLAY_POINTS = 5
+
+def pack_overlay(seq, distracted, yaw, points, frame_shape):
+    """打包客户端绘制叠加层所需的数据；points 为 None 表示未检测到人脸"""
+    flags = FLAG_DISTRACTED if distracted else 0
+    if points is None:
+        coords = (0.0,) * (2 * OVERLAY_POINTS)
+    else:
+        flags |= FLAG_FACE
+        coords = tuple(float(v) for v in points.reshape(-1))
+    height, width = frame_shape[:2]
+    return OVERLAY_STRUCT.pack(seq & 0xFFFFFFFF, flags, width, height, _value(yaw), *coords)
+
+def unpack_result(data):
+    """解码为与 is_distracted 结果相同结构的字典；带采集时间的包另有 capture_time"""
+    seq, flags, yaw, pitch, ear, closed_duration = RESULT_STRUCT.unpack_from(data)
+    capture_time = None
+    if len(data) >= RESULT_STRUCT.size + CAPTURE_TIME_STRUCT.size:
+        capture_time, = CAPTURE_TIME_STRUCT.unpack_from(data, RESULT_STRUCT.size)
+    return {
+        'capture_time': capture_time,
+        'seq': seq,
+        'distracted': bool(flags & FLAG_DISTRACTED),
+        'keyframe': bool(flags & FLAG_KEYFRAME),
+        'reason': {
+            'head_pose': {'yaw': _optional(yaw), 'pitch': _optional(pitch)},
+            'eyes': {
+                'closed': bool(flags & FLAG_EYES_CLOSED) if flags & FLAG_FACE else None,
+                'closed_duration': _optional(closed_duration),
+                'ear': _optional(ear),
+            },
+        },
+    }